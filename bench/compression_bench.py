@@ -0,0 +1,53 @@
+## @file compression_bench.py
+#  @brief Benchmark: Bytes auf der Leitung und CPU-Kosten pro MB für zlib/lzma.
+#  @details Aufruf aus dem Projektverzeichnis: python -m bench.compression_bench [-s MB]
+#           Die "skip"-Spalte zeigt, ob worth_compressing() die Nutzlast übersprungen hätte.
+
+import argparse
+import os
+import time
+import random
+
+from core import compression
+
+## @brief Erzeugt Beispiel-Nutzlasten der Größe size.
+def samples(size):
+    rnd = random.Random(1)
+    words = ["Hallo", "Bob", "morgen", "Folien", "Vorlesung", "Betriebssysteme", "Rechnernetze",
+             "Abgabe", "Gruppe", "Prozess", "Socket", "Nachricht", "und", "die", "der", "das"]
+    text = " ".join(rnd.choice(words) for _ in range(size // 6)).encode()[:size]
+    # Unkomprimiertes Bild (BMP-artig): weiche Farbverläufe
+    row = bytes((x * 255 // 1024) for x in range(1024)) * 3
+    bitmap = b"BM" + b"".join(row[i % 97:] + row[:i % 97] for i in range(size // len(row) + 1))[:size - 2]
+    jpeg = b"\xff\xd8\xff\xe0" + os.urandom(size - 4)  # steht für bereits komprimierte Bilder
+    return {"Text": text, "Bitmap": bitmap, "JPEG": jpeg}
+
+## @brief Misst Kompression und Dekompression.
+#  @return (komprimierte Größe, ms/MB komprimieren, ms/MB entpacken)
+def measure(data, codec, level):
+    mb = len(data) / 1e6
+    t = time.process_time()
+    packed = compression.compress(data, codec, level)
+    c_ms = (time.process_time() - t) * 1000 / mb
+    t = time.process_time()
+    assert compression.decompress(packed, codec, len(data)) == data
+    d_ms = (time.process_time() - t) * 1000 / mb
+    return len(packed), c_ms, d_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-s", type=float, default=4, help="Größe je Nutzlast in MB")
+    args = parser.parse_args()
+    size = int(args.s * 1e6)
+
+    print(f"{'Nutzlast':<8} {'skip':>4} {'Codec':<7} {'Bytes':>10} {'Anteil':>7} {'enc ms/MB':>10} {'dec ms/MB':>10}")
+    for name, data in samples(size).items():
+        skip = "ja" if not compression.worth_compressing(data) else "nein"
+        print(f"{name:<8} {skip:>4} {'keiner':<7} {len(data):>10} {100:>6.1f}% {0:>10.1f} {0:>10.1f}")
+        for codec, level in ((compression.CAP_ZLIB, 1), (compression.CAP_ZLIB, 6), (compression.CAP_LZMA, 0)):
+            n, c_ms, d_ms = measure(data, codec, level)
+            label = f"{codec}-{level}"
+            print(f"{'':<8} {'':>4} {label:<7} {n:>10} {n / len(data) * 100:>6.1f}% {c_ms:>10.1f} {d_ms:>10.1f}")
+
+if __name__ == "__main__":
+    main()
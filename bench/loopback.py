@@ -0,0 +1,279 @@
+## @file loopback.py
+#  @brief Benchmark: Nachrichten- und Bilddurchsatz über Loopback.
+#  @details Startet N Knoten aus je einem Network- und Discovery-Prozess auf
+#           127.0.0.1 mit eigenen Ports, ohne CLI und GUI. Der Benchmark
+#           übernimmt die Rolle der Oberfläche und spricht die Knoten über ihre
+#           Queues an. Discovery läuft über eine Multicast-Gruppe auf der
+#           Loopback-Schnittstelle (Broadcast erreicht 127.0.0.1 nicht).
+#           Gemessen werden:
+#             - MSG-Round-Trip (p50/p99): A → B, B antwortet sofort an A
+#             - Dauerdurchsatz: A sendet so schnell wie möglich an B
+#             - Konvergenz: Zeit, bis alle N Teilnehmertabellen vollständig sind, einmal
+#               über WHO (WHO → KNOWNUSERS → WHO-Fenster → MEMBERS, enthält also
+#               who_window) und einmal über JOIN-Broadcasts
+#             - Bildübertragung per TCP und UDP in MB/s für mehrere Größen
+#           Ergebnis als JSON auf stdout oder in eine Datei (-o).
+#           Aufruf aus dem Projektverzeichnis: python -m bench.loopback [-n 2,4,8] [-o ergebnis.json]
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import tempfile
+import platform
+import threading
+import statistics
+from multiprocessing import Process, Queue
+
+from core.network import Network
+from core.discovery import Discovery
+from core.peer_table import PeerTable
+from core.image_handler import send_image
+
+LOCALHOST = "127.0.0.1"
+
+# Ausgaben der Knoten auf stderr, damit stdout nur das JSON enthält
+def _run_network(*args):
+    sys.stdout = sys.stderr
+    Network(*args).run()
+
+def _run_discovery(*args, **kwargs):
+    sys.stdout = sys.stderr
+    Discovery(*args, **kwargs).run()
+
+## @class Node
+#  @brief Ein Teilnehmer aus Network- und Discovery-Prozess.
+class Node:
+    ## @brief Konstruktor; startet beide Prozesse.
+    #  @param handle Name des Teilnehmers
+    #  @param port UDP-Port (TCP-Bildserver auf port + 100)
+    #  @param config Gemeinsame Konfiguration aller Knoten
+    #  @param workdir Verzeichnis für Bilder und Verlauf dieses Knotens
+    def __init__(self, handle, port, config, workdir):
+        self.handle = handle
+        self.port = port
+        self.config = {**config, "handle": handle, "port": port,
+                       "imagepath": os.path.join(workdir, handle)}
+        self.to_net, self.from_net = Queue(), Queue()
+        self.to_disc, self.from_disc = Queue(), Queue()
+        self.net_lookup, self.ui_lookup = Queue(), Queue()
+        self.table = PeerTable.create(config.get("peer_table_size", 4096))
+        self.waiters = []   # (Prädikat, Queue) für eingehende Zeilen
+        self._lock = threading.Lock()
+        self.procs = [
+            Process(target=_run_discovery, name=f"Discovery-{handle}",
+                    args=(self.to_disc, self.from_disc, self.config["imagepath"]),
+                    kwargs={"reply_queues": {"net": self.net_lookup, "ui": self.ui_lookup},
+                            "config": self.config, "peer_table": self.table}, daemon=True),
+            Process(target=_run_network, name=f"Network-{handle}",
+                    args=(handle, port, self.to_net, self.from_net, self.to_disc, self.from_disc,
+                          self.config, self.net_lookup, self.table), daemon=True),
+        ]
+        for p in self.procs:
+            p.start()
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        while True:
+            line = self.from_net.get()
+            if not isinstance(line, str):
+                continue
+            now = time.perf_counter()
+            with self._lock:
+                waiters = list(self.waiters)
+            for match, q in waiters:
+                if match(line):
+                    q.put((now, line))
+
+    ## @brief Meldet alle Zeilen, auf die match zutrifft, an eine Queue.
+    #  @return Queue mit (Zeitpunkt, Zeile)
+    def watch(self, match):
+        q = queue.Queue()
+        with self._lock:
+            self.waiters.append((match, q))
+        return q
+
+    ## @brief Sendet eine Nachricht an einen anderen Knoten.
+    def send_msg(self, other, text):
+        self.to_net.put(["MSG", self.handle, other.handle, text, LOCALHOST, other.port])
+
+    ## @brief Beendet die Prozesse und gibt die Tabelle frei.
+    def stop(self):
+        for p in self.procs:
+            p.terminate()
+        for p in self.procs:
+            p.join(2)
+        self.table.close()
+
+## @brief Startet n Knoten und wartet, bis ihre Hauptschleifen laufen.
+def start_nodes(n, config, workdir, base_port):
+    nodes = [Node(f"bench{i}", base_port + i, config, workdir) for i in range(n)]
+    for node in nodes:
+        ready = node.watch(lambda line: line.startswith("[Network]") and "Datagramme" in line)
+        deadline = time.monotonic() + 30
+        while True:
+            node.to_net.put(["STATS", node.handle])
+            try:
+                ready.get(timeout=0.2)
+                break
+            except queue.Empty:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{node.handle} startet nicht")
+    return nodes
+
+## @brief Alle Knoten senden JOIN; gemessen wird, bis jede Tabelle alle Knoten enthält.
+#  @return Sekunden bis zur Konvergenz
+def join_all(nodes, timeout=30.0):
+    t0 = time.perf_counter()
+    for node in nodes:
+        node.to_net.put(["JOIN", node.handle, LOCALHOST, node.port])
+    want = {node.handle for node in nodes}
+    pending = list(nodes)
+    while pending:
+        pending = [node for node in pending if not want <= node.table.snapshot().keys()]
+        if time.perf_counter() - t0 > timeout:
+            raise RuntimeError(f"Keine Konvergenz nach {timeout} s: {[n.handle for n in pending]}")
+        time.sleep(0.001)
+    return time.perf_counter() - t0
+
+## @brief Alle Knoten senden WHO; gemessen wird, bis jede Tabelle alle anderen Knoten enthält.
+#  @details Frisch gestartete Knoten ohne JOIN; WHO selbst trägt keine Adresse,
+#           daher lernt jeder Knoten nur die anderen aus deren KNOWNUSERS-Antworten.
+#  @return Sekunden bis zur Konvergenz
+def who_all(nodes, timeout=30.0):
+    t0 = time.perf_counter()
+    for node in nodes:
+        node.to_net.put(["WHO", node.handle])
+    handles = {node.handle for node in nodes}
+    pending = list(nodes)
+    while pending:
+        pending = [node for node in pending if not handles - {node.handle} <= node.table.snapshot().keys()]
+        if time.perf_counter() - t0 > timeout:
+            raise RuntimeError(f"Keine WHO-Konvergenz nach {timeout} s: {[n.handle for n in pending]}")
+        time.sleep(0.001)
+    return time.perf_counter() - t0
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+## @brief Round-Trip A → B → A; B antwortet aus dem Benchmark heraus sofort.
+#  @return Dictionary mit p50/p99/mean in Millisekunden
+def bench_rtt(a, b, count):
+    pings = b.watch(lambda line: line.startswith(f"[{a.handle}] rtt-"))
+    pongs = a.watch(lambda line: line.startswith(f"[{b.handle}] pong-"))
+
+    def responder():
+        for _ in range(count):
+            _, line = pings.get()
+            b.send_msg(a, "pong-" + line.split("rtt-", 1)[1])
+    threading.Thread(target=responder, daemon=True).start()
+
+    samples = []
+    for seq in range(count):
+        t = time.perf_counter()
+        a.send_msg(b, f"rtt-{seq}")
+        now, _ = pongs.get(timeout=5)
+        samples.append((now - t) * 1000)
+    return {"count": count, "p50_ms": _percentile(samples, 50), "p99_ms": _percentile(samples, 99),
+            "mean_ms": statistics.fmean(samples)}
+
+## @brief Sendet count Nachrichten ohne Pause und zählt, was ankommt.
+#  @return Dictionary mit gesendeten/empfangenen Nachrichten und Nachrichten pro Sekunde
+def bench_throughput(a, b, count, settle=2.0):
+    got = b.watch(lambda line: line.startswith(f"[{a.handle}] tp-"))
+    t0 = time.perf_counter()
+    for seq in range(count):
+        a.send_msg(b, f"tp-{seq}")
+    received, last = 0, t0
+    while received < count:
+        try:
+            last, _ = got.get(timeout=settle)
+        except queue.Empty:
+            break
+        received += 1
+    elapsed = last - t0
+    return {"sent": count, "received": received, "seconds": elapsed,
+            "msgs_per_s": received / elapsed if elapsed > 0 else 0.0}
+
+## @brief Überträgt Bilder verschiedener Größe per TCP und UDP.
+#  @param sizes Größen in Bytes
+#  @return Liste von Dictionaries je Größe und Transport
+def bench_images(a, b, sizes, workdir, timeout=120.0):
+    results = []
+    received = b.watch(lambda line: line.startswith(f"[{a.handle}] Bild erhalten"))
+    for size in sizes:
+        for transport in ("tcp", "udp"):
+            # Zufallsinhalt je Lauf, sonst greift die Deduplizierung des Bildspeichers
+            path = os.path.join(workdir, f"bench-{transport}-{size}.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            t0 = time.perf_counter()
+            if transport == "tcp":
+                send_image(LOCALHOST, b.port + 100, a.handle, path, timeout=timeout)
+            else:
+                a.to_net.put(["IMG", a.handle, b.handle, path, LOCALHOST, b.port])
+            done, _ = received.get(timeout=timeout)
+            seconds = done - t0
+            results.append({"transport": transport, "bytes": size, "seconds": seconds,
+                            "mb_per_s": size / 1e6 / seconds})
+            os.unlink(path)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback-Benchmark für Network/Discovery")
+    parser.add_argument("-n", default="2,4,8", help="Knotenzahlen für die Konvergenzmessung")
+    parser.add_argument("--pings", type=int, default=500, help="Anzahl Round-Trips")
+    parser.add_argument("--messages", type=int, default=20000, help="Nachrichten für den Durchsatz")
+    parser.add_argument("--sizes", default="0.1,1,10", help="Bildgrößen in MB")
+    parser.add_argument("--port", type=int, default=47000, help="Erster UDP-Port der Knoten")
+    parser.add_argument("--whoisport", type=int, default=4799)
+    parser.add_argument("--group", default="239.255.42.99", help="Multicast-Gruppe für Discovery")
+    parser.add_argument("--who-window", type=float, default=0.3, help="Sammelfenster für WHO-Antworten in Sekunden")
+    parser.add_argument("-o", help="JSON-Datei statt stdout")
+    args = parser.parse_args()
+
+    config = {"whoisport": args.whoisport, "local_ip": LOCALHOST, "multicast_group": args.group,
+              "multicast_interface": LOCALHOST, "open_images": False, "image_fsync": False,
+              "history": False, "autoreply": "", "who_window": args.who_window}
+    report = {"timestamp": time.time(), "python": platform.python_version(), "platform": platform.platform(),
+              "config": config, "convergence": []}
+
+    with tempfile.TemporaryDirectory(prefix="bsrn-bench-") as workdir:
+        for n in sorted(int(x) for x in args.n.split(",")):
+            result = {"nodes": n}
+            for key, measure in (("who_seconds", who_all), ("join_seconds", join_all)):
+                nodes = start_nodes(n, config, workdir, args.port)   # frische Tabellen je Messung
+                try:
+                    result[key] = measure(nodes)
+                finally:
+                    for node in nodes:
+                        node.stop()
+            report["convergence"].append(result)
+            print(f"[Bench] Konvergenz mit {n} Knoten gemessen", file=sys.stderr)
+
+        a, b = start_nodes(2, config, workdir, args.port)
+        try:
+            join_all([a, b])
+            report["rtt"] = bench_rtt(a, b, args.pings)
+            print("[Bench] Round-Trip gemessen", file=sys.stderr)
+            report["throughput"] = bench_throughput(a, b, args.messages)
+            print("[Bench] Durchsatz gemessen", file=sys.stderr)
+            sizes = [int(float(s) * 1e6) for s in args.sizes.split(",")]
+            report["images"] = bench_images(a, b, sizes, workdir)
+            print("[Bench] Bildübertragung gemessen", file=sys.stderr)
+        finally:
+            a.stop()
+            b.stop()
+
+    text = json.dumps(report, indent=2)
+    if args.o:
+        with open(args.o, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
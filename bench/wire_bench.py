@@ -0,0 +1,44 @@
+## @file wire_bench.py
+#  @brief Micro-Benchmark: Kodieren/Dekodieren von SLCP-Paketen als JSON und binär.
+#  @details Aufruf aus dem Projektverzeichnis: python -m bench.wire_bench [-n ANZAHL]
+
+import argparse
+import os
+import timeit
+import uuid
+
+from core import wire
+
+## @var SAMPLES
+#  @brief Typische Pakete je Befehl
+SAMPLES = {
+    "JOIN": ["JOIN", "alice", "192.168.178.23", 5001, wire.CAP_BINARY],
+    "LEAVE": ["LEAVE", "alice"],
+    "WHO": ["WHO", "alice"],
+    "MSG": ["MSG", "alice", "bob", "Hallo Bob, hast du die Folien für morgen schon fertig?"],
+    "KNOWNUSERS": ["KNOWNUSERS", "alice 192.168.178.23 5001", wire.CAP_BINARY],
+    "IMG_CHUNK": ["IMG_CHUNK", uuid.uuid4().hex, 17, 4096, os.urandom(1024)],
+}
+
+## @brief Misst die mittlere Zeit pro Aufruf in Mikrosekunden.
+def per_call_us(fn, n):
+    return min(timeit.repeat(fn, number=n, repeat=3)) / n * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=20000, help="Aufrufe pro Messung")
+    args = parser.parse_args()
+
+    print(f"{'Paket':<11} {'JSON B':>7} {'Bin B':>6} {'JSON enc':>9} {'Bin enc':>8} {'JSON dec':>9} {'Bin dec':>8}  (µs)")
+    for name, cmd in SAMPLES.items():
+        js = wire.encode_json(cmd)
+        bn = wire.encode_binary(cmd)
+        assert wire.decode(bn) == cmd
+        print(f"{name:<11} {len(js):>7} {len(bn):>6} "
+              f"{per_call_us(lambda: wire.encode_json(cmd), args.n):>9.2f} "
+              f"{per_call_us(lambda: wire.encode_binary(cmd), args.n):>8.2f} "
+              f"{per_call_us(lambda: wire.decode(js), args.n):>9.2f} "
+              f"{per_call_us(lambda: wire.decode(bn), args.n):>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,12 @@
 #  @brief Benutzeroberfläche (CLI) für den BSRN-Chat.
 #  @details Nimmt Eingaben entgegen und steuert die Kommunikation mit Network und Discovery.
 
-from prompt_toolkit import PromptSession
-from prompt_toolkit.patch_stdout import patch_stdout
 import threading
-import sys
-import socket
-import base64
-import re
-from core.image_handler import load_image_as_bytes
-import uuid
-from core.image_handler import chunk_image_data
+from core.image_handler import send_image, HAVE
+from core.lookup import PeerLookup
+from core.history import HistoryReader, history_path, format_row
+from core.renderer import OutputRenderer
+from core.netinfo import local_ip
 import os
 
 ## @class CLI
@@ -25,7 +21,9 @@ class CLI:
     #  @param from_net Queue von Network
     #  @param from_disc Queue von Discovery
     #  @param config Konfiguration
-    def __init__(self, username, to_net, to_disc, from_net, from_disc, config):
+    #  @param lookup_q Eigener Antwortkanal für Adressabfragen bei Discovery
+    #  @param peer_table Teilnehmertabelle von Discovery im Shared Memory
+    def __init__(self, username, to_net, to_disc, from_net, from_disc, config, lookup_q=None, peer_table=None):
         ## @var self.username
         #  @brief Benutzername
         self.username  = username
@@ -50,34 +48,62 @@ class CLI:
         #  @brief Konfigurationsdaten
         self.config    = config
 
+        ## @var self.lookup_q
+        #  @brief Antwortkanal für Adressabfragen
+        self.lookup_q  = lookup_q if lookup_q is not None else from_disc
+
+        ## @var self.peer_table
+        #  @brief Teilnehmertabelle im Shared Memory (optional)
+        self.peer_table = peer_table
+
+        ## @var self.history
+        #  @brief Lesezugriff auf den Nachrichtenverlauf
+        self.history = HistoryReader(history_path(config))
+
+        ## @var self.renderer
+        #  @brief Gibt eingehende Nachrichten gebündelt aus
+        self.renderer = OutputRenderer(username, config.get("output_interval", 0.05))
+
         print(f"[CLI] gestartet für {self.username}")
         print(f"Autoreply: \"{self.config.get('autoreply','')}\"")
         print("Verfügbare Befehle:")
-        print("  MSG <name> <text>")
+        print("  MSG <name>[,<name>…|*] <text>")
         print("  IMG <name> <pfad>")
         print("  JOIN [<name> <ip> <port>]")
         print("  WHO")
+        print("  CACHE")
+        print("  STATS")
+        print("  HISTORY <name> [n]")
+        print("  SEARCH <text>")
         print("  LEAVE")
         print("  HELP\n")
 
     ## @brief Startet die CLI-Eingabeschleife
-    def run(self):
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-        except:
-            ip = "127.0.0.1"
+    #  @param on_ready Callback, sobald die Eingabezeile erscheint (für --startup-profile), optional
+    def run(self, on_ready=None):
+        # prompt_toolkit erst hier laden, damit der Start bis zur Auswahl schnell bleibt
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.patch_stdout import patch_stdout
+
+        ip = local_ip(self.config)
         port = self.config.get("port", 5000)
 
         self.to_net.put(["JOIN", self.username, ip, port])
 
+        ## @var self.lookup
+        #  @brief Korrelierte Adressabfrage bei Discovery
+        self.lookup = PeerLookup(self.to_disc, self.lookup_q, "ui", self.username,
+                                 self.config.get("lookup_timeout", 2.0),
+                                 self.config.get("peer_cache_ttl", 60.0),
+                                 self.peer_table)
+
         session = PromptSession(f"[{self.username}]> ")
 
         threading.Thread(target=self._network_listener, daemon=True).start()
 
         with patch_stdout():
+            if on_ready:
+                on_ready()
             while True:
                 try:
                     text = session.prompt()
@@ -90,128 +116,144 @@ class CLI:
                 cmd = parts[0].upper() if parts else ""
 
                 if cmd == "MSG" and len(parts) >= 3:
-                    # 1. IP/Port vom Discovery holen
+                    # IP/Port asynchron vom Discovery holen, gesendet wird im Callback
                     target, msg_text = parts[1], " ".join(parts[2:])
-                    self.to_disc.put(["GET_QUEUE", self.username, target])
-                    found = None
-                    while True:
-                        resp = self.from_disc.get()
-                        if isinstance(resp, list) and resp and resp[0] == "FOUND" and resp[1] == target:
-                            found = resp
-                            break
-                        elif isinstance(resp, list) and resp and resp[0] == "NOT_FOUND" and resp[1] == target:
-                            found = None
-                            break
-
-                    if not found:
-                        print(f"❌ Nutzer '{target}' nicht gefunden.")
+                    if target == "*" or "," in target:
+                        # Gruppe: eine Abfrage für alle Empfänger, Network sendet alle auf einmal
+                        targets = "*" if target == "*" else [t for t in target.split(",") if t]
+                        fut = self.lookup.lookup_many(targets)
+                        fut.add_done_callback(lambda f, t=target, m=msg_text: self._send_msg_multi(t, m, f))
                         continue
-
-                    ip = found[2]
-                    port = found[3]
-                    self.to_net.put(["MSG", self.username, target, msg_text, ip, port])
+                    fut = self.lookup.lookup(target)
+                    fut.add_done_callback(lambda f, t=target, m=msg_text: self._send_msg(t, m, f))
 
                 elif cmd == "IMG" and len(parts) >= 3:
+                    # Adressabfrage und TCP-Versand laufen im Hintergrund
                     target, path = parts[1], " ".join(parts[2:])
-                    img_bytes = load_image_as_bytes(path)
-                    if img_bytes is None:
-                        print(f"❌ Fehler: Bilddatei '{path}' konnte nicht geladen werden.")
-                        continue
-
-                    img_b64 = base64.b64encode(img_bytes).decode('ascii')
-                    filename = os.path.basename(path)
-
-                    # Hole IP/Port vom Ziel
-                    self.to_disc.put(["GET_QUEUE", self.username, target])
-                    found = None
-                    while True:
-                        resp = self.from_disc.get()
-                        if isinstance(resp, list) and resp and resp[0] == "FOUND" and resp[1] == target:
-                            found = resp
-                            break
-                        elif isinstance(resp, list) and resp and resp[0] == "NOT_FOUND" and resp[1] == target:
-                            found = None
-                            break
-
-                    if not found:
-                        print(f"❌ Nutzer '{target}' nicht gefunden.")
-                        continue
-
-                    ip = found[2]
-                    port = found[3]
-
-                    # TCP-Versand: direkter JSON-Block
-                    import json
-                    payload = json.dumps([self.username, filename, img_b64]).encode()
-                    try:
-                        with socket.create_connection((ip, port + 100), timeout=5) as sock:
-                            print(f"[TCP-Client] Sende an {ip}:{port + 100}")
-                            sock.sendall(payload)
-                            print(f"[TCP] Bild erfolgreich an {target} gesendet.")
-                    except Exception as e:
-                        print(f"[TCP Fehler] Bildversand an {target} fehlgeschlagen: {e}")
+                    fut = self.lookup.lookup(target)
+                    threading.Thread(target=self._send_img, args=(target, path, fut), daemon=True).start()
                     continue
 
                 elif cmd == "JOIN":
                     if len(parts) == 1:
                         self.to_net.put(["JOIN", self.username, ip, port])
-                    elif len(parts) == 4:
+                    elif len(parts) == 4 and parts[3].isdigit() and 0 < int(parts[3]) < 65536:
                         _, h, ipa, pstr = parts
-                        self.to_net.put(["JOIN", h, ipa, pstr])
+                        self.to_net.put(["JOIN", h, ipa, int(pstr)])
                     else:
                         print("❌ Ungültiger JOIN-Befehl. Syntax: JOIN [<name> <ip> <port>]")
 
                 elif cmd == "WHO":
                     self.to_net.put(["WHO", self.username])
 
+                elif cmd == "CACHE":
+                    st = self.lookup.cache.stats()
+                    print(f"Adress-Cache: {st['hits']} Treffer, {st['misses']} Fehlschläge, "
+                          f"{st['entries']} Einträge (Version {st['version']})")
+                    if self.peer_table is not None:
+                        print(f"Shared-Memory-Tabelle: {self.lookup.table_hits} Treffer")
+
+                elif cmd == "STATS":
+                    # Network und Discovery antworten mit ihren Kennzahlen
+                    self.to_net.put(["STATS", self.username])
+
+                elif cmd == "HISTORY" and len(parts) >= 2:
+                    limit = int(parts[2]) if len(parts) >= 3 and parts[2].isdigit() else 20
+                    rows = self.history.recent(parts[1], limit)
+                    if not rows:
+                        print(f"Kein Verlauf mit '{parts[1]}'.")
+                    for row in rows:
+                        print(format_row(row))
+
+                elif cmd == "SEARCH" and len(parts) >= 2:
+                    rows = self.history.search(text.strip()[len("SEARCH"):].strip())
+                    if not rows:
+                        print("Keine Treffer.")
+                    for row in rows:
+                        print(format_row(row))
+
                 elif cmd == "LEAVE":
                     self.to_net.put(["LEAVE", self.username])
                     print("Verlasse den Chat…")
                     break
 
                 elif cmd == "HELP":
-                    print("Befehle: MSG, IMG, JOIN, WHO, LEAVE, HELP")
+                    print("Befehle: MSG, IMG, JOIN, WHO, CACHE, STATS, HISTORY, SEARCH, LEAVE, HELP")
 
                 else:
                     if cmd:
                         print("❌ Ungültiger Befehl.")
 
+    ## @brief Wertet das Ergebnis einer Adressabfrage aus.
+    #  @param target Gesuchtes Handle
+    #  @param fut Future der Adressabfrage
+    #  @return (IP, Port) oder None (Fehlermeldung wurde bereits ausgegeben)
+    def _lookup_result(self, target, fut):
+        try:
+            found = fut.result()
+        except TimeoutError:
+            print(f"❌ Keine Antwort von Discovery für '{target}'.")
+            return None
+        if not found:
+            print(f"❌ Nutzer '{target}' nicht gefunden.")
+        return found
+
+    ## @brief Sendet eine Textnachricht nach erfolgreicher Adressabfrage.
+    #  @param target Empfänger
+    #  @param msg_text Nachrichtentext
+    #  @param fut Future der Adressabfrage
+    def _send_msg(self, target, msg_text, fut):
+        found = self._lookup_result(target, fut)
+        if found:
+            ip, port = found
+            self.to_net.put(["MSG", self.username, target, msg_text, ip, port])
+
+    ## @brief Sendet eine Textnachricht an mehrere Empfänger.
+    #  @param label Empfängerangabe wie eingegeben ("a,b,c" oder "*")
+    #  @param msg_text Nachrichtentext
+    #  @param fut Future von lookup_many
+    def _send_msg_multi(self, label, msg_text, fut):
+        try:
+            found = fut.result()
+        except TimeoutError:
+            print(f"❌ Keine Antwort von Discovery für '{label}'.")
+            return
+        recipients = [[h, addr[0], addr[1]] for h, addr in found.items() if addr and h != self.username]
+        unknown = [h for h, addr in found.items() if not addr]
+        if not recipients:
+            print(f"❌ Keine Empfänger für '{label}' gefunden.")
+            return
+        self.to_net.put(["MSG_MULTI", self.username, label, msg_text, recipients, unknown])
+
+    ## @brief Lädt ein Bild und sendet es per TCP an den Empfänger.
+    #  @param target Empfänger
+    #  @param path Pfad zur Bilddatei
+    #  @param fut Future der Adressabfrage
+    def _send_img(self, target, path, fut):
+        if not os.path.isfile(path):
+            print(f"❌ Fehler: Bilddatei '{path}' konnte nicht geladen werden.")
+            return
+
+        found = self._lookup_result(target, fut)
+        if not found:
+            return
+        ip, port = found
+
+        # TCP-Versand: Header + rohe Bytes per sendfile
+        try:
+            print(f"[TCP-Client] Sende an {ip}:{port + 100}")
+            if send_image(ip, port + 100, self.username, path) == HAVE:
+                print(f"[TCP] {target} hat das Bild bereits – keine Übertragung nötig.")
+            else:
+                print(f"[TCP] Bild erfolgreich an {target} gesendet.")
+        except Exception as e:
+            print(f"[TCP Fehler] Bildversand an {target} fehlgeschlagen: {e} – versuche UDP")
+            self.to_net.put(["IMG", self.username, target, os.path.abspath(path), ip, port])
+
     ## @brief Gibt eingehende Nachrichten formatiert aus
     def _network_listener(self):
         """
-        Läuft im Hintergrund und gibt eingehende Nachrichten sofort aus.
+        Läuft im Hintergrund und gibt eingehende Nachrichten gebündelt aus.
         Behandelt alle Nachrichten, die über Network hereinkommen.
         """
-        while True:
-            msg = self.from_net.get()  # blockierend warten
-            if isinstance(msg, str):
-                m = re.match(r'^\[(.+)\] Bild erhalten: (.+)$', msg)
-                if m:
-                    print(msg)
-                    print(f"[Hinweis] Bild gespeichert unter: {m.group(2)}")
-                    continue
-                if msg.startswith(f"[{self.username}]"):
-                    continue
-            # Formatierte Ausgabe für KNOWNUSERS
-            if isinstance(msg, str) and msg.startswith("KNOWNUSERS "):
-                from prettytable import PrettyTable
-                users_str = msg[len("KNOWNUSERS "):]
-                entries = users_str.split(", ")
-                user_data = []
-                for entry in entries:
-                    parts = entry.strip().split(" ")
-                    if len(parts) == 3:
-                        name, ip, port = parts
-                        if name == self.username:
-                            name += " 🟢 Du"
-                        user_data.append((name, ip, port))
-                user_data.sort(key=lambda x: x[0].lower())
-                t = PrettyTable(['Name', 'IP', 'Port'])
-                for row in user_data:
-                    t.add_row(row)
-                print("Bekannte Teilnehmer:")
-                print(t)
-            elif isinstance(msg, list) and msg and msg[0] == "KNOWNUSERS":
-                continue
-            else:
-                print(msg)
\ No newline at end of file
+        self.renderer.run(self.from_net)
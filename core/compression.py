@@ -0,0 +1,105 @@
+## @file compression.py
+#  @brief Optionale Kompression von Nutzdaten mit zlib oder lzma.
+#  @details Die Codecs werden wie das Binärformat per Capability ausgehandelt
+#           (JOIN/KNOWNUSERS bzw. Antwort des Bildservers). Komprimiert wird nur
+#           oberhalb einer Mindestgröße und nur, wenn es sich lohnt: bereits
+#           komprimierte Formate (JPEG, PNG, GIF, WebP, ZIP, …) werden an ihrer
+#           Signatur erkannt und übersprungen, alles andere wird zuerst an einer
+#           Stichprobe getestet.
+
+import zlib
+import lzma
+
+## @var CAP_ZLIB
+#  @brief Capability-Kennung für zlib
+CAP_ZLIB = "zlib"
+
+## @var CAP_LZMA
+#  @brief Capability-Kennung für lzma
+CAP_LZMA = "lzma"
+
+## @var CODECS
+#  @brief Unterstützte Codecs in der Reihenfolge der Bevorzugung
+CODECS = (CAP_ZLIB, CAP_LZMA)
+
+## @var SAMPLE_SIZE
+#  @brief Größe der Stichprobe für den Kompressionstest
+SAMPLE_SIZE = 64 * 1024
+
+## @var MIN_SAVING
+#  @brief Mindestens so viel muss die Stichprobe schrumpfen (Anteil)
+MIN_SAVING = 0.1
+
+# Signaturen von Formaten, die sich nicht weiter komprimieren lassen
+_COMPRESSED_MAGIC = (
+    b"\xff\xd8\xff",          # JPEG
+    b"\x89PNG\r\n\x1a\n",     # PNG
+    b"GIF87a", b"GIF89a",     # GIF
+    b"PK\x03\x04",            # ZIP
+    b"\x1f\x8b",              # gzip
+    b"\xfd7zXZ\x00",          # xz
+    b"BZh",                   # bzip2
+)
+
+## @brief Wählt den bevorzugten gemeinsamen Codec.
+#  @param own Eigene Codecs (Reihenfolge = Vorliebe)
+#  @param peer Vom Gegenüber angebotene Capabilities
+#  @return Codec-Name oder None
+def choose(own, peer):
+    for codec in own:
+        if codec in peer:
+            return codec
+    return None
+
+## @brief Prüft an Signatur und Stichprobe, ob sich Kompression lohnt.
+#  @param head Anfang der Daten (mindestens ein paar KB für die Stichprobe)
+#  @return True, wenn komprimiert werden sollte
+def worth_compressing(head):
+    head = bytes(head[:SAMPLE_SIZE])
+    if head.startswith(_COMPRESSED_MAGIC) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP"):
+        return False
+    if len(head) < 64:
+        return False
+    return len(zlib.compress(head, 1)) <= len(head) * (1 - MIN_SAVING)
+
+## @brief Liefert einen Streaming-Kompressor.
+#  @param codec CAP_ZLIB oder CAP_LZMA
+#  @param level Stufe (zlib 1–9, lzma 0–9)
+#  @return Objekt mit compress(data) und flush()
+def compressor(codec, level=6):
+    if codec == CAP_ZLIB:
+        return zlib.compressobj(level)
+    if codec == CAP_LZMA:
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError(f"Unbekannter Codec: {codec}")
+
+## @brief Liefert einen Streaming-Dekompressor.
+#  @param codec CAP_ZLIB oder CAP_LZMA
+#  @return Objekt mit decompress(data, max_length)
+def decompressor(codec):
+    if codec == CAP_ZLIB:
+        return zlib.decompressobj()
+    if codec == CAP_LZMA:
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unbekannter Codec: {codec}")
+
+## @brief Komprimiert einen Block vollständig.
+def compress(data, codec, level=6):
+    c = compressor(codec, level)
+    return c.compress(data) + c.flush()
+
+## @brief Entpackt einen Block mit Obergrenze (Schutz vor Kompressionsbomben).
+#  @param data Komprimierte Daten
+#  @param codec CAP_ZLIB oder CAP_LZMA
+#  @param max_size Maximale entpackte Größe in Bytes
+#  @return bytes
+#  @throws ValueError bei ungültigen Daten oder Überschreiten von max_size
+def decompress(data, codec, max_size):
+    d = decompressor(codec)
+    try:
+        out = d.decompress(data, max_size + 1)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"Ungültige {codec}-Daten: {e}") from None
+    if len(out) > max_size:
+        raise ValueError(f"Entpackte Daten größer als {max_size} Bytes")
+    return out
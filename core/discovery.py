@@ -2,11 +2,15 @@
 #  @brief Discovery-Modul für den BSRN-Chat
 #  @details Verwaltung von Chat-Teilnehmern, Nachrichten und Bildempfang via IPC.
 
+import os
 import time
+import queue
+import heapq
 from multiprocessing import current_process
-from core.image_handler import save_and_open_image
-import base64
-import json
+from core.image_handler import ImageWriter, ImageViewer
+from core.image_store import ImageStore, store_root
+from core.history import HistoryWriter, history_path
+from core.metrics import Metrics, MetricsDump
 
 ## @class Discovery
 #  @brief Verarbeitet JOIN/LEAVE/WHO/MSG/IMG Kommandos von Teilnehmern.
@@ -16,7 +20,10 @@ class Discovery:
     #  @param in_queue Queue für eingehende Nachrichten
     #  @param out_queue Queue für Ausgaben an CLI
     #  @param imagepath Pfad zum Speichern empfangener Bilder
-    def __init__(self, in_queue, out_queue, imagepath):
+    #  @param reply_queues Antwortkanäle für korrelierte Abfragen (Name → Queue)
+    #  @param config Konfigurationsdaten (z. B. peer_ttl), optional
+    #  @param peer_table Teilnehmertabelle im Shared Memory (PeerTable), optional
+    def __init__(self, in_queue, out_queue, imagepath, reply_queues=None, config=None, peer_table=None):
         ## @var self.in_q
         #  @brief Eingangs-Queue vom Network-Prozess
         self.in_q = in_queue
@@ -25,72 +32,417 @@ class Discovery:
         #  @brief Ausgangs-Queue zur CLI
         self.out_q = out_queue
 
+        ## @var self.reply_queues
+        #  @brief Antwortkanäle für GET_QUEUE-Anfragen mit Request-ID
+        self.reply_queues = reply_queues or {}
+
         ## @var self.participants
         #  @brief Bekannte Teilnehmer (handle → (IP, Port))
         self.participants = {}
 
+        ## @var self.peer_table
+        #  @brief Spiegel von participants im Shared Memory für Leser ohne IPC
+        self.peer_table = peer_table
+
+        config = config or {}
+
+        ## @var self.peer_ttl
+        #  @brief Sekunden ohne Lebenszeichen, nach denen ein Teilnehmer entfernt wird
+        #         (0, auch über heartbeat_interval = 0, schaltet das Entfernen ab)
+        self.peer_ttl = config.get("peer_ttl", 3.5 * config.get("heartbeat_interval", 10.0))
+
+        ## @var self.last_seen
+        #  @brief Letztes Lebenszeichen je Teilnehmer (handle → monotonic-Zeit)
+        self.last_seen = {}
+
+        ## @var self.heartbeating
+        #  @brief Teilnehmer, die HEARTBEAT senden; nur sie laufen nach peer_ttl ab,
+        #         alle anderen bleiben bis zu ihrem LEAVE
+        self.heartbeating = set()
+
+        self._expiry = []         # Heap aus (frühester Ablauf, handle), höchstens ein Eintrag je handle
+        self._scheduled = set()   # handles mit Eintrag im Heap
+
+        ## @var self.version
+        #  @brief Version der Teilnehmerliste, steigt mit jedem JOIN/LEAVE-Delta
+        self.version = 0
+
+        self._member_versions = {}  # Quelle → zuletzt angewendete MEMBERS-Version
+
         ## @var self.imagepath
         #  @brief Speicherort für empfangene Bilder
         self.imagepath = imagepath
 
-        ## @var self._incoming_chunks
-        #  @brief Zwischenspeicher für Bilddaten-Chunks
-        self._incoming_chunks = {}
+        ## @var self.image_store
+        #  @brief Inhaltsadressierter Bildspeicher unter imagepath/store (optional)
+        self.image_store = None
+        if config.get("image_store", True):
+            self.image_store = ImageStore(store_root(imagepath),
+                                          config.get("image_store_limit", 512 * 1024 * 1024))
+
+        ## @var self.image_writer
+        #  @brief Speichert Bilder und startet den Viewer im Hintergrund
+        self.image_writer = ImageWriter(imagepath,
+                                        ImageViewer(config.get("open_images", True),
+                                                    config.get("viewer_interval", 2.0)),
+                                        fsync=config.get("image_fsync", True),
+                                        store=self.image_store)
+
+        ## @var self.handle
+        #  @brief Eigenes Handle (unterscheidet gesendete von empfangenen Nachrichten)
+        self.handle = config.get("handle")
+
+        ## @var self.history
+        #  @brief Schreibt den Nachrichtenverlauf im Hintergrund (optional)
+        self.history = None
+        if config.get("history", True):
+            self.history = HistoryWriter(history_path({"imagepath": imagepath, **config}),
+                                         config.get("history_batch", 500),
+                                         config.get("history_flush_interval", 0.2))
+
+        ## @var self.processed_total
+        #  @brief Anzahl insgesamt verarbeiteter Nachrichten
+        self.processed_total = 0
+
+        ## @var self.processed_per_sec
+        #  @brief Verarbeitete Nachrichten pro Sekunde (letztes Messfenster)
+        self.processed_per_sec = 0.0
+
+        self._rate_start = time.monotonic()
+        self._rate_count = 0
+
+        ## @var self.metrics
+        #  @brief Laufzeitkennzahlen (Befehle, Dispatch-Latenz)
+        self.metrics = Metrics()
+        self._commands = self.metrics.group("commands")
+        self._dispatch_us = self.metrics.histogram("dispatch_us")
+
+        ## @var self.metrics_dump
+        #  @brief Periodische Ausgabe der Kennzahlen (Datei oder Unix-Socket), optional
+        self.metrics_dump = None
+        self.metrics_interval = config.get("metrics_interval", 10.0)
+        self._next_dump = None
+        if config.get("metrics_dump"):
+            self.metrics_dump = MetricsDump(config["metrics_dump"], "discovery")
+            self._next_dump = time.monotonic() + self.metrics_interval
+
+        ## @var self.handlers
+        #  @brief Dispatch-Tabelle: Befehl → Handler
+        self.handlers = {
+            "JOIN": self._on_join,
+            "MEMBERS": self._on_members,
+            "LEAVE": self._on_leave,
+            "WHO": self._on_who,
+            "MSG": self._on_msg,
+            "MSG_MULTI": self._on_msg_multi,
+            "IMG_FILE": self._on_img_file,
+            "GET_QUEUE": self._on_get_queue,
+            "GET_MANY": self._on_get_many,
+            "STATS": self._on_stats,
+            "HEARTBEAT": self._on_heartbeat,
+        }
 
     ## @brief Hauptschleife zur Verarbeitung von Nachrichten
+    #  @details Blockiert auf der Queue und arbeitet danach alle anstehenden
+    #           Nachrichten als Batch ab – ohne Polling und ohne Sleep.
     def run(self):
         print(f"[{current_process().name}] Discovery gestartet")
         while True:
-            if not self.in_q.empty():
-                msg = self.in_q.get()
-
-                if not isinstance(msg, list) or len(msg) < 2:
-                    self.out_q.put("[Discovery] Ungültiges Format.")
-                    continue
-
-                command = msg[0]
-                handle = msg[1]
-
-                if command == "JOIN" and len(msg) >= 4:
-                    handle, ip, port = msg[1], msg[2], msg[3]
-                    already_known = handle in self.participants and self.participants[handle] == (ip, port)
-                    self.participants[handle] = (ip, port)
-                    if not already_known:
-                        self.out_q.put(f"[System] {handle} ist dem Chat beigetreten.")
-
-                elif command == "LEAVE":
-                    if handle in self.participants:
-                        del self.participants[handle]
-                        self.out_q.put(f"[System] {handle} hat den Chat verlassen.")
-
-                elif command == "WHO":
-                    pass
-                
-                elif command == "MSG" and len(msg) >= 4:
-                    sender, target, text = msg[1], msg[2], msg[3]
-                
-                    self.out_q.put(f"[{sender}] {text}")
-
-                elif command == "IMG" and len(msg) >= 4:
-                    sender, target, img_b64 = msg[1], msg[2], msg[3]
-                    try:
-                        image_data = base64.b64decode(img_b64)
-                    except Exception as e:
-                        self.out_q.put(f"[⚠️ Fehler beim Dekodieren des Bildes] {e}")
-                        continue
-                    path = save_and_open_image(sender, image_data, self.imagepath)
-                    self.out_q.put(f"[{sender}] Bild erhalten: {path}")
-                    self.out_q.put(f"[Hinweis] Bild gespeichert unter: {path}")
-
-                elif command == "GET_QUEUE":
-                    target = msg[2]
-                    if target in self.participants:
-                        ip, port = self.participants[target]
-                        self.out_q.put(["FOUND", target, ip, port])
-                    else:
-                        self.out_q.put(["NOT_FOUND", target, None])
-
-            time.sleep(0.05)
+            batch = []
+            try:
+                batch.append(self.in_q.get(timeout=self._next_timeout()))
+                while True:
+                    batch.append(self.in_q.get_nowait())
+            except queue.Empty:
+                pass
+            clock = time.perf_counter
+            for msg in batch:
+                started = clock()
+                self.dispatch(msg)
+                self._dispatch_us.observe((clock() - started) * 1e6)
+            self._count_processed(len(batch))
+            try:
+                self._expire_stale()
+            except Exception as e:
+                self._handler_error(self._expire_stale, e)
+            if self._next_dump is not None and time.monotonic() >= self._next_dump:
+                self._next_dump = time.monotonic() + self.metrics_interval
+                self.metrics_dump.write(self.metrics_snapshot())
+
+    ## @brief Wartezeit bis zum nächsten Ablauf oder zur nächsten Kennzahlen-Ausgabe.
+    #  @return Sekunden oder None (unbegrenzt warten)
+    def _next_timeout(self):
+        timeout = self._next_expiry()
+        if self._next_dump is not None:
+            until_dump = max(self._next_dump - time.monotonic(), 0)
+            timeout = until_dump if timeout is None else min(timeout, until_dump)
+        return timeout
+
+    ## @brief Kennzahlen des Prozesses.
+    def metrics_snapshot(self):
+        self._count_processed(0)
+        extra = {"participants": len(self.participants), "processed_total": self.processed_total,
+                 "processed_per_sec": self.processed_per_sec}
+        if self.image_store is not None:
+            extra["image_store"] = self.image_store.stats()
+        if self.history is not None:
+            extra["history"] = {"written": self.history.written, "batches": self.history.batches}
+        return self.metrics.snapshot(extra)
+
+    ## @brief Sekunden bis zum nächsten möglichen Ablauf eines Teilnehmers.
+    #  @return Wartezeit oder None, wenn niemand ablaufen kann
+    def _next_expiry(self):
+        if not self._expiry:
+            return None
+        return max(self._expiry[0][0] - time.monotonic(), 0)
+
+    ## @brief Vermerkt ein Lebenszeichen eines Teilnehmers.
+    #  @param handle Teilnehmer
+    def _touch(self, handle):
+        now = time.monotonic()
+        self.last_seen[handle] = now
+        if handle in self.heartbeating and self.peer_ttl > 0 and handle not in self._scheduled:
+            self._scheduled.add(handle)
+            heapq.heappush(self._expiry, (now + self.peer_ttl, handle))
+
+    ## @brief Entfernt Teilnehmer, deren letztes Lebenszeichen älter als peer_ttl ist.
+    #  @details Ein Heap-Eintrag je Teilnehmer: Ist der Eintrag fällig, der
+    #           Teilnehmer aber inzwischen erneut gesehen worden, wird er mit der
+    #           neuen Frist wieder eingereiht – keine Suche über alle Teilnehmer.
+    def _expire_stale(self):
+        now = time.monotonic()
+        stale = []
+        while self._expiry and self._expiry[0][0] <= now:
+            _, handle = heapq.heappop(self._expiry)
+            seen = self.last_seen.get(handle)
+            if seen is None:
+                self._scheduled.discard(handle)
+            elif seen + self.peer_ttl > now:
+                heapq.heappush(self._expiry, (seen + self.peer_ttl, handle))
+            else:
+                self._scheduled.discard(handle)
+                stale.append(handle)
+        if stale:
+            self._apply_members({}, stale, reason=" (keine Lebenszeichen mehr)")
+
+    ## @brief Prüft, ob ein Teilnehmer noch als lebendig gilt.
+    def _is_alive(self, handle):
+        if handle not in self.heartbeating or self.peer_ttl <= 0:
+            return True
+        seen = self.last_seen.get(handle)
+        return seen is not None and time.monotonic() - seen < self.peer_ttl
+
+    ## @brief Leitet eine Nachricht an ihren Handler weiter.
+    #  @param msg Nachricht als Liste [Befehl, Handle, ...]
+    def dispatch(self, msg):
+        if not isinstance(msg, list) or len(msg) < 2:
+            self.out_q.put("[Discovery] Ungültiges Format.")
+            return
+        handler = self.handlers.get(msg[0])
+        if handler:
+            self._commands[msg[0]] += 1
+            try:
+                handler(msg)
+            except Exception as e:
+                self._handler_error(handler, e)
+
+    ## @brief Zählt und meldet eine Ausnahme aus einem Handler, statt den Prozess zu beenden.
+    #  @param handler Auslösender Handler
+    #  @param error Ausnahme
+    def _handler_error(self, handler, error):
+        self.metrics.counters["handler_errors"] += 1
+        print(f"[Discovery] Fehler in {getattr(handler, '__name__', handler)}: {error!r}")
+
+    ## @brief Aktualisiert den Durchsatzzähler.
+    #  @param n Anzahl gerade verarbeiteter Nachrichten
+    def _count_processed(self, n):
+        self.processed_total += n
+        self._rate_count += n
+        now = time.monotonic()
+        elapsed = now - self._rate_start
+        if elapsed >= 1.0:
+            self.processed_per_sec = self._rate_count / elapsed
+            self._rate_start = now
+            self._rate_count = 0
+
+    def _on_join(self, msg):
+        if len(msg) < 4:
+            return
+        self._apply_members({msg[1]: (msg[2], msg[3])}, [])
+
+    def _on_leave(self, msg):
+        self._apply_members({}, [msg[1]])
+
+    ## @brief Lebenszeichen eines Teilnehmers.
+    #  @details ["HEARTBEAT", handle, ip, port] trägt den Teilnehmer auch neu ein;
+    #           ["HEARTBEAT", handle] ohne Adresse erneuert nur einen bekannten Eintrag.
+    #           Ab dem ersten Heartbeat unterliegt der Teilnehmer der peer_ttl.
+    def _on_heartbeat(self, msg):
+        self.heartbeating.add(msg[1])
+        if len(msg) >= 4:
+            self._apply_members({msg[1]: (msg[2], msg[3])}, [])
+        elif msg[1] in self.participants:
+            self._touch(msg[1])
+
+    ## @brief Übernimmt ein Mitglieder-Delta von Network.
+    #  @param msg ["MEMBERS", quelle, version, {neu}, [entfernt], {geändert}]
+    def _on_members(self, msg):
+        if len(msg) < 6:
+            return
+        source, version = msg[1], msg[2]
+        if version <= self._member_versions.get(source, 0):
+            return  # veraltetes oder doppeltes Delta
+        self._member_versions[source] = version
+        upserts = dict(msg[3])
+        upserts.update(msg[5])
+        self._apply_members({h: tuple(addr) for h, addr in upserts.items()}, msg[4])
+
+    ## @brief Wendet Änderungen auf die Teilnehmerliste an und veröffentlicht ein Delta.
+    #  @param upserts Neue oder geänderte Einträge (handle → (IP, Port))
+    #  @param removed Entfernte Handles
+    #  @param reason Zusatz für die Austrittsmeldung
+    def _apply_members(self, upserts, removed, reason=""):
+        added, changed, gone = {}, {}, []
+        for handle, (ip, port) in upserts.items():
+            self._touch(handle)
+            old = self.participants.get(handle)
+            if old == (ip, port):
+                continue
+            self.participants[handle] = (ip, port)
+            if old is None:
+                added[handle] = [ip, port]
+                self.out_q.put(f"[System] {handle} ist dem Chat beigetreten.")
+            else:
+                changed[handle] = [ip, port]
+        for handle in removed:
+            self.last_seen.pop(handle, None)
+            self.heartbeating.discard(handle)
+            if self.participants.pop(handle, None) is not None:
+                gone.append(handle)
+                self.out_q.put(f"[System] {handle} hat den Chat verlassen{reason}.")
+        if added or changed or gone:
+            if self.peer_table is not None:
+                self.peer_table.update({**added, **changed}, gone)
+            self._publish(added, gone, changed)
+
+    ## @brief Schickt ein Teilnehmer-Delta an alle Antwortkanäle.
+    #  @details Hält die Adress-Caches in CLI, GUI und Network aktuell.
+    #  @param added Neue Einträge (handle → [IP, Port])
+    #  @param removed Entfernte Handles
+    #  @param changed Einträge mit neuer Adresse (handle → [IP, Port])
+    def _publish(self, added, removed, changed=None):
+        self.version += 1
+        for reply_q in self.reply_queues.values():
+            reply_q.put(["PEERS", self.version, added, removed, changed or {}])
+
+    def _on_who(self, msg):
+        pass
+
+    def _on_msg(self, msg):
+        if len(msg) < 4:
+            return
+        sender, target, text = msg[1], msg[2], msg[3]
+        if sender in self.participants:
+            self._touch(sender)
+        if self.history is not None:
+            self.history.record(target if sender == self.handle else sender, sender, target, text)
+        self.out_q.put(f"[{sender}] {text}")
+
+    ## @brief Eigene Nachricht an mehrere Empfänger.
+    #  @details ["MSG_MULTI", sender, bezeichnung, text, [handles]] – im Verlauf landet
+    #           eine Zeile je aufgelöstem Empfänger, damit HISTORY <name> sie findet.
+    def _on_msg_multi(self, msg):
+        if len(msg) < 5:
+            return
+        sender, label, text, recipients = msg[1], msg[2], msg[3], msg[4]
+        if self.history is not None:
+            now = time.time()
+            for handle in recipients:
+                self.history.record(handle, sender, label, text, now)
+        self.out_q.put(f"[{sender}] {text}")
+
+    ## @brief Übernimmt ein von Network gespooltes Bild.
+    #  @details ["IMG_FILE", sender, target, spoolpfad, größe, (dateiname), (sha256)] – die
+    #           Bilddaten liegen schon im Bildordner, über die Queue geht nur der Pfad.
+    #           Ohne Spoolpfad lag das Bild bereits im Speicher und wurde nicht übertragen.
+    #           Übernommen werden nur Spooldateien (.incoming_*) direkt im Bildordner.
+    def _on_img_file(self, msg):
+        if len(msg) < 5:
+            return
+        sender, tmp_path, size = msg[1], msg[3], msg[4]
+        if tmp_path is not None and not self._is_spool_file(tmp_path):
+            self.out_q.put(f"[Discovery] Bild von {sender} abgewiesen: kein Spoolpfad")
+            return
+        if sender in self.participants:
+            self._touch(sender)
+        filename = msg[5] if len(msg) >= 6 else None
+        digest = msg[6] if len(msg) >= 7 else None
+        def done(path, error):
+            if error:
+                self.out_q.put(f"[❌ Fehler beim Speichern des Bildes] {error}")
+            elif tmp_path is None:
+                self.out_q.put(f"[{sender}] Bild erhalten (bereits vorhanden): {path}")
+            else:
+                self.out_q.put(f"[{sender}] Bild erhalten: {path} ({size / 1024:.0f} KB)")
+        if tmp_path is None:
+            if digest:
+                self.image_writer.have(sender, digest, filename, on_done=done)
+            return
+        self.image_writer.adopt(sender, tmp_path, filename, on_done=done)
+
+    ## @brief Prüft, ob ein Pfad eine Spooldatei im Bildordner ist.
+    #  @param path Pfad aus IMG_FILE
+    #  @return True für <imagepath>/.incoming_*
+    def _is_spool_file(self, path):
+        if not isinstance(path, str):
+            return False
+        path = os.path.realpath(path)
+        return (os.path.basename(path).startswith(".incoming_")
+                and os.path.dirname(path) == os.path.realpath(self.imagepath))
 
+    ## @brief Beantwortet eine Adressabfrage.
+    #  @details ["GET_QUEUE", von, ziel, req_id, kanal] wird mit Request-ID an den
+    #           genannten Kanal beantwortet, die alte Form ohne ID an out_q.
+    def _on_get_queue(self, msg):
+        target = msg[2]
+        if len(msg) >= 5:
+            req_id = msg[3]
+            reply_q = self.reply_queues.get(msg[4], self.out_q)
+            tag = [req_id]
+        else:
+            reply_q = self.out_q
+            tag = []
+        if target in self.participants and not self._is_alive(target):
+            self._apply_members({}, [target], reason=" (keine Lebenszeichen mehr)")
+        if target in self.participants:
+            ip, port = self.participants[target]
+            reply_q.put(["FOUND", target, ip, port] + tag)
+        else:
+            reply_q.put(["NOT_FOUND", target, None] + tag)
 
+    ## @brief Beantwortet eine Adressabfrage für mehrere Empfänger auf einmal.
+    #  @details ["GET_MANY", von, [ziele] oder "*", req_id, kanal] →
+    #           ["FOUND_MANY", {handle: [ip, port] oder None}, req_id]
+    def _on_get_many(self, msg):
+        if len(msg) < 5:
+            return
+        targets = msg[2]
+        if targets == "*":
+            targets = [h for h in self.participants if h != msg[1]]
+        stale = [t for t in targets if t in self.participants and not self._is_alive(t)]
+        if stale:
+            self._apply_members({}, stale, reason=" (keine Lebenszeichen mehr)")
+        result = {}
+        for target in targets:
+            entry = self.participants.get(target)
+            result[target] = list(entry) if entry else None
+        self.reply_queues.get(msg[4], self.out_q).put(["FOUND_MANY", result, msg[3]])
 
+    ## @brief Meldet den Durchsatz und die Latenz des Dispatchers.
+    def _on_stats(self, msg):
+        self._count_processed(0)
+        lat = self._dispatch_us.snapshot()
+        self.out_q.put(f"[Discovery] {self.processed_per_sec:.1f} Nachrichten/s, "
+                       f"{self.processed_total} verarbeitet, {len(self.participants)} Teilnehmer\n"
+                       f"[Discovery] Dispatch-Latenz: p50 ≤ {lat['p50']:.0f} µs, p99 ≤ {lat['p99']:.0f} µs, "
+                       f"max {lat['max']:.0f} µs, Handlerfehler: {self.metrics.counters['handler_errors']}")
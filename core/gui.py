@@ -4,12 +4,14 @@
 #           Keine Logikänderungen – nur Benutzerschnittstelle.
 import tkinter as tk
 from tkinter.scrolledtext import ScrolledText
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, simpledialog
+import queue
 import threading
 from multiprocessing import current_process
 import os
-import socket
-import json
+from core.lookup import PeerLookup
+from core.image_handler import send_image, HAVE
+from core.history import HistoryReader, format_row
 
 ## @brief Extrahiert den Namen aus einer Systemzeile.
 #  @param msg_line Die Zeile, z. B. "[System] Alice ...".
@@ -24,13 +26,36 @@ def extract_username(msg_line: str) -> str:
 #           gesendet und empfangen werden können. Unterstützt auch Bildversand
 #           per TCP und WHO-Anfragen.
 class GUI:
-    def __init__(self, in_q, out_q, username, to_disc=None, from_disc=None):
+    ## @var ALL_RECIPIENTS
+    #  @brief Eintrag im Empfänger-Menü für eine Nachricht an alle
+    ALL_RECIPIENTS = "Alle"
+
+    ## @var MAX_LINES
+    #  @brief Höchstzahl Zeilen im Chat-Verlauf, ältere werden entfernt
+    MAX_LINES = 5000
+
+    ## @var PUMP_BATCH
+    #  @brief Höchstzahl Nachrichten, die pro Durchlauf der Pumpe angezeigt werden
+    PUMP_BATCH = 200
+
+    ## @var PUMP_INTERVAL
+    #  @brief Millisekunden zwischen zwei Durchläufen, wenn die Queue leer war
+    PUMP_INTERVAL = 50
+
+    def __init__(self, in_q, out_q, username, to_disc=None, from_disc=None, lookup_q=None, peer_table=None,
+                 history_db=None):
         self.in_q = in_q        
         self.out_q = out_q      
         self.username = username
         self.to_disc = to_disc      
         self.from_disc = from_disc  
         self.known_users = set()
+        self._menu_users = None      # zuletzt im Menü angezeigte Nutzer
+        self._users_dirty = False    # Menü beim nächsten Durchlauf der Pumpe neu aufbauen
+        self._dialogs = queue.Queue()  # (Titel, Text) aus Worker-Threads, angezeigt von der Pumpe
+        self.lookup = PeerLookup(to_disc, lookup_q if lookup_q is not None else from_disc, "ui", username,
+                                 peer_table=peer_table)
+        self.history = HistoryReader(history_db) if history_db else None
 
         self.root = tk.Tk()
         self.root.title(f"BSRN Chat – GUI ({self.username})")
@@ -58,17 +83,24 @@ class GUI:
         tk.Button(self.root, text="Bild senden", command=self.send_img).grid(row=2, column=4, pady=(0, 10))
         tk.Button(self.root, text="WHO", command=self.send_who).grid(row=3, column=4, sticky="e", pady=(0, 10))
         tk.Button(self.root, text="Verlassen", command=self.leave_chat, fg="red").grid(row=3, column=0, sticky="w", padx=10, pady=(0, 10))
+        tk.Button(self.root, text="Verlauf", command=self.show_history).grid(row=3, column=2, sticky="e", pady=(0, 10))
+        tk.Button(self.root, text="Suchen", command=self.search_history).grid(row=3, column=3, pady=(0, 10))
+        tk.Button(self.root, text="Statistik", command=self.send_stats).grid(row=3, column=1, sticky="w", pady=(0, 10))
 
         self.recipient_menu.config(state="disabled")
         self.entry.config(state="disabled")
 
-        threading.Thread(target=self.listen_for_messages, daemon=True).start()
-
         self.send_who()
 
         self.root.protocol("WM_DELETE_WINDOW", self.leave_chat)
 
+    ## @brief Startet die Pumpe für eingehende Nachrichten und den Tk-Mainloop.
+    #  @param on_ready Callback, sobald das Fenster bereit ist (für --startup-profile), optional
+    def run(self, on_ready=None):
         print(f"[{current_process().name}] GUI gestartet")
+        self.root.after(0, self.pump_messages)
+        if on_ready:
+            self.root.after_idle(on_ready)
         self.root.mainloop()
 
     ## @brief Sendet eine Textnachricht an den ausgewählten Empfänger.
@@ -83,99 +115,180 @@ class GUI:
             return
         print(f"Sende MSG an {target}: {text}")
 
-        self.to_disc.put(["GET_QUEUE", self.username, target])
-        found = None
-        while True:
-            resp = self.from_disc.get()
-            if isinstance(resp, list) and resp and resp[0] == "FOUND" and resp[1] == target:
-                found = resp
-                break
-            elif isinstance(resp, list) and resp and resp[0] == "NOT_FOUND" and resp[1] == target:
-                found = None
-                break
-
-        if not found:
-            messagebox.showerror("Fehler", f"Nutzer '{target}' nicht gefunden.")
+        if target == self.ALL_RECIPIENTS:
+            fut = self.lookup.lookup_many("*")
+            self.when_resolved(target, fut, lambda found: self.deliver_msg_multi(text, found), many=True)
             return
+        fut = self.lookup.lookup(target)
+        self.when_resolved(target, fut, lambda ip, port: self.deliver_msg(target, text, ip, port))
 
-        ip = found[2]
-        port = found[3]
+    ## @brief Übergibt eine Textnachricht mit bekannter Adresse an Network.
+    def deliver_msg(self, target, text, ip, port):
         self.in_q.put(["MSG", self.username, target, text, ip, port])
         self.append_chat_line(f"[Du → {target}]: {text}")
         self.entry.delete(0, tk.END)
 
+    ## @brief Übergibt eine Nachricht an alle gefundenen Teilnehmer an Network.
+    #  @param found Dictionary handle → (ip, port) oder None
+    def deliver_msg_multi(self, text, found):
+        recipients = [[h, addr[0], addr[1]] for h, addr in found.items() if addr and h != self.username]
+        if not recipients:
+            messagebox.showinfo("Keine Nutzer", "Es sind keine anderen Nutzer im Chat.")
+            return
+        self.in_q.put(["MSG_MULTI", self.username, "*", text, recipients])
+        self.append_chat_line(f"[Du → {self.ALL_RECIPIENTS}]: {text}")
+        self.entry.delete(0, tk.END)
+
+    ## @brief Wartet im Tk-Mainloop auf eine Adressabfrage, ohne die Oberfläche zu blockieren.
+    #  @param target Gesuchtes Handle
+    #  @param fut Future der Adressabfrage
+    #  @param on_found Callback mit (ip, port), läuft im Tk-Thread
+    #  @param many True für lookup_many: on_found erhält das ganze Dictionary
+    def when_resolved(self, target, fut, on_found, many=False):
+        if not fut.done():
+            self.root.after(20, self.when_resolved, target, fut, on_found, many)
+            return
+        try:
+            found = fut.result()
+        except TimeoutError:
+            messagebox.showerror("Fehler", f"Keine Antwort von Discovery für '{target}'.")
+            return
+        if many:
+            on_found(found)
+            return
+        if not found:
+            messagebox.showerror("Fehler", f"Nutzer '{target}' nicht gefunden.")
+            return
+        on_found(*found)
+
     ## @brief Sendet ein Bild an den ausgewählten Empfänger.
-    #  @details Wandelt das Bild in base64 um und sendet es per TCP an den Zielport + 100.
+    #  @details Streamt die Datei per TCP an den Zielport + 100.
     def send_img(self):
         target = self.recipient_var.get().strip()
         if not target:
             messagebox.showwarning("Kein Empfänger", "Bitte einen Empfänger auswählen.")
             return
+        if target == self.ALL_RECIPIENTS:
+            messagebox.showwarning("Einzelner Empfänger", "Bilder können nur an einen Empfänger gesendet werden.")
+            return
         path = filedialog.askopenfilename(title="Bild auswählen",
                                           filetypes=[("Bilddateien", "*.png *.jpg *.jpeg *.gif *.bmp"), ("Alle", "*.*")])
         if not path or not os.path.isfile(path):
             return
-        from core.image_handler import load_image_as_bytes
-        import base64
-        img_bytes = load_image_as_bytes(path)
-        if img_bytes is None:
-            messagebox.showerror("Fehler", "Bild konnte nicht geladen werden.")
-            return
-        img_b64 = base64.b64encode(img_bytes).decode()
-        filename = os.path.basename(path)
         print(f"Sende IMG an {target}: {path}")
 
-        self.to_disc.put(["GET_QUEUE", self.username, target])
-        found = None
-        while True:
-            resp = self.from_disc.get()
-            if isinstance(resp, list) and resp and resp[0] == "FOUND" and resp[1] == target:
-                found = resp
-                break
-            elif isinstance(resp, list) and resp and resp[0] == "NOT_FOUND" and resp[1] == target:
-                found = None
-                break
+        fut = self.lookup.lookup(target)
+        self.when_resolved(target, fut, lambda ip, port: self.deliver_img(target, path, ip, port))
 
-        if not found:
-            messagebox.showerror("Fehler", f"Nutzer '{target}' nicht gefunden.")
-            return
-
-        ip = found[2]
-        port = found[3]
+    ## @brief Sendet ein Bild per TCP (Header + rohe Bytes) an eine bekannte Adresse.
+    #  @details Hash und Versand laufen in einem eigenen Thread, damit die Oberfläche
+    #           nicht blockiert; das Ergebnis zeigt pump_messages im Tk-Thread an.
+    def deliver_img(self, target, path, ip, port):
         print(f"[DEBUG] Sende Bild an IP: {ip}, Port: {port + 100}, Empfänger: {target}")
+        threading.Thread(target=self._deliver_img_worker, args=(target, path, ip, port), daemon=True).start()
 
-        payload = json.dumps([self.username, filename, img_b64]).encode()
+    def _deliver_img_worker(self, target, path, ip, port):
         try:
-            with socket.create_connection((ip, port + 100), timeout=5) as sock:
-                print(f"[TCP-Client] Sende an {ip}:{port + 100}")
-                sock.sendall(payload)
-                print(f"[TCP] Bild erfolgreich an {target} gesendet.")
-                messagebox.showinfo("Bild gesendet", f"Bild erfolgreich an {target} gesendet.")
+            print(f"[TCP-Client] Sende an {ip}:{port + 100}")
+            result = send_image(ip, port + 100, self.username, path)
         except Exception as e:
-            print(f"[TCP Fehler] Bildversand an {target} fehlgeschlagen: {e}")
-            messagebox.showerror("Fehler", f"Bildversand an {target} fehlgeschlagen:\n{e}")
+            print(f"[TCP Fehler] Bildversand an {target} fehlgeschlagen: {e} – versuche UDP")
+            self.in_q.put(["IMG", self.username, target, os.path.abspath(path), ip, port])
+            self._dialogs.put(("Bildversand", f"TCP an {target} fehlgeschlagen:\n{e}\nDas Bild wird per UDP gesendet."))
+            return
+        if result == HAVE:
+            print(f"[TCP] {target} hat das Bild bereits – keine Übertragung nötig.")
+            self._dialogs.put(("Bild gesendet", f"{target} hat das Bild bereits."))
+        else:
+            print(f"[TCP] Bild erfolgreich an {target} gesendet.")
+            self._dialogs.put(("Bild gesendet", f"Bild erfolgreich an {target} gesendet."))
+
+    ## @brief Zeigt die letzten Nachrichten mit dem ausgewählten Empfänger.
+    def show_history(self):
+        target = self.recipient_var.get().strip()
+        if not target or target == self.ALL_RECIPIENTS:
+            messagebox.showwarning("Kein Empfänger", "Bitte einen Empfänger auswählen.")
+            return
+        rows = self.history.recent(target, 50) if self.history else []
+        self.show_rows(f"Verlauf mit {target}", rows)
+
+    ## @brief Durchsucht den Nachrichtenverlauf nach einem Begriff.
+    def search_history(self):
+        text = simpledialog.askstring("Verlauf durchsuchen", "Suchbegriff:", parent=self.root)
+        if not text or not text.strip():
+            return
+        rows = self.history.search(text, 50) if self.history else []
+        self.show_rows(f"Suche: {text}", rows)
+
+    ## @brief Zeigt Verlaufszeilen in einem eigenen Fenster.
+    #  @param title Fenstertitel
+    #  @param rows Liste (ts, sender, target, body)
+    def show_rows(self, title, rows):
+        if not rows:
+            messagebox.showinfo(title, "Keine Nachrichten gefunden.")
+            return
+        window = tk.Toplevel(self.root)
+        window.title(title)
+        area = ScrolledText(window, width=75, height=20, wrap=tk.WORD)
+        area.pack(padx=10, pady=10)
+        area.insert(tk.END, "\n".join(format_row(row) for row in rows))
+        area.config(state="disabled")
+        area.see(tk.END)
+
+    ## @brief Fordert die Laufzeitkennzahlen von Network und Discovery an (Ausgabe im Chat-Verlauf).
+    def send_stats(self):
+        self.in_q.put(["STATS", self.username])
 
     ## @brief Fordert mit WHO die aktuelle Teilnehmerliste an.
     def send_who(self):
         print("Sende WHO-Befehl")
         self.in_q.put(["WHO", self.username])
 
-    ## @brief Wartet auf Nachrichten aus der Queue und verarbeitet sie.
-    def listen_for_messages(self):
-        while True:
-            if not self.out_q.empty():
-                line = self.out_q.get()
+    ## @brief Holt eingehende Nachrichten im Tk-Thread ab und zeigt sie gesammelt an.
+    #  @details Läuft über root.after statt in einem eigenen Thread, da Tkinter
+    #           nur aus dem Mainloop-Thread bedient werden darf. Pro Durchlauf
+    #           werden bis zu PUMP_BATCH Nachrichten mit einem Einfügen angezeigt
+    #           und Änderungen der Teilnehmerliste zu einem Menü-Update zusammengefasst.
+    #           Meldungen aus Worker-Threads (_dialogs) werden hier als Dialog gezeigt.
+    def pump_messages(self):
+        lines = []
+        try:
+            while len(lines) < self.PUMP_BATCH:
+                line = self.out_q.get_nowait()
+                if not isinstance(line, str):
+                    continue
                 print("Empfangen:", repr(line))  # Debug-Ausgabe
                 # Nur normale Nachrichten anzeigen, keine WHO/KNOWNUSERS
                 if not (line.startswith("[WHO]") or line.startswith("KNOWNUSERS ")):
-                    self.append_chat_line(line)
+                    lines.append(line)
                 self.update_users_from_line(line)
+        except queue.Empty:
+            pass
+        if lines:
+            self.append_chat_lines(lines)
+        if self._users_dirty:
+            self.refresh_recipient_menu()
+        try:
+            while True:
+                messagebox.showinfo(*self._dialogs.get_nowait())
+        except queue.Empty:
+            pass
+        # Volle Stapel sofort weiter abarbeiten, sonst in Ruhe warten
+        self.root.after(1 if len(lines) >= self.PUMP_BATCH else self.PUMP_INTERVAL, self.pump_messages)
 
     ## @brief Fügt eine neue Zeile zum Chat-Verlauf hinzu.
     #  @param text_line Die Textzeile, die angezeigt werden soll.
     def append_chat_line(self, text_line: str):
+        self.append_chat_lines([text_line])
+
+    ## @brief Fügt mehrere Zeilen mit einem Einfügen hinzu und kürzt den Verlauf auf MAX_LINES.
+    #  @param lines Liste von Textzeilen
+    def append_chat_lines(self, lines):
         self.text_area.config(state="normal")
-        self.text_area.insert(tk.END, text_line + "\n")
+        self.text_area.insert(tk.END, "\n".join(lines) + "\n")
+        excess = int(self.text_area.index("end-1c").split(".")[0]) - 1 - self.MAX_LINES
+        if excess > 0:
+            self.text_area.delete("1.0", f"{excess + 1}.0")
         self.text_area.config(state="disabled")
         self.text_area.see(tk.END)
 
@@ -185,34 +298,45 @@ class GUI:
         if line.startswith("[System]") and "ist dem Chat beigetreten" in line:
             self.known_users.add(extract_username(line))
             print("User beigetreten:", self.known_users)
-            self.refresh_recipient_menu()
+            self._users_dirty = True
         elif line.startswith("[System]") and "hat den Chat verlassen" in line:
             self.known_users.discard(extract_username(line))
             print("User verlassen:", self.known_users)
-            self.refresh_recipient_menu()
+            self._users_dirty = True
         elif line.startswith("[WHO]"):
             parts = line.split("]", 1)
             if len(parts) == 2:
                 users = [u.strip() for u in parts[1].split(",") if u.strip()]
                 print("WHO-User:", users)
                 self.known_users = set(users)
-                self.refresh_recipient_menu()
+                self._users_dirty = True
         elif line.startswith("KNOWNUSERS "):
             users_str = line[len("KNOWNUSERS "):]
-            users = [u.split(" ")[0] for u in users_str.split(",") if u.strip()]
+            users = [u.strip().split(" ")[0] for u in users_str.split(",") if u.strip()]
             print("KNOWNUSERS-User:", users)
             self.known_users = set(users)
-            self.refresh_recipient_menu()
+            self._users_dirty = True
 
     ## @brief Aktualisiert das Empfänger-Dropdown-Menü basierend auf bekannten Nutzern.
+    #  @details Wird von der Pumpe höchstens einmal pro Durchlauf aufgerufen; ist die
+    #           Nutzerliste unverändert, bleibt das Menü wie es ist. Die aktuelle
+    #           Auswahl bleibt erhalten, solange der Nutzer noch bekannt ist.
     def refresh_recipient_menu(self):
+        self._users_dirty = False
+        sorted_users = sorted(self.known_users)
+        if sorted_users == self._menu_users:
+            return
+        self._menu_users = sorted_users
         menu = self.recipient_menu["menu"]
         menu.delete(0, "end")
-        sorted_users = sorted(self.known_users) 
+        if len(sorted_users) > 1:
+            menu.add_command(label=self.ALL_RECIPIENTS, command=lambda: self.recipient_var.set(self.ALL_RECIPIENTS))
         for user in sorted_users:
             menu.add_command(label=user, command=lambda u=user: self.recipient_var.set(u))
         if sorted_users:
-            self.recipient_var.set(sorted_users[0])
+            current = self.recipient_var.get()
+            if current not in self.known_users and not (current == self.ALL_RECIPIENTS and len(sorted_users) > 1):
+                self.recipient_var.set(sorted_users[0])
             self.recipient_menu.config(state="normal")
             self.entry.config(state="normal")
         else:
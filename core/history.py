@@ -0,0 +1,189 @@
+## @file history.py
+#  @brief Dauerhafter Nachrichtenverlauf in SQLite.
+#  @details Discovery ist der einzige Schreiber: record() legt die Nachricht nur
+#           in eine Queue, ein Hintergrund-Thread schreibt gesammelt in einer
+#           Transaktion (executemany). Die Datenbank läuft im WAL-Modus, dadurch
+#           können CLI und GUI über eine eigene Verbindung lesen, während
+#           geschrieben wird.
+#           Indizes: (peer, ts) für HISTORY, ts für zeitliche Abfragen und ein
+#           FTS5-Volltextindex auf dem Nachrichtentext für SEARCH. Fehlt FTS5 in
+#           der SQLite-Version, wird mit LIKE gesucht.
+
+import os
+import time
+import queue
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id     INTEGER PRIMARY KEY,
+    ts     REAL NOT NULL,
+    peer   TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    target TEXT NOT NULL,
+    body   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_peer_ts ON messages(peer, ts);
+CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages(ts);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(body, content='messages', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, body) VALUES (new.id, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, body) VALUES ('delete', old.id, old.body);
+END;
+"""
+
+## @brief Pfad der Verlaufsdatenbank aus der Konfiguration.
+#  @param config Konfigurationsdaten
+#  @return Pfad (history_path, sonst history.db im Bildordner)
+def history_path(config):
+    return config.get("history_path") or os.path.join(config.get("imagepath", "./received"), "history.db")
+
+def _connect(path, readonly=False):
+    if readonly:
+        conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # im WAL-Modus absturzsicher, fsync nur beim Checkpoint
+    conn.execute("PRAGMA busy_timeout=2000")
+    return conn
+
+## @brief Macht aus einer Benutzereingabe eine FTS5-Abfrage (alle Wörter, ohne Operatoren).
+def _fts_query(text):
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+## @class HistoryWriter
+#  @brief Schreibt Nachrichten gesammelt aus einem Hintergrund-Thread.
+class HistoryWriter:
+    ## @brief Konstruktor
+    #  @param path Pfad der Datenbank
+    #  @param batch_size Höchstens so viele Nachrichten je Transaktion
+    #  @param flush_interval Sekunden, die auf weitere Nachrichten für einen Stapel gewartet wird
+    def __init__(self, path, batch_size=500, flush_interval=0.2):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        ## @var self.written
+        #  @brief Anzahl gespeicherter Nachrichten
+        self.written = 0
+
+        ## @var self.batches
+        #  @brief Anzahl Transaktionen
+        self.batches = 0
+
+        self._rows = queue.Queue()
+        self._thread = None
+
+    ## @brief Vermerkt eine Nachricht, ohne auf die Datenbank zu warten.
+    #  @param peer Gesprächspartner (bei eigenen Nachrichten der Empfänger)
+    #  @param sender Absender
+    #  @param target Empfänger (Handle, "a,b" oder "*")
+    #  @param body Nachrichtentext
+    #  @param ts Zeitstempel (Unix-Zeit), sonst jetzt
+    def record(self, peer, sender, target, body, ts=None):
+        # Thread erst im Zielprozess starten (das Objekt entsteht vor dem Fork)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._rows.put((ts or time.time(), peer, sender, target, body))
+
+    ## @brief Schreibt alle ausstehenden Nachrichten und beendet den Thread.
+    def close(self):
+        if self._thread is not None:
+            self._rows.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        conn = _connect(self.path)
+        conn.executescript(_SCHEMA)
+        try:
+            conn.executescript(_FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            pass  # SQLite ohne FTS5: Suche fällt auf LIKE zurück
+        running = True
+        while running:
+            batch = [self._rows.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._rows.get(timeout=remaining) if remaining > 0 else self._rows.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                batch = [row for row in batch if row is not None]
+                running = False
+            if not batch:
+                continue
+            try:
+                with conn:
+                    conn.executemany("INSERT INTO messages (ts, peer, sender, target, body) VALUES (?, ?, ?, ?, ?)",
+                                     batch)
+                self.written += len(batch)
+                self.batches += 1
+            except sqlite3.Error as e:
+                print(f"[History] {len(batch)} Nachrichten nicht gespeichert: {e}")
+        conn.close()
+
+## @class HistoryReader
+#  @brief Lesezugriff auf den Verlauf für CLI und GUI.
+#  @details Öffnet die Datenbank erst bei der ersten Abfrage und nur lesend.
+class HistoryReader:
+    ## @brief Konstruktor
+    #  @param path Pfad der Datenbank
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _query(self, sql, args):
+        with self._lock:
+            if self._conn is None:
+                if not os.path.exists(self.path):
+                    return []
+                self._conn = _connect(self.path, readonly=True)
+            try:
+                return self._conn.execute(sql, args).fetchall()
+            except sqlite3.OperationalError:
+                return []  # z. B. Tabelle noch nicht angelegt
+
+    ## @brief Letzte Nachrichten mit einem Teilnehmer.
+    #  @param peer Handle des Gesprächspartners
+    #  @param limit Anzahl Nachrichten
+    #  @return Liste (ts, sender, target, body), älteste zuerst
+    def recent(self, peer, limit=20):
+        rows = self._query("SELECT ts, sender, target, body FROM messages WHERE peer = ? "
+                           "ORDER BY ts DESC LIMIT ?", (peer, limit))
+        return rows[::-1]
+
+    ## @brief Volltextsuche im Verlauf.
+    #  @param text Suchbegriffe (alle müssen vorkommen)
+    #  @param limit Höchstzahl Treffer
+    #  @return Liste (ts, sender, target, body), älteste zuerst
+    def search(self, text, limit=20):
+        if not text.split():
+            return []
+        if self._query("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'", ()):
+            rows = self._query("SELECT m.ts, m.sender, m.target, m.body FROM messages_fts "
+                               "JOIN messages m ON m.id = messages_fts.rowid "
+                               "WHERE messages_fts MATCH ? ORDER BY messages_fts.rowid DESC LIMIT ?",
+                               (_fts_query(text), limit))
+        else:
+            rows = self._query("SELECT ts, sender, target, body FROM messages WHERE body LIKE ? "
+                               "ORDER BY id DESC LIMIT ?", (f"%{text}%", limit))
+        return rows[::-1]
+
+## @brief Formatiert eine Verlaufszeile für die Ausgabe.
+#  @param row (ts, sender, target, body)
+def format_row(row):
+    ts, sender, target, body = row
+    return f"{time.strftime('%d.%m. %H:%M', time.localtime(ts))} [{sender} → {target}] {body}"
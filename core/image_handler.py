@@ -4,39 +4,274 @@
 import os
 import platform
 import uuid
+import re
+import json
+import base64
+import socket
+import struct
+import tempfile
+import threading
+import queue
+import time
+import subprocess
+import zlib
+from core.image_store import file_digest, DIGEST_SIZE
+from core.compression import worth_compressing
+
+## @var IMG_MAGIC
+#  @brief Kennung des binären Bildprotokolls über TCP
+IMG_MAGIC = b"BSRNIMG1"
+
+## @var IMG_HEADER
+#  @brief Header nach IMG_MAGIC: Länge Absender, Länge Dateiname, Länge Bilddaten
+IMG_HEADER = struct.Struct("!HHQ")
+
+## @var IMG_MAGIC_V2
+#  @brief Kennung mit Inhaltshash: nach IMG_HEADER folgen 32 Bytes sha256, danach
+#         wartet der Sender auf REPLY_HAVE oder REPLY_SEND
+IMG_MAGIC_V2 = b"BSRNIMG2"
+
+## @var REPLY_HAVE
+#  @brief Antwort des Empfängers: Bild liegt schon vor, nichts senden
+REPLY_HAVE = b"H"
+
+## @var REPLY_SEND
+#  @brief Antwort des Empfängers: Bilddaten senden
+REPLY_SEND = b"S"
+
+## @var REPLY_SEND_ZLIB
+#  @brief Antwort des Empfängers: Bilddaten senden, zlib-Strom erlaubt. Der Sender
+#         schickt dann ein Flag-Byte (FLAG_ZLIB oder FLAG_RAW) vor den Daten.
+REPLY_SEND_ZLIB = b"Z"
+
+## @var REPLY_BUSY
+#  @brief Antwort des Empfängers: alle Plätze belegt, der Sender soll ausweichen
+REPLY_BUSY = b"B"
+
+FLAG_ZLIB = b"Z"
+FLAG_RAW = b"R"
+
+## @var SENT
+#  @brief Ergebnis von send_image: Bilddaten wurden übertragen
+SENT = "sent"
+
+## @var HAVE
+#  @brief Ergebnis von send_image: Empfänger hatte das Bild schon, nichts übertragen
+HAVE = "have"
+
+## @var STREAM_LEVEL
+#  @brief zlib-Stufe für Bildströme (schnell genug, um das Netz nicht auszubremsen)
+STREAM_LEVEL = 1
+
+## @var STREAM_BUFSIZE
+#  @brief Puffergröße beim gestreamten Empfang
+STREAM_BUFSIZE = 64 * 1024
+
+## @brief Bildet einen freien Zieldateinamen im Bildordner.
+#  @param folder Zielordner
+#  @param sender Name des Absenders
+#  @param filename Originaler Dateiname (für die Endung), optional
+#  @return Vollständiger Pfad
+def make_image_path(folder, sender, filename=None):
+    ext = os.path.splitext(filename or "")[1].lower() or ".jpg"
+    safe_sender = re.sub(r"[^\w.-]", "_", sender)
+    return os.path.join(folder, f"{safe_sender}_{uuid.uuid4().hex[:8]}{ext}")
+
+## @brief Öffnet ein Bild im Standardprogramm, ohne auf den Viewer zu warten.
+#  @param full_path Pfad zur Bilddatei
+def open_image(full_path):
+    try:
+        if platform.system() == "Windows":
+            os.startfile(full_path)
+        else:
+            opener = "open" if platform.system() == "Darwin" else "xdg-open"
+            subprocess.Popen([opener, full_path], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL, start_new_session=True)
+    except Exception as e:
+        print(f"[⚠️ Fehler beim Öffnen des Bildes] {e}")
+
+## @class ImageViewer
+#  @brief Startet den Bildbetrachter abschaltbar und mit Ratenbegrenzung.
+#  @details Bei vielen Bildern kurz hintereinander öffnet sich nur das erste
+#           Fenster; die übrigen liegen trotzdem im Bildordner.
+class ImageViewer:
+    ## @brief Konstruktor
+    #  @param enabled False schaltet das automatische Öffnen ab
+    #  @param min_interval Mindestabstand zwischen zwei Viewer-Starts in Sekunden
+    def __init__(self, enabled=True, min_interval=2.0):
+        self.enabled = enabled
+        self.min_interval = min_interval
+
+        ## @var self.suppressed
+        #  @brief Anzahl wegen der Ratenbegrenzung nicht geöffneter Bilder
+        self.suppressed = 0
+
+        self._last = None
+
+    ## @brief Öffnet ein Bild, falls erlaubt.
+    #  @return True, wenn ein Viewer gestartet wurde
+    def show(self, path):
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        if self._last is not None and now - self._last < self.min_interval:
+            self.suppressed += 1
+            return False
+        self._last = now
+        open_image(path)
+        return True
+
+## @class ImageWriter
+#  @brief Speichert empfangene Bilder in einem Hintergrund-Thread.
+#  @details Aufträge werden gesammelt abgearbeitet: erst alle Dateien schreiben,
+#           dann je Datei fsync, umbenennen und einmal den Ordner synchronisieren.
+#           Erst danach folgen Callback und Viewer. Der Aufrufer wartet nie auf
+#           die Platte oder den Viewer. Mit einem ImageStore landen die Bilder
+#           inhaltsadressiert und dedupliziert im Speicher statt im Bildordner.
+class ImageWriter:
+    ## @brief Konstruktor
+    #  @param imagepath Bildordner
+    #  @param viewer ImageViewer oder None
+    #  @param fsync False verzichtet auf fsync (schneller, aber nicht absturzsicher)
+    #  @param store ImageStore oder None
+    def __init__(self, imagepath, viewer=None, fsync=True, store=None):
+        self.imagepath = imagepath
+        self.viewer = viewer
+        self.fsync = fsync
+        self.store = store
+        self._jobs = queue.Queue()
+        self._thread = None
+
+    ## @brief Speichert Bilddaten.
+    #  @param sender Absender
+    #  @param data Bilddaten als Bytes
+    #  @param filename Originaler Dateiname (für die Endung), optional
+    #  @param on_done Callback on_done(pfad, fehler) aus dem Writer-Thread
+    def save(self, sender, data, filename=None, on_done=None):
+        self._submit((sender, data, None, filename, on_done, None))
+
+    ## @brief Übernimmt eine fertige Spooldatei.
+    #  @param tmp_path Pfad der Spooldatei im Bildordner
+    def adopt(self, sender, tmp_path, filename=None, on_done=None):
+        self._submit((sender, None, tmp_path, filename, on_done, None))
+
+    ## @brief Meldet ein Bild, das nicht übertragen wurde, weil es schon im Speicher liegt.
+    #  @param digest sha256 als Hex-String
+    def have(self, sender, digest, filename=None, on_done=None):
+        self._submit((sender, None, None, filename, on_done, digest))
+
+    def _submit(self, job):
+        # Thread erst im Zielprozess starten (das Objekt entsteht vor dem Fork)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._jobs.put(job)
+
+    def _run(self):
+        while True:
+            batch = [self._jobs.get()]
+            try:
+                while True:
+                    batch.append(self._jobs.get_nowait())
+            except queue.Empty:
+                pass
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        results = []
+        folders = {os.path.abspath(self.imagepath)}
+        for sender, data, tmp_path, filename, on_done, digest in batch:
+            try:
+                if digest is not None:
+                    path = self.store.touch(digest, sender, filename) if self.store else None
+                    if path is None:
+                        raise FileNotFoundError(f"Bild {digest[:12]} nicht mehr im Speicher")
+                    results.append((path, None, on_done))
+                    continue
+                if tmp_path is None:
+                    with spool_image(self.imagepath) as f:
+                        f.write(data)
+                    tmp_path = f.name
+                if self.fsync:
+                    with open(tmp_path, "r+b") as f:
+                        os.fsync(f.fileno())
+                if self.store:
+                    path, _, _ = self.store.put(tmp_path, sender, filename)
+                    folders.update((self.store.root, os.path.dirname(path)))
+                else:
+                    path = adopt_image(sender, tmp_path, self.imagepath, filename)
+                results.append((path, None, on_done))
+            except OSError as e:
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                results.append((None, e, on_done))
+        if self.store:
+            try:
+                self.store.save_index()
+            except OSError:
+                pass  # Index wird beim nächsten Start aus den Ordnern ergänzt
+        if self.fsync and hasattr(os, "O_DIRECTORY"):
+            # Umbenennungen dauerhaft machen: einmal pro Stapel und Ordner statt pro Bild
+            for folder in folders:
+                try:
+                    fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+        for path, error, on_done in results:
+            if path and self.viewer:
+                self.viewer.show(path)
+            if on_done:
+                on_done(path, error)
 
 ## @brief Speichert ein Bild und öffnet es im Standardprogramm.
 #  @param sender Name des Absenders
 #  @param binary_data Bilddaten als Bytes
 #  @param imagepath Zielordner zum Speichern
+#  @param filename Originaler Dateiname (für die Endung), optional
 #  @return Vollständiger Pfad der gespeicherten Datei oder None bei Fehler
-def save_and_open_image(sender, binary_data, imagepath):
+def save_and_open_image(sender, binary_data, imagepath, filename=None):
     try:
         folder = os.path.abspath(imagepath)
         os.makedirs(folder, exist_ok=True)
 
-        filename = f"{sender}_{uuid.uuid4().hex[:8]}.jpg"
-        full_path = os.path.join(folder, filename)
+        full_path = make_image_path(folder, sender, filename)
 
         with open(full_path, "wb") as f:
             f.write(binary_data)
 
-        try:
-            if platform.system() == "Windows":
-                os.startfile(full_path)
-            elif platform.system() == "Darwin":
-                os.system(f"open \"{full_path}\"")
-            else:
-                os.system(f"xdg-open \"{full_path}\"")
-        except Exception as e:
-            print(f"[⚠️ Fehler beim Öffnen des Bildes] {e}")
-
+        open_image(full_path)
         return full_path
 
     except Exception as e:
         print(f"[❌ Fehler beim Speichern des Bildes] {e}")
         return None
 
+## @brief Legt eine Spooldatei für ein eingehendes Bild im Bildordner an.
+#  @details Liegt im selben Dateisystem wie das Ziel, adopt_image kann sie daher
+#           ohne Kopie umbenennen. Zwischen Prozessen wird nur der Pfad übergeben.
+#  @param imagepath Bildordner
+#  @return Geöffnete Datei (Modus w+b); der Aufrufer schließt sie
+def spool_image(imagepath):
+    folder = os.path.abspath(imagepath)
+    os.makedirs(folder, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=folder, prefix=".incoming_", delete=False)
+
+## @brief Übernimmt eine vollständige Spooldatei unter ihrem endgültigen Namen.
+#  @param sender Name des Absenders
+#  @param tmp_path Pfad der Spooldatei
+#  @param imagepath Bildordner
+#  @param filename Originaler Dateiname (für die Endung), optional
+#  @return Vollständiger Pfad der gespeicherten Datei
+def adopt_image(sender, tmp_path, imagepath, filename=None):
+    os.chmod(tmp_path, 0o644)  # NamedTemporaryFile legt 0600 an
+    full_path = make_image_path(os.path.abspath(imagepath), sender, filename)
+    os.replace(tmp_path, full_path)
+    return full_path
+
 ## @brief Lädt ein Bild als Bytes aus einer Datei.
 #  @param path Pfad zur Bilddatei
 #  @return Bilddaten oder None bei Fehler
@@ -53,4 +288,181 @@ def load_image_as_bytes(path):
 #  @param max_size Maximale Länge pro Stück (Standard: 512)
 #  @return Liste mit String-Chunks
 def chunk_image_data(b64_string, max_size=512):
-    return [b64_string[i:i+max_size] for i in range(0, len(b64_string), max_size)]
\ No newline at end of file
+    return [b64_string[i:i+max_size] for i in range(0, len(b64_string), max_size)]
+
+## @brief Sendet eine Bilddatei gestreamt über eine TCP-Verbindung.
+#  @details Header (IMG_MAGIC, IMG_HEADER, Absender, Dateiname) und danach die
+#           rohen Bytes per socket.sendfile – ohne base64 und ohne die Datei
+#           ganz in den Speicher zu laden. Mit digest wird zuerst der Hash
+#           angeboten (IMG_MAGIC_V2); meldet der Empfänger REPLY_HAVE, entfällt
+#           die Übertragung. Erlaubt er zlib (REPLY_SEND_ZLIB), wird komprimiert,
+#           sofern die Datei kein bereits komprimiertes Format ist.
+#  @param sock Verbundener TCP-Socket
+#  @param sender Name des Absenders
+#  @param path Pfad zur Bilddatei
+#  @param digest sha256 der Datei als Hex-String, optional
+#  @return Anzahl gesendeter Bilddaten-Bytes auf der Leitung oder None, wenn der Empfänger das Bild schon hat
+def send_image_file(sock, sender, path, digest=None):
+    size = os.path.getsize(path)
+    sender_b = sender.encode()
+    name_b = os.path.basename(path).encode()
+    header = IMG_HEADER.pack(len(sender_b), len(name_b), size)
+    if digest:
+        sock.sendall(IMG_MAGIC_V2 + header + bytes.fromhex(digest) + sender_b + name_b)
+        reply = _recv_exact(sock, 1)
+        if reply == REPLY_HAVE:
+            return None
+        if reply == REPLY_BUSY:
+            raise ConnectionError("Empfänger ist ausgelastet")
+        if reply == REPLY_SEND_ZLIB:
+            with open(path, "rb") as f:
+                if worth_compressing(f.read(STREAM_BUFSIZE)):
+                    f.seek(0)
+                    sock.sendall(FLAG_ZLIB)
+                    return _send_zlib(sock, f)
+            sock.sendall(FLAG_RAW)
+        elif reply != REPLY_SEND:
+            raise ConnectionError("Empfänger versteht den Hash-Header nicht")
+    else:
+        sock.sendall(IMG_MAGIC + header + sender_b + name_b)
+    with open(path, "rb") as f:
+        sock.sendfile(f)
+    return size
+
+## @brief Verbindet sich mit dem Bildserver eines Teilnehmers und sendet ein Bild.
+#  @param ip Ziel-IP
+#  @param port TCP-Port des Bildservers (UDP-Port + 100)
+#  @param sender Name des Absenders
+#  @param path Pfad zur Bilddatei
+#  @param timeout Verbindungs-Timeout in Sekunden
+#  @return SENT oder HAVE (Empfänger hatte das Bild schon)
+def send_image(ip, port, sender, path, timeout=5):
+    digest = file_digest(path)
+    with socket.create_connection((ip, port), timeout=timeout) as sock:
+        return HAVE if send_image_file(sock, sender, path, digest) is None else SENT
+
+## @brief Sendet eine Datei als zlib-Strom und schließt die Senderichtung.
+#  @return Anzahl gesendeter Bytes
+def _send_zlib(sock, f):
+    c = zlib.compressobj(STREAM_LEVEL)
+    sent = 0
+    for block in iter(lambda: f.read(STREAM_BUFSIZE), b""):
+        out = c.compress(block)
+        if out:
+            sock.sendall(out)
+            sent += len(out)
+    out = c.flush()
+    sock.sendall(out)
+    sock.shutdown(socket.SHUT_WR)  # Ende des Stroms
+    return sent + len(out)
+
+## @brief Liest genau n Bytes oder weniger bei Verbindungsende.
+def _recv_exact(conn, n):
+    buf = bytearray()
+    while len(buf) < n:
+        part = conn.recv(n - len(buf))
+        if not part:
+            break
+        buf += part
+    return bytes(buf)
+
+## @brief Empfängt ein Bild von einer TCP-Verbindung in eine Spooldatei.
+#  @details Binärprotokoll: die Bytes werden direkt in eine Spooldatei im
+#           Bildordner geschrieben, der Speicherbedarf bleibt konstant.
+#           Umbenennen und Öffnen übernimmt der Aufrufer (adopt_image bzw.
+#           ImageWriter). Bietet der Sender einen Hash an (IMG_MAGIC_V2) und
+#           liefert have(digest) True, wird mit REPLY_HAVE geantwortet und
+#           nichts empfangen. Das alte JSON-Format [sender, filename, img_b64]
+#           wird weiterhin akzeptiert.
+#  @param conn Verbundener TCP-Socket
+#  @param imagepath Zielordner zum Speichern
+#  @param have Funktion have(digest) → bool, optional
+#  @param allow_zlib True erlaubt dem Sender einen zlib-Strom (nur mit Hash-Header)
+#  @return (Absender, Pfad der Spooldatei oder None, Anzahl Bytes, Dateiname, sha256 oder None)
+#          oder None ohne Daten
+def receive_image(conn, imagepath, have=None, allow_zlib=False):
+    folder = os.path.abspath(imagepath)
+    os.makedirs(folder, exist_ok=True)
+
+    head = _recv_exact(conn, len(IMG_MAGIC))
+    if not head:
+        return None
+    if head not in (IMG_MAGIC, IMG_MAGIC_V2):
+        return _receive_legacy_json(conn, head, folder)
+
+    sender_len, name_len, size = IMG_HEADER.unpack(_recv_exact(conn, IMG_HEADER.size))
+    digest = _recv_exact(conn, DIGEST_SIZE).hex() if head == IMG_MAGIC_V2 else None
+    sender = _recv_exact(conn, sender_len).decode()
+    filename = _recv_exact(conn, name_len).decode()
+    if digest:
+        if have and have(digest):
+            conn.sendall(REPLY_HAVE)
+            return sender, None, size, filename, digest
+        if allow_zlib:
+            conn.sendall(REPLY_SEND_ZLIB)
+            if _recv_exact(conn, 1) == FLAG_ZLIB:
+                return sender, _receive_zlib(conn, folder, size), size, filename, digest
+        else:
+            conn.sendall(REPLY_SEND)
+
+    buf = bytearray(STREAM_BUFSIZE)
+    view = memoryview(buf)
+    remaining = size
+    tmp = spool_image(folder)
+    try:
+        with tmp:
+            while remaining:
+                n = conn.recv_into(view[:min(remaining, STREAM_BUFSIZE)])
+                if not n:
+                    raise ConnectionError(f"Verbindung nach {size - remaining} von {size} Bytes abgebrochen")
+                tmp.write(view[:n])
+                remaining -= n
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    return sender, tmp.name, size, filename, digest
+
+## @brief Empfängt einen zlib-Strom bis zum Verbindungsende in eine Spooldatei.
+#  @param size Angekündigte entpackte Größe; mehr wird nicht geschrieben
+#  @return Pfad der Spooldatei
+def _receive_zlib(conn, folder, size):
+    d = zlib.decompressobj()
+    buf = bytearray(STREAM_BUFSIZE)
+    view = memoryview(buf)
+    written = 0
+    tmp = spool_image(folder)
+    try:
+        with tmp:
+            while not d.eof:
+                n = conn.recv_into(view)
+                if not n:
+                    break
+                data = view[:n]
+                while data:
+                    # Ausgabe begrenzen, damit kleine Eingaben nicht riesig aufgehen
+                    out = d.decompress(data, STREAM_BUFSIZE)
+                    written += len(out)
+                    if written > size:
+                        raise ValueError(f"Bild größer als angekündigt ({size} Bytes)")
+                    tmp.write(out)
+                    data = d.unconsumed_tail
+            if not d.eof or written != size:
+                raise ConnectionError(f"Verbindung nach {written} von {size} Bytes abgebrochen")
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    return tmp.name
+
+## @brief Empfängt das alte JSON-Format [sender, filename, img_b64].
+def _receive_legacy_json(conn, head, folder):
+    parts = [head]
+    while True:
+        part = conn.recv(STREAM_BUFSIZE)
+        if not part:
+            break
+        parts.append(part)
+    sender, filename, img_b64 = json.loads(b"".join(parts).decode())
+    image_data = base64.b64decode(img_b64)
+    with spool_image(folder) as f:
+        f.write(image_data)
+    return sender, f.name, len(image_data), filename, None
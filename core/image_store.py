@@ -0,0 +1,181 @@
+## @file image_store.py
+#  @brief Inhaltsadressierter Bildspeicher mit Deduplizierung und LRU-Verdrängung.
+#  @details Jedes Bild liegt genau einmal unter <root>/<sha256>/<dateiname>.
+#           Ein Index (index.json) hält Größe, Absender, Dateinamen und den
+#           letzten Zugriff. Übersteigt der Speicher max_bytes, werden die am
+#           längsten nicht benutzten Bilder entfernt.
+#           Schreiber ist nur Discovery (ImageWriter); andere Prozesse prüfen mit
+#           stored_path(), ob ein Bild schon vorhanden ist.
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+
+## @var DIGEST_SIZE
+#  @brief Länge eines sha256-Hashes in Bytes
+DIGEST_SIZE = 32
+
+_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+## @brief Berechnet den sha256-Hash einer Datei.
+#  @param path Pfad zur Datei
+#  @return Hash als Hex-String
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+## @brief Sucht ein Bild im Speicher, ohne den Index zu laden.
+#  @param root Wurzel des Speichers
+#  @param digest sha256 als Hex-String
+#  @return Pfad der Bilddatei oder None
+def stored_path(root, digest):
+    if not isinstance(digest, str) or not _HEX.match(digest):
+        return None
+    folder = os.path.join(root, digest)
+    try:
+        names = [n for n in os.listdir(folder) if not n.startswith(".")]
+    except OSError:
+        return None
+    return os.path.join(folder, names[0]) if names else None
+
+## @brief Wurzel des Bildspeichers innerhalb des Bildordners.
+#  @param imagepath Bildordner aus der Konfiguration
+def store_root(imagepath):
+    return os.path.join(os.path.abspath(imagepath), "store")
+
+def _safe_name(filename):
+    name = re.sub(r"[^\w.-]", "_", os.path.basename(filename or ""))
+    return name.lstrip(".") or "bild.jpg"
+
+## @class ImageStore
+#  @brief Bildspeicher mit Index und Größenbegrenzung.
+class ImageStore:
+    ## @brief Konstruktor
+    #  @param root Wurzelordner des Speichers
+    #  @param max_bytes Obergrenze für die Summe aller Bilder in Bytes
+    def __init__(self, root, max_bytes=512 * 1024 * 1024):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+        ## @var self.entries
+        #  @brief Index: sha256 → {size, name, senders, filenames, last_used}
+        self.entries = {}
+
+        ## @var self.total_bytes
+        #  @brief Belegter Speicher in Bytes
+        self.total_bytes = 0
+
+        ## @var self.dedup_hits
+        #  @brief Anzahl Bilder, die bereits vorhanden waren
+        self.dedup_hits = 0
+
+        self._index_path = os.path.join(self.root, "index.json")
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        # Index mit dem Dateisystem abgleichen (z. B. nach einem Absturz)
+        for digest in os.listdir(self.root):
+            path = stored_path(self.root, digest)
+            if path is None:
+                continue
+            entry = entries.get(digest) or {"senders": [], "filenames": [], "last_used": os.path.getmtime(path)}
+            entry["name"] = os.path.basename(path)
+            entry["size"] = os.path.getsize(path)
+            self.entries[digest] = entry
+        self.total_bytes = sum(e["size"] for e in self.entries.values())
+        self._dirty = entries.keys() != self.entries.keys()
+
+    ## @brief Liefert den Pfad eines vorhandenen Bildes und vermerkt den Zugriff.
+    #  @param digest sha256 als Hex-String
+    #  @param sender Absender für die Metadaten, optional
+    #  @param filename Dateiname für die Metadaten, optional
+    #  @return Pfad oder None
+    def touch(self, digest, sender=None, filename=None):
+        entry = self.entries.get(digest)
+        if entry is None:
+            return None
+        path = os.path.join(self.root, digest, entry["name"])
+        if not os.path.exists(path):
+            self._drop(digest)
+            return None
+        entry["last_used"] = time.time()
+        if sender and sender not in entry["senders"]:
+            entry["senders"].append(sender)
+        if filename and filename not in entry["filenames"]:
+            entry["filenames"].append(filename)
+        self._dirty = True
+        return path
+
+    ## @brief Übernimmt eine Spooldatei in den Speicher.
+    #  @details Ist der Inhalt schon vorhanden, wird die Spooldatei gelöscht.
+    #  @param tmp_path Spooldatei (gleiches Dateisystem wie root)
+    #  @param sender Absender
+    #  @param filename Originaler Dateiname
+    #  @param digest Bekannter Hash der Datei, sonst wird er berechnet
+    #  @return (Pfad, sha256, bereits vorhanden)
+    def put(self, tmp_path, sender, filename=None, digest=None):
+        digest = digest or file_digest(tmp_path)
+        path = self.touch(digest, sender, filename)
+        if path is not None:
+            os.unlink(tmp_path)
+            self.dedup_hits += 1
+            return path, digest, True
+        name = _safe_name(filename)
+        folder = os.path.join(self.root, digest)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, name)
+        os.chmod(tmp_path, 0o644)  # NamedTemporaryFile legt 0600 an
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        self.entries[digest] = {"size": size, "name": name, "senders": [sender] if sender else [],
+                                "filenames": [filename] if filename else [], "last_used": time.time()}
+        self.total_bytes += size
+        self._dirty = True
+        self._evict(keep=digest)
+        return path, digest, False
+
+    ## @brief Entfernt die am längsten unbenutzten Bilder, bis max_bytes eingehalten ist.
+    #  @param keep Hash, der nicht entfernt werden darf (das gerade gespeicherte Bild)
+    def _evict(self, keep=None):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for digest in sorted(self.entries, key=lambda d: self.entries[d]["last_used"]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if digest != keep:
+                self._drop(digest)
+
+    def _drop(self, digest):
+        entry = self.entries.pop(digest)
+        self.total_bytes -= entry["size"]
+        shutil.rmtree(os.path.join(self.root, digest), ignore_errors=True)
+        self._dirty = True
+
+    ## @brief Schreibt den Index atomar, falls er sich geändert hat.
+    def save_index(self):
+        if not self._dirty:
+            return
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self._index_path)
+        self._dirty = False
+
+    ## @brief Kennzahlen für die Anzeige.
+    #  @return Dictionary mit images, total_bytes, max_bytes, dedup_hits
+    def stats(self):
+        return {"images": len(self.entries), "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes, "dedup_hits": self.dedup_hits}
@@ -0,0 +1,284 @@
+## @file lookup.py
+#  @brief Asynchrone Teilnehmer-Abfrage bei Discovery.
+#  @details Jede Anfrage trägt eine Request-ID und nennt einen Antwortkanal.
+#           Discovery schickt die Antwort nur an diesen Kanal, ein Dispatcher-Thread
+#           ordnet sie über die Request-ID dem passenden Future zu.
+#           Zusätzlich pflegt jeder Aufrufer einen lokalen Adress-Cache, den
+#           Discovery über JOIN/LEAVE-Deltas aktuell hält.
+#           Ist eine Teilnehmertabelle im Shared Memory vorhanden (peer_table.py),
+#           wird sie vor allem anderen gelesen – ohne Queue-Verkehr.
+
+import threading
+import itertools
+import heapq
+import time
+import queue
+from concurrent.futures import Future
+
+## @class PeerCache
+#  @brief Lokaler Cache handle → (IP, Port) mit TTL.
+#  @details Wird durch Deltas von Discovery aktuell gehalten. Die TTL ist nur
+#           die Rückfallebene, falls ein Delta verloren geht.
+class PeerCache:
+    ## @brief Konstruktor
+    #  @param ttl Gültigkeit eines Eintrags in Sekunden
+    def __init__(self, ttl=60.0):
+        ## @var self.ttl
+        #  @brief Gültigkeit eines Eintrags in Sekunden
+        self.ttl = ttl
+
+        ## @var self.hits
+        #  @brief Anzahl Treffer
+        self.hits = 0
+
+        ## @var self.misses
+        #  @brief Anzahl Fehlschläge (Abfrage bei Discovery nötig)
+        self.misses = 0
+
+        ## @var self.version
+        #  @brief Zuletzt angewendete Delta-Version von Discovery
+        self.version = 0
+
+        self._entries = {}  # handle → (ip, port, Ablaufzeit)
+        self._lock = threading.Lock()
+
+    ## @brief Sucht ein Handle im Cache.
+    #  @return (IP, Port) oder None
+    def get(self, handle):
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry and entry[2] > time.monotonic():
+                self.hits += 1
+                return entry[0], entry[1]
+            if entry:
+                del self._entries[handle]
+            self.misses += 1
+            return None
+
+    ## @brief Trägt eine Adresse ein oder erneuert sie.
+    def put(self, handle, ip, port):
+        with self._lock:
+            self._entries[handle] = (ip, port, time.monotonic() + self.ttl)
+
+    ## @brief Wendet ein Delta von Discovery an.
+    #  @param version Version des Deltas
+    #  @param added Neue Einträge (handle → [IP, Port])
+    #  @param removed Entfernte Handles
+    #  @param changed Einträge mit neuer Adresse (handle → [IP, Port])
+    def apply_delta(self, version, added, removed, changed=None):
+        with self._lock:
+            if self.version and version != self.version + 1:
+                # Lücke: ein Delta fehlt, dem Cache nicht mehr trauen
+                self._entries.clear()
+            self.version = version
+            expires = time.monotonic() + self.ttl
+            for handle, (ip, port) in added.items():
+                self._entries[handle] = (ip, port, expires)
+            for handle, (ip, port) in (changed or {}).items():
+                self._entries[handle] = (ip, port, expires)
+            for handle in removed:
+                self._entries.pop(handle, None)
+
+    ## @brief Kennzahlen für die Anzeige.
+    #  @return Dictionary mit hits, misses, entries, version
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries), "version": self.version}
+
+## @class PeerLookup
+#  @brief Korrelierte, nicht-blockierende Abfrage von IP/Port zu einem Handle.
+#  @details Mehrere Abfragen können gleichzeitig laufen; keine stiehlt einer
+#           anderen die Antwort. Das Ergebnis ist ein Future mit (IP, Port)
+#           oder None, falls der Teilnehmer unbekannt ist. Nach Ablauf des
+#           Timeouts endet das Future mit TimeoutError. Treffer im lokalen
+#           Cache kommen ohne Umweg über Discovery zurück.
+class PeerLookup:
+    ## @brief Konstruktor
+    #  @param to_disc Queue an Discovery
+    #  @param reply_q Eigener Antwortkanal von Discovery
+    #  @param channel Name des Antwortkanals (z. B. "ui" oder "net")
+    #  @param requester Handle des Anfragenden
+    #  @param timeout Standard-Timeout in Sekunden
+    #  @param cache_ttl Gültigkeit der Cache-Einträge in Sekunden
+    #  @param peer_table Teilnehmertabelle im Shared Memory (PeerTable), optional
+    #  @param on_peers Funktion on_peers(neu, entfernt, geändert) für jedes PEERS-Delta,
+    #         läuft im Dispatcher-Thread, optional
+    def __init__(self, to_disc, reply_q, channel, requester, timeout=2.0, cache_ttl=60.0, peer_table=None,
+                 on_peers=None):
+        ## @var self.to_disc
+        #  @brief Queue an Discovery
+        self.to_disc = to_disc
+
+        ## @var self.reply_q
+        #  @brief Antwortkanal von Discovery
+        self.reply_q = reply_q
+
+        ## @var self.channel
+        #  @brief Name des Antwortkanals
+        self.channel = channel
+
+        ## @var self.requester
+        #  @brief Handle des Anfragenden
+        self.requester = requester
+
+        ## @var self.timeout
+        #  @brief Standard-Timeout in Sekunden
+        self.timeout = timeout
+
+        ## @var self.cache
+        #  @brief Lokaler Adress-Cache
+        self.cache = PeerCache(cache_ttl)
+
+        ## @var self.peer_table
+        #  @brief Teilnehmertabelle von Discovery im Shared Memory
+        self.peer_table = peer_table
+
+        ## @var self.table_hits
+        #  @brief Anzahl direkt aus dem Shared Memory beantworteter Abfragen
+        self.table_hits = 0
+
+        self.on_peers = on_peers
+        self._ids = itertools.count(1)
+        self._pending = {}     # req_id → Future
+        self._deadlines = []   # Heap aus (Ablaufzeit, req_id)
+        self._waiting = False  # Dispatcher wartet mit Timeout
+        self._lock = threading.Lock()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    ## @brief Startet eine Abfrage.
+    #  @param target Gesuchtes Handle
+    #  @param timeout Timeout in Sekunden (Standard: self.timeout)
+    #  @return Future mit (IP, Port) oder None
+    def lookup(self, target, timeout=None):
+        fut = Future()
+        if self.peer_table is not None:
+            found = self.peer_table.get(target)
+            if found:
+                self.table_hits += 1
+                fut.set_result(found)
+                return fut
+        cached = self.cache.get(target)
+        if cached:
+            fut.set_result(cached)
+            return fut
+        return self._request(["GET_QUEUE", self.requester, target], timeout)
+
+    ## @brief Fragt mehrere Empfänger mit einer einzigen Anfrage ab.
+    #  @details Bekannte Adressen kommen aus Tabelle bzw. Cache, nur der Rest geht
+    #           als ein GET_MANY an Discovery. "*" fragt alle Teilnehmer außer
+    #           dem Anfragenden ab.
+    #  @param targets Liste von Handles oder "*"
+    #  @param timeout Timeout in Sekunden (Standard: self.timeout)
+    #  @return Future mit Dictionary handle → (IP, Port) oder None
+    def lookup_many(self, targets, timeout=None):
+        found, missing = {}, targets
+        if targets != "*":
+            missing = []
+            for target in dict.fromkeys(targets):
+                hit = self.peer_table.get(target) if self.peer_table is not None else None
+                hit = hit or self.cache.get(target)
+                if hit:
+                    found[target] = hit
+                else:
+                    missing.append(target)
+            if not missing:
+                fut = Future()
+                fut.set_result(found)
+                return fut
+        fut = Future()
+        def merge(inner):
+            if inner.exception() is not None:
+                fut.set_exception(inner.exception())
+            else:
+                fut.set_result({**found, **inner.result()})
+        self._request(["GET_MANY", self.requester, missing], timeout).add_done_callback(merge)
+        return fut
+
+    ## @brief Schickt eine Anfrage mit Request-ID und Antwortkanal an Discovery.
+    #  @param cmd Anfrage ohne req_id und Kanal
+    #  @return Future für die Antwort
+    def _request(self, cmd, timeout):
+        fut = Future()
+        req_id = f"{self.channel}-{next(self._ids)}"
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        with self._lock:
+            wake = not self._waiting or not self._deadlines or deadline < self._deadlines[0][0]
+            self._pending[req_id] = fut
+            heapq.heappush(self._deadlines, (deadline, req_id))
+        self.to_disc.put(cmd + [req_id, self.channel])
+        if wake:
+            # Dispatcher wartet ohne oder mit zu langem Timeout – aufwecken
+            self.reply_q.put(None)
+        return fut
+
+    ## @brief Blockierende Abfrage für einfache Aufrufer.
+    #  @param target Gesuchtes Handle
+    #  @param timeout Timeout in Sekunden
+    #  @return (IP, Port) oder None bei unbekanntem Teilnehmer oder Timeout
+    def resolve(self, target, timeout=None):
+        try:
+            return self.lookup(target, timeout).result()
+        except TimeoutError:
+            return None
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                wait = self._deadlines[0][0] - time.monotonic() if self._deadlines else None
+                self._waiting = wait is not None
+            try:
+                resp = self.reply_q.get(timeout=max(wait, 0) if wait is not None else None)
+            except queue.Empty:
+                resp = None
+            except (EOFError, OSError):
+                return
+            if isinstance(resp, list):
+                self._handle_reply(resp)
+            self._expire()
+
+    ## @brief Ordnet eine Antwort von Discovery dem wartenden Future zu.
+    #  @param resp ["FOUND", handle, ip, port, req_id], ["NOT_FOUND", handle, None, req_id],
+    #              ["FOUND_MANY", {handle: [ip, port] oder None}, req_id]
+    #              oder ein Delta ["PEERS", version, {neu}, [entfernt], {geändert}]
+    def _handle_reply(self, resp):
+        if resp and resp[0] == "PEERS" and len(resp) >= 4:
+            changed = resp[4] if len(resp) >= 5 else None
+            self.cache.apply_delta(resp[1], resp[2], resp[3], changed)
+            if self.on_peers:
+                self.on_peers(resp[2], resp[3], changed or {})
+            return
+        if not resp or resp[0] not in ("FOUND", "NOT_FOUND", "FOUND_MANY"):
+            return
+        if resp[0] == "FOUND":
+            self.cache.put(resp[1], resp[2], resp[3])
+        elif resp[0] == "FOUND_MANY":
+            result = {h: tuple(addr) if addr else None for h, addr in resp[1].items()}
+            for h, addr in result.items():
+                if addr:
+                    self.cache.put(h, *addr)
+        with self._lock:
+            fut = self._pending.pop(resp[-1], None)
+        if fut is None:
+            return  # verspätete Antwort nach Timeout
+        if resp[0] == "FOUND_MANY":
+            fut.set_result(result)
+        elif resp[0] == "FOUND":
+            fut.set_result((resp[2], resp[3]))
+        else:
+            fut.set_result(None)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, req_id = heapq.heappop(self._deadlines)
+                fut = self._pending.pop(req_id, None)
+                if fut is not None:
+                    expired.append(fut)
+            # Einträge bereits beantworteter Anfragen aus dem Heap räumen
+            while self._deadlines and self._deadlines[0][1] not in self._pending:
+                heapq.heappop(self._deadlines)
+        for fut in expired:
+            fut.set_exception(TimeoutError("Keine Antwort von Discovery"))
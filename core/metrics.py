@@ -0,0 +1,140 @@
+## @file metrics.py
+#  @brief Laufzeitkennzahlen: Zähler, Histogramme und periodische Ausgabe.
+#  @details Jeder Prozess führt eigene Kennzahlen. Zähler sind einfache
+#           Dictionaries, damit ein Erhöhen im heißen Pfad nur ein
+#           Dictionary-Zugriff ist. Histogramme zählen in Zweierpotenz-Buckets
+#           und liefern daraus Näherungen für p50/p99.
+#           Mit metrics_dump in der Konfiguration schreibt jeder Prozess
+#           regelmäßig eine JSON-Zeile in eine Datei oder schickt sie als
+#           Datagramm an einen Unix-Socket ("unix:/pfad").
+
+import json
+import time
+import socket
+import collections
+
+## @class Histogram
+#  @brief Werteverteilung in Zweierpotenz-Buckets.
+class Histogram:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * 64   # Bucket i: Werte < 2**i
+
+    ## @brief Nimmt einen Wert auf (nicht negativ, z. B. Mikrosekunden).
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.buckets[min(int(value).bit_length(), 63)] += 1
+
+    ## @brief Obergrenze des Buckets, in dem das p-Quantil liegt.
+    #  @param p Quantil in Prozent
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return float(min(1 << i, self.max))
+        return self.max
+
+    ## @brief Kennzahlen als Dictionary.
+    def snapshot(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(50), "p99": self.percentile(99), "max": self.max}
+
+## @class Metrics
+#  @brief Kennzahlen eines Prozesses.
+#  @details Nicht threadsicher; Zähler, die aus mehreren Threads erhöht werden,
+#           schützt der Aufrufer.
+class Metrics:
+    def __init__(self):
+        ## @var self.counters
+        #  @brief Einzelne Zähler (Name → Wert)
+        self.counters = collections.defaultdict(int)
+
+        ## @var self.groups
+        #  @brief Zählergruppen, z. B. Pakete je Befehl (Name → {Schlüssel → Wert})
+        self.groups = {}
+
+        ## @var self.histograms
+        #  @brief Histogramme (Name → Histogram)
+        self.histograms = {}
+
+        self.started = time.time()
+
+    ## @brief Liefert eine Zählergruppe und legt sie bei Bedarf an.
+    def group(self, name):
+        group = self.groups.get(name)
+        if group is None:
+            group = self.groups[name] = collections.defaultdict(int)
+        return group
+
+    ## @brief Liefert ein Histogramm und legt es bei Bedarf an.
+    def histogram(self, name):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram()
+        return hist
+
+    ## @brief Alle Kennzahlen als JSON-fähiges Dictionary.
+    #  @param extra Weitere Einträge (z. B. Queue-Längen), optional
+    def snapshot(self, extra=None):
+        snap = {"time": time.time(), "uptime": time.time() - self.started,
+                "counters": dict(self.counters),
+                "groups": {name: dict(group) for name, group in self.groups.items()},
+                "histograms": {name: hist.snapshot() for name, hist in self.histograms.items()}}
+        if extra:
+            snap.update(extra)
+        return snap
+
+## @brief Länge einer multiprocessing-Queue.
+#  @return Anzahl Einträge oder None (qsize fehlt z. B. unter macOS)
+def queue_depth(q):
+    if q is None:
+        return None
+    try:
+        return q.qsize()
+    except (NotImplementedError, OSError):
+        return None
+
+## @brief Formatiert eine Zählergruppe als "a 3, b 1" (absteigend).
+def format_group(group, limit=8):
+    items = sorted(group.items(), key=lambda kv: -kv[1])
+    text = ", ".join(f"{k} {v}" for k, v in items[:limit])
+    if len(items) > limit:
+        text += f", … ({len(items) - limit} weitere)"
+    return text or "–"
+
+## @class MetricsDump
+#  @brief Schreibt Schnappschüsse als JSON-Zeilen in eine Datei oder an einen Unix-Socket.
+class MetricsDump:
+    ## @brief Konstruktor
+    #  @param target Dateipfad oder "unix:/pfad/zum/socket" (Datagramm-Socket)
+    #  @param process Name des Prozesses, wird in jede Zeile geschrieben
+    def __init__(self, target, process):
+        self.target = target
+        self.process = process
+        self._sock = None
+        if target.startswith("unix:") and hasattr(socket, "AF_UNIX"):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+
+    ## @brief Schreibt einen Schnappschuss; Fehler werden ignoriert (kein Leser, volle Platte).
+    def write(self, snapshot):
+        line = json.dumps({"process": self.process, **snapshot}, default=str)
+        try:
+            if self._sock is not None:
+                self._sock.sendto(line.encode(), self.target[len("unix:"):])
+            else:
+                with open(self.target, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError:
+            pass
@@ -0,0 +1,37 @@
+## @file netinfo.py
+#  @brief Ermittelt einmalig die lokale IP-Adresse.
+#  @details main.py fragt die Schnittstelle beim Start einmal ab und legt das
+#           Ergebnis als "local_ip" in der Konfiguration ab. Network und CLI
+#           erhalten die Konfiguration und müssen daher nicht erneut prüfen.
+
+import socket
+
+## @var FALLBACK_IP
+#  @brief Adresse, wenn keine Route nach außen existiert
+FALLBACK_IP = "127.0.0.1"
+
+_cached = None
+
+## @brief Bestimmt die Adresse der Schnittstelle mit der Standardroute.
+#  @details connect() auf einem UDP-Socket sendet nichts, der Kernel wählt nur
+#           die Route und damit die Absenderadresse aus.
+#  @return IP-Adresse als String, FALLBACK_IP ohne Netz
+def probe_local_ip():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(("8.8.8.8", 80))
+        return s.getsockname()[0]
+    except OSError:
+        return FALLBACK_IP
+    finally:
+        s.close()
+
+## @brief Lokale IP-Adresse aus der Konfiguration, sonst einmal pro Prozess ermittelt.
+#  @param config Konfigurationsdaten (Schlüssel "local_ip"), optional
+def local_ip(config=None):
+    global _cached
+    if config and config.get("local_ip"):
+        return config["local_ip"]
+    if _cached is None:
+        _cached = probe_local_ip()
+    return _cached
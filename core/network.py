@@ -2,18 +2,278 @@
 #  @brief Netzwerkmodul für den BSRN-Chat
 #  @details Verwaltet UDP-Broadcasts, TCP-Bildempfang und leitet Befehle weiter zwischen CLI und Discovery.
 
-import socket, select, json
+import socket, selectors
 import time
 from multiprocessing import current_process
 import uuid
 import math
 import threading
+import collections
+import heapq
+import itertools
+import struct
+import sys
+from core.lookup import PeerLookup
+from core.image_handler import receive_image, spool_image, REPLY_BUSY
+from core.udp_transfer import ChunkSender, ChunkReassembler
+from core.image_store import stored_path, store_root, file_digest
+from core import wire
+from core import compression
+from core.netinfo import local_ip
+from core.metrics import Metrics, MetricsDump, Histogram, queue_depth, format_group
+
+## @var UDP_BUFSIZE
+#  @brief Größe der wiederverwendeten Empfangspuffer (maximale Datagrammgröße)
+UDP_BUFSIZE = 65535
+
+## @var MAX_TEXT
+#  @brief Obergrenze für entpackte MSGZ-Texte in Bytes
+MAX_TEXT = 1024 * 1024
+
+## @var REMOTE_TO_DISCOVERY
+#  @brief Befehle von außen, die Discovery erreichen dürfen; alles andere
+#         (IMG_FILE, MEMBERS, GET_QUEUE, STATS, …) kommt nur aus dem eigenen Prozess
+REMOTE_TO_DISCOVERY = frozenset({"MSG", "IMG", "JOIN", "LEAVE", "KNOWNUSERS", "HEARTBEAT"})
+
+## @brief Prüft, ob msg mindestens count Felder nach dem Befehl hat und diese Strings sind.
+def _has_strings(msg, count):
+    return len(msg) > count and all(isinstance(v, str) for v in msg[1:count + 1])
+
+## @brief Wandelt einen Port aus einem Datagramm um.
+#  @return Port als int oder None, wenn der Wert kein gültiger Port ist
+def _parse_port(value):
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        return None
+    return port if 0 < port < 65536 else None
+
+## @var SO_RXQ_OVFL
+#  @brief Socket-Option für den Drop-Zähler des Kernels (nur Linux)
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40 if sys.platform.startswith("linux") else None)
+
+## @class QueueBridge
+#  @brief Macht eine multiprocessing-Queue für selectors weckbar.
+#  @details Ein Hintergrund-Thread blockiert auf der Queue, sammelt die Einträge
+#           und weckt den Selector über ein Socket-Paar. Die Hauptschleife holt
+#           anschließend alle anstehenden Einträge auf einmal ab.
+class QueueBridge:
+    ## @brief Konstruktor
+    #  @param queue Zu überbrückende Queue (None: nur lokale Einträge über post())
+    def __init__(self, queue=None):
+        self.queue = queue
+        self._items = collections.deque()
+        self._rsock, self._wsock = socket.socketpair()
+        self._rsock.setblocking(False)
+        self._wsock.setblocking(False)
+        if queue is not None:
+            threading.Thread(target=self._pump, daemon=True).start()
+
+    ## @brief Dateideskriptor für den Selector
+    def fileno(self):
+        return self._rsock.fileno()
+
+    ## @brief Reiht einen Eintrag aus dem eigenen Prozess ein und weckt den Selector.
+    #  @param item Beliebiger Eintrag
+    def post(self, item):
+        self._items.append(item)
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wsock.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            pass  # Puffer voll: ein Wecksignal steht ohnehin an
+
+    def _pump(self):
+        while True:
+            try:
+                item = self.queue.get()
+            except (EOFError, OSError):
+                return  # Queue wurde beim Beenden geschlossen
+            self._items.append(item)
+            self._wake()
+
+    ## @brief Anzahl wartender Einträge in der Queue und bereits übernommener, noch nicht abgeholter.
+    #  @details Der Pump-Thread leert die Queue sofort, ein Rückstau steht daher meist in _items.
+    @property
+    def depth(self):
+        return (queue_depth(self.queue) or 0) + len(self._items)
+
+    ## @brief Holt alle anstehenden Einträge ab.
+    #  @return Liste der Einträge in Eingangsreihenfolge
+    def drain(self):
+        try:
+            while self._rsock.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        items = []
+        while self._items:
+            items.append(self._items.popleft())
+        return items
+
+## @class ImageServer
+#  @brief TCP-Server für den Bildempfang mit begrenzter Nebenläufigkeit.
+#  @details Jede Verbindung läuft in einem eigenen Thread; ein Semaphor begrenzt
+#           die gleichzeitigen Übertragungen. Ist das Limit erreicht, wartet eine
+#           neue Verbindung bis zu slot_wait Sekunden auf einen Platz und erhält
+#           sonst REPLY_BUSY, damit der Sender sofort auf UDP ausweicht, statt in
+#           seinen Timeout zu laufen (der Kernel nimmt Verbindungen auch ohne
+#           accept() an). Höchstens max_waiting Verbindungen warten gleichzeitig,
+#           weitere weist der Accept-Thread sofort ab. Jede Verbindung hat einen
+#           Lese-Timeout, damit ein hängender Sender keinen Platz blockiert.
+class ImageServer:
+    ## @brief Konstruktor
+    #  @param port TCP-Port
+    #  @param imagepath Zielordner für empfangene Bilder
+    #  @param out_q Queue für Meldungen an die CLI
+    #  @param to_disc Queue an Discovery, das empfangene Bilder übernimmt (IMG_FILE)
+    #  @param max_workers Maximale Anzahl gleichzeitiger Übertragungen
+    #  @param backlog Länge des Listen-Backlogs
+    #  @param timeout Lese-Timeout pro Verbindung in Sekunden
+    #  @param have Funktion have(sha256) → bool für bereits gespeicherte Bilder, optional
+    #  @param allow_zlib True erlaubt komprimierte Bildströme
+    #  @param slot_wait Sekunden, die eine Verbindung auf einen freien Platz wartet
+    #  @param max_waiting Höchstzahl Verbindungen, die gleichzeitig auf einen Platz warten
+    def __init__(self, port, imagepath, out_q, to_disc, max_workers=4, backlog=64, timeout=10.0, have=None,
+                 allow_zlib=False, slot_wait=1.0, max_waiting=16):
+        self.port = port
+        self.imagepath = imagepath
+        self.out_q = out_q
+        self.to_disc = to_disc
+        self.have = have
+        self.allow_zlib = allow_zlib
+        self.max_workers = max_workers
+        self.backlog = backlog
+        self.timeout = timeout
+        self.slot_wait = slot_wait
+
+        ## @var self.active
+        #  @brief Anzahl laufender Übertragungen
+        self.active = 0
+
+        ## @var self.completed
+        #  @brief Anzahl abgeschlossener Übertragungen
+        self.completed = 0
+
+        ## @var self.rejected
+        #  @brief Anzahl mit REPLY_BUSY abgewiesener Verbindungen
+        self.rejected = 0
+
+        ## @var self.total_bytes
+        #  @brief Insgesamt empfangene Bilddaten in Bytes
+        self.total_bytes = 0
+
+        ## @var self.total_seconds
+        #  @brief Summe der Übertragungsdauern in Sekunden
+        self.total_seconds = 0.0
+
+        ## @var self.rates
+        #  @brief Verteilung der Übertragungsraten in MB/s
+        self.rates = Histogram()
+
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._admitted = threading.BoundedSemaphore(max_workers + max_waiting)  # Handler-Threads insgesamt
+        self._lock = threading.Lock()
+
+    ## @brief Startet den Accept-Thread.
+    def start(self):
+        tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        tcp_sock.bind(('', self.port))
+        tcp_sock.listen(self.backlog)
+        print(f"[TCP-ImageServer] Lauscht auf Port {self.port} (max. {self.max_workers} gleichzeitig)")
+        threading.Thread(target=self._accept_loop, args=(tcp_sock,), daemon=True).start()
+
+    def _accept_loop(self, tcp_sock):
+        while True:
+            try:
+                conn, addr = tcp_sock.accept()
+            except OSError:
+                time.sleep(0.1)  # z. B. EMFILE: kurz warten statt im Kreis zu drehen
+                continue
+            if not self._admitted.acquire(blocking=False):
+                self._reject_busy(conn, 0)  # ohne zu warten, der Accept-Thread darf nicht hängen
+                continue
+            try:
+                threading.Thread(target=self._handle, args=(conn, addr), daemon=True).start()
+            except RuntimeError:  # kein Thread mehr möglich
+                self._admitted.release()
+                self._reject_busy(conn, 0)
+
+    ## @brief Weist eine Verbindung ab, für die kein Platz frei wurde.
+    #  @param timeout Sekunden, die auf den Header des Senders gewartet wird (0: nur Anstehendes lesen)
+    def _reject_busy(self, conn, timeout):
+        with self._lock:
+            self.rejected += 1
+        try:
+            with conn:
+                conn.settimeout(timeout)
+                conn.send(REPLY_BUSY)
+                conn.shutdown(socket.SHUT_WR)
+                conn.recv(4096)  # Header lesen, sonst setzt close() die Verbindung vor der Antwort zurück
+        except OSError:
+            pass
+
+    def _handle(self, conn, addr):
+        try:
+            if self._slots.acquire(timeout=self.slot_wait):
+                self._receive(conn, addr)
+            else:
+                self._reject_busy(conn, self.slot_wait)
+        finally:
+            self._admitted.release()
+
+    ## @brief Empfängt ein Bild über eine Verbindung mit belegtem Platz.
+    def _receive(self, conn, addr):
+        with self._lock:
+            self.active += 1
+        started = time.monotonic()
+        try:
+            with conn:
+                conn.settimeout(self.timeout)
+                result = receive_image(conn, self.imagepath, self.have, self.allow_zlib)
+            if result and result[1] is None:
+                # Bild liegt schon im Speicher, nichts übertragen
+                sender, _, size, filename, digest = result
+                self.to_disc.put(["IMG_FILE", sender, None, None, size, filename, digest])
+            elif result:
+                sender, tmp_path, size, filename, digest = result
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self.completed += 1
+                    self.total_bytes += size
+                    self.total_seconds += elapsed
+                    self.rates.observe(size / max(elapsed, 1e-6) / 1e6)
+                    active = self.active - 1
+                # Speichern und Öffnen übernimmt Discovery im Hintergrund
+                self.to_disc.put(["IMG_FILE", sender, None, tmp_path, size, filename, digest])
+                self.out_q.put(f"[TCP] {size / 1024:.0f} KB in {elapsed:.2f} s "
+                               f"({size / max(elapsed, 1e-6) / 1e6:.1f} MB/s), weitere aktive Übertragungen: {active}")
+        except Exception as e:
+            self.out_q.put(f"[Fehler beim Empfangen über TCP von {addr[0]}] {e}")
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+
+    ## @brief Kennzahlen des Bildservers.
+    #  @return Dictionary mit active, completed, rejected, total_bytes, mb_per_s, rates
+    def stats(self):
+        with self._lock:
+            rate = self.total_bytes / self.total_seconds / 1e6 if self.total_seconds else 0.0
+            return {"active": self.active, "completed": self.completed, "rejected": self.rejected,
+                    "total_bytes": self.total_bytes, "mb_per_s": rate, "rates": self.rates.snapshot()}
 
 ## @class Network
 #  @brief Netzwerk-Komponente des BSRN-Chatprogramms.
 #  @details Startet TCP-Server für Bilder, verarbeitet UDP-Broadcasts und synchronisiert Teilnehmerdaten.
 class Network:
-    def __init__(self, username, port, in_q, out_q, to_disc, from_disc, config):
+    def __init__(self, username, port, in_q, out_q, to_disc, from_disc, config, lookup_q=None, peer_table=None):
+        self._timers = []  # Heap aus (Zeitpunkt, Nummer, Callback)
+        self._timer_seq = itertools.count()
+
         ## @var self.username
         #  @brief Benutzername dieses Clients
         self.username   = username
@@ -42,15 +302,48 @@ class Network:
         #  @brief Konfigurationsdaten (z. B. imagepath, whoisport)
         self.config     = config
 
-        # Lokale IP-Adresse beim Start ermitteln
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            s.connect(("8.8.8.8", 80))
-            self.local_ip = s.getsockname()[0]
-        except:
-            self.local_ip = "127.0.0.1"
-        finally:
-            s.close()
+        ## @var self.lookup_q
+        #  @brief Eigener Antwortkanal für Adressabfragen bei Discovery
+        self.lookup_q   = lookup_q
+
+        ## @var self.peer_table
+        #  @brief Teilnehmertabelle von Discovery im Shared Memory (optional)
+        self.peer_table = peer_table
+
+        ## @var self.wire_format
+        #  @brief "auto" (binär nur an Teilnehmer, die es per JOIN anbieten), "json" oder "binary"
+        self.wire_format = config.get("wire_format", "auto")
+
+        ## @var self.capabilities
+        #  @brief Eigene Capabilities, die mit JOIN und KNOWNUSERS verschickt werden
+        self.capabilities = [] if self.wire_format == "json" else [wire.CAP_BINARY]
+
+        ## @var self.codecs
+        #  @brief Eigene Kompressionsverfahren in der Reihenfolge der Vorliebe (leer = aus)
+        self.codecs = list(config.get("compression_codecs", compression.CODECS)) if config.get("compression", True) else []
+        self.capabilities += self.codecs
+
+        ## @var self.compress_threshold
+        #  @brief Texte ab dieser Größe (Bytes) werden komprimiert, falls der Empfänger es kann
+        self.compress_threshold = config.get("compress_threshold", 1024)
+
+        ## @var self.peer_caps
+        #  @brief Capabilities anderer Teilnehmer ((IP, Port) → Menge)
+        self.peer_caps  = {}
+
+        ## @var self.participants
+        #  @brief Aus KNOWNUSERS/JOIN/LEAVE bekannte Teilnehmer (handle → (IP, Port))
+        self.participants = {}
+
+        ## @var self.members_version
+        #  @brief Version der an Discovery geschickten Mitglieder-Deltas
+        self.members_version = 0
+
+        self._pending_members = ({}, {})   # (neu, geändert) seit dem letzten Delta
+        self._who_window_armed = False
+
+        # Lokale IP-Adresse: von main.py einmal ermittelt und über die Konfiguration geteilt
+        self.local_ip = local_ip(self.config)
 
         ## @var self.udp
         #  @brief UDP-Socket für Broadcast und Empfang
@@ -67,204 +360,680 @@ class Network:
         self.broadcast_udp.bind(('', self.config['whoisport']))
         self.broadcast_udp.setblocking(False)
 
+        ## @var self.multicast_group
+        #  @brief Multicast-Gruppe für JOIN/LEAVE/WHO/HEARTBEAT oder None (Broadcast)
+        self.multicast_group = self.config.get("multicast_group") or None
+        if self.multicast_group:
+            self._join_multicast()
+
+        ## @var self.udp_stats
+        #  @brief Empfangszähler: Datagramme, vom Kernel verworfene und zu große (abgeschnittene)
+        self.udp_stats = {"datagrams": 0, "kernel_drops": 0, "overruns": 0}
+
+        ## @var self.metrics
+        #  @brief Laufzeitkennzahlen (Pakete und Bytes je Befehl, Fehler)
+        self.metrics = Metrics()
+        self._counters = self.metrics.counters
+        self._packets_in = self.metrics.group("packets_in")
+        self._packets_out = self.metrics.group("packets_out")
+
+        self._rx_buffers = {}      # Socket → wiederverwendeter Empfangspuffer
+        self._kernel_drops = {}    # Socket → letzter Stand des Kernel-Drop-Zählers
+        self._track_drops = False
+        for sock in (self.udp, self.broadcast_udp):
+            if self.config.get("udp_rcvbuf"):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, int(self.config["udp_rcvbuf"]))
+            self._rx_buffers[sock] = memoryview(bytearray(UDP_BUFSIZE))
+            self._kernel_drops[sock] = 0
+        if SO_RXQ_OVFL is not None and hasattr(socket.socket, "recvmsg_into"):
+            try:
+                for sock in (self.udp, self.broadcast_udp):
+                    sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self._track_drops = True
+                self._ancbufsize = socket.CMSG_SPACE(4)
+            except OSError:
+                pass
+
     ## @brief Startet den TCP-Server zum Bildempfang (Port+100)
     def start_tcp_image_server(self):
-        def handler():
-            tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            tcp_sock.bind(('', self.port + 100))  # z. B. TCP auf Port+100
-            tcp_sock.listen(5)
-            print(f"[TCP-ImageServer] Lauscht auf Port {self.port + 100}")
-            while True:
-                conn, addr = tcp_sock.accept()
-                print(f"[TCP-Server] Verbindung angenommen von {addr}")
-                with conn:
-                    data = b""
-                    while True:
-                        part = conn.recv(4096)
-                        if not part:
-                            break
-                        data += part
-                    if data:
-                        try:
-                            import json, base64
-                            from core.image_handler import save_and_open_image
-                            decoded = json.loads(data.decode())
-                            sender, filename, img_b64 = decoded
-                            image_data = base64.b64decode(img_b64)
-                            path = save_and_open_image(sender, image_data, self.config['imagepath'])
-                            self.out_q.put(f"[{sender}] Bild erhalten: {path}")
-                        except Exception as e:
-                            self.out_q.put(f"[Fehler beim Empfangen über TCP] {e}")
-        threading.Thread(target=handler, daemon=True).start()
+        ## @var self.image_server
+        #  @brief Nebenläufiger TCP-Bildserver
+        self.image_server = ImageServer(self.port + 100, self.config['imagepath'], self.out_q, self.to_disc,
+                                        max_workers=self.config.get("image_workers", 4),
+                                        backlog=self.config.get("image_backlog", 64),
+                                        timeout=self.config.get("image_timeout", 10.0),
+                                        have=self._have_image,
+                                        allow_zlib=compression.CAP_ZLIB in self.codecs,
+                                        slot_wait=self.config.get("image_slot_wait", 1.0),
+                                        max_waiting=self.config.get("image_max_waiting", 16))
+        self.image_server.start()
 
+    ## @brief Prüft, ob ein Bild bereits im inhaltsadressierten Speicher liegt.
+    #  @param digest sha256 als Hex-String
+    def _have_image(self, digest):
+        if not self.config.get("image_store", True):
+            return False
+        return stored_path(store_root(self.config['imagepath']), digest) is not None
 
+    ## @brief Sendet ein Paket an einen Teilnehmer, binär falls ausgehandelt.
     def _send_unicast(self, cmd, ip, port):
-        packet = json.dumps(cmd).encode()
+        cmd = self._maybe_compress(cmd, (ip, port))
+        packet = wire.encode(cmd, self._wants_binary((ip, port)))
         self.udp.sendto(packet, (ip, port))
+        self._packets_out[cmd[0]] += 1
+        self._counters["bytes_out"] += len(packet)
+
+    ## @brief Ersetzt lange MSG-Texte durch ["MSGZ", sender, target, codec, daten].
+    #  @details Nur wenn der Empfänger den Codec angeboten hat und die Kompression
+    #           tatsächlich spart; sonst bleibt das Paket unverändert.
+    #  @param cmd Paket als Liste
+    #  @param addr (IP, Port) des Empfängers
+    def _maybe_compress(self, cmd, addr):
+        if cmd[0] != "MSG" or len(cmd) < 4 or not isinstance(cmd[3], str) or len(cmd[3]) < self.compress_threshold:
+            return cmd
+        codec = compression.choose(self.codecs, self.peer_caps.get(addr, ()))
+        if codec is None:
+            return cmd
+        raw = cmd[3].encode()
+        packed = compression.compress(raw, codec)
+        # base64 in JSON kostet ein Drittel mehr
+        cost = len(packed) if self._wants_binary(addr) else len(packed) * 4 // 3
+        if cost >= len(raw):
+            return cmd
+        return ["MSGZ", cmd[1], cmd[2], codec, packed]
 
     def _send_broadcast(self, cmd):
-        packet = json.dumps(cmd).encode()
+        packet = wire.encode(cmd, self.wire_format == "binary")
+        self._send_discovery(packet, cmd[0])
+
+    ## @brief Sendet ein fertiges Paket an alle: per Multicast, sonst per Broadcast.
+    #  @param packet Kodiertes Paket
+    #  @param kind Befehl für die Statistik
+    def _send_discovery(self, packet, kind):
+        self._packets_out[kind] += 1
+        self._counters["bytes_out"] += len(packet)
+        if self.multicast_group:
+            try:
+                self.udp.sendto(packet, (self.multicast_group, self.config['whoisport']))
+                return
+            except OSError:
+                pass  # z. B. keine Route für Multicast – Broadcast versuchen
         self.udp.sendto(packet, ('<broadcast>', self.config['whoisport']))
 
+    ## @brief Tritt der Multicast-Gruppe bei und stellt TTL und Schnittstelle ein.
+    #  @details Empfangen wird weiter über broadcast_udp (an whoisport gebunden),
+    #           gesendet über self.udp. Schlägt der Beitritt fehl, bleibt es bei Broadcast.
+    def _join_multicast(self):
+        group = self.multicast_group
+        iface = self.config.get("multicast_interface", "0.0.0.0")
+        try:
+            mreq = socket.inet_aton(group) + socket.inet_aton(iface)
+            self.broadcast_udp.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            self.udp.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, int(self.config.get("multicast_ttl", 1)))
+            self.udp.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1 if self.config.get("multicast_loop", True) else 0)
+            if iface != "0.0.0.0":
+                self.udp.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(iface))
+        except OSError as e:
+            print(f"[Network] Multicast-Gruppe {group} nicht verfügbar ({e}), verwende Broadcast")
+            self.multicast_group = None
+
+    ## @brief Prüft, ob an eine Adresse binär gesendet werden soll.
+    #  @param addr (IP, Port) des Empfängers
+    def _wants_binary(self, addr):
+        if self.wire_format == "binary":
+            return True
+        return self.wire_format == "auto" and wire.CAP_BINARY in self.peer_caps.get(addr, ())
+
+    ## @brief Merkt sich die Capabilities eines Teilnehmers.
+    #  @param addr (IP, Port) des Teilnehmers
+    #  @param caps Kommagetrennte Capabilities, z. B. "bin1"
+    def _learn_caps(self, addr, caps):
+        if isinstance(caps, str) and caps:
+            self.peer_caps.setdefault(addr, set()).update(caps.split(","))
+
     ## @brief Hauptschleife: Verarbeitet CLI-Befehle, sendet/empfängt über UDP/TCP.
+    #  @details Ereignisgesteuert über selectors: wacht sofort bei UDP-Daten,
+    #           CLI-Befehlen oder Discovery-Antworten auf und arbeitet pro
+    #           Aufwachen alles Anstehende ab.
     def run(self):
         print(f"[{current_process().name}] Network gestartet")
         self.start_tcp_image_server()
+
+        ## @var self.cli_bridge
+        #  @brief Weckbare Brücke für die Queue von der CLI
+        self.cli_bridge = QueueBridge(self.in_q)
+
+        ## @var self.disc_bridge
+        #  @brief Weckbare Brücke für die Queue vom Discovery-Prozess
+        self.disc_bridge = QueueBridge(self.from_disc)
+
+        ## @var self.events
+        #  @brief Weckbare Brücke für Ereignisse aus eigenen Threads (z. B. Lookup-Ergebnisse)
+        self.events = QueueBridge()
+
+        ## @var self.lookup
+        #  @brief Korrelierte Adressabfrage bei Discovery
+        self.lookup = None
+        if self.lookup_q is not None:
+            self.lookup = PeerLookup(self.to_disc, self.lookup_q, "net", self.username,
+                                     self.config.get("lookup_timeout", 2.0),
+                                     self.config.get("peer_cache_ttl", 60.0),
+                                     self.peer_table, on_peers=self._on_peer_delta)
+
+        ## @var self.chunk_sender
+        #  @brief Ausgehende UDP-Bildübertragungen (Rückfallebene zu TCP)
+        self.chunk_sender = ChunkSender(self._send_unicast, self.out_q,
+                                        chunk_size=self.config.get("udp_chunk_size", 1024),
+                                        window=self.config.get("udp_window", 64))
+
+        ## @var self.reassembler
+        #  @brief Reassembly eingehender UDP-Bildübertragungen
+        self.reassembler = ChunkReassembler(self._send_unicast, self._on_udp_image, self.config['imagepath'],
+                                            limit=self.config.get("udp_reassembly_limit", 32 * 1024 * 1024),
+                                            timeout=self.config.get("udp_reassembly_timeout", 15.0),
+                                            have=self._have_image)
+        self._transfer_tick_armed = False
+
+        ## @var self.heartbeat_interval
+        #  @brief Abstand der HEARTBEAT-Broadcasts in Sekunden (0 schaltet sie ab)
+        self.heartbeat_interval = self.config.get("heartbeat_interval", 10.0)
+        if self.heartbeat_interval:
+            self.call_later(self.heartbeat_interval, self._send_heartbeat)
+
+        ## @var self.metrics_dump
+        #  @brief Periodische Ausgabe der Kennzahlen (Datei oder Unix-Socket), optional
+        self.metrics_dump = None
+        if self.config.get("metrics_dump"):
+            self.metrics_dump = MetricsDump(self.config["metrics_dump"], "network")
+            self.call_later(self.config.get("metrics_interval", 10.0), self._dump_metrics)
+
+        sel = selectors.DefaultSelector()
+        sel.register(self.udp, selectors.EVENT_READ, self._on_udp_readable)
+        sel.register(self.broadcast_udp, selectors.EVENT_READ, self._on_udp_readable)
+        sel.register(self.cli_bridge, selectors.EVENT_READ, self._on_cli_ready)
+        sel.register(self.disc_bridge, selectors.EVENT_READ, self._on_disc_ready)
+        sel.register(self.events, selectors.EVENT_READ, self._on_events)
+
         while True:
-            # 1) Lokale Queue von CLI
+            for key, _ in sel.select(self._run_timers()):
+                try:
+                    key.data(key.fileobj)
+                except Exception as e:
+                    self._handler_error(key.data, e)
+
+    ## @brief Zählt und meldet eine Ausnahme aus einem Handler, statt den Prozess zu beenden.
+    #  @param handler Auslösender Handler
+    #  @param error Ausnahme
+    def _handler_error(self, handler, error):
+        self._counters["handler_errors"] += 1
+        print(f"[Network] Fehler in {getattr(handler, '__name__', handler)}: {error!r}")
+
+    ## @brief Plant einen Callback in der Hauptschleife ein.
+    #  @param delay Verzögerung in Sekunden
+    #  @param callback Funktion ohne Argumente
+    def call_later(self, delay, callback):
+        heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timer_seq), callback))
+
+    ## @brief Führt fällige Timer aus.
+    #  @return Sekunden bis zum nächsten Timer oder None
+    def _run_timers(self):
+        while self._timers:
+            when, _, callback = self._timers[0]
+            delay = when - time.monotonic()
+            if delay > 0:
+                return delay
+            heapq.heappop(self._timers)
             try:
-                cmd = self.in_q.get_nowait()
-            except:
-                cmd = None
-
-            if cmd:
-                if not (isinstance(cmd, list) and cmd and cmd[0] in ("IMG_HEADER", "IMG_CHUNK") and isinstance(cmd[-2], str) and isinstance(cmd[-1], int)):
-                    self.to_disc.put(cmd)
-
-                if isinstance(cmd, list) and cmd[0] == "KNOWNUSERS" and len(cmd) >= 3:
-                    target_ip = cmd[-2]
-                    target_port = cmd[-1]
-                    net_cmd = cmd[:-2]
-                    self._send_unicast(net_cmd, target_ip, target_port)
-                    continue
-
-                # Unicast für Nachrichten mit Ziel-IP/Port
-                if isinstance(cmd, list) and cmd and cmd[0] in ("IMG", "IMG_CHUNK", "IMG_HEADER") and len(cmd) >= 5 and isinstance(cmd[-2], str) and isinstance(cmd[-1], int):
-                    # ["IMG", sender, target, img_b64, ip, port]
-                    ip = cmd[-2]
-                    port = cmd[-1]
-                    net_cmd = cmd[:-2]
-                    
-                    if cmd[0] == "IMG":
-                        import base64
-                        from core.image_handler import chunk_image_data
-                        img_b64 = cmd[3]
-                        chunks = chunk_image_data(img_b64, 512)
-                        msg_id = uuid.uuid4().hex
-                        for idx, chunk in enumerate(chunks):
-                            self.in_q.put(["IMG_CHUNK", msg_id, idx, len(chunks), chunk, ip, port])
-                        break  # exit after enqueuing all chunks once
-                    else:
-                        self._send_unicast(net_cmd, ip, port)
-                elif isinstance(cmd, list) and cmd[0] == "IMG_CHUNK" and len(cmd) >= 7 and isinstance(cmd[-2], str) and isinstance(cmd[-1], int):
-                    # Already handled above, but keep for clarity
-                    ip = cmd[-2]
-                    port = cmd[-1]
-                    net_cmd = cmd[:-2]
-                    self._send_unicast(net_cmd, ip, port)
-                elif isinstance(cmd, list) and cmd[0] == "MSG" and len(cmd) >= 6 and isinstance(cmd[-2], str) and isinstance(cmd[-1], int):
-                    ip = cmd[-2]
-                    port = cmd[-1]
-                    msg_cmd = cmd[:-2]
-                    
-                    self._send_unicast(msg_cmd, ip, port)
-                    continue
+                callback()
+            except Exception as e:
+                self._handler_error(callback, e)
+        return None
+
+    ## @brief Sorgt dafür, dass laufende UDP-Übertragungen regelmäßig geprüft werden.
+    def _arm_transfer_tick(self):
+        if not self._transfer_tick_armed:
+            self._transfer_tick_armed = True
+            self.call_later(0.05, self._transfer_tick)
+
+    def _transfer_tick(self):
+        self._transfer_tick_armed = False
+        busy = self.chunk_sender.tick()
+        busy = self.reassembler.expire() or busy
+        if busy:
+            self._arm_transfer_tick()
+
+    ## @brief Kündigt die eigene Anwesenheit per Broadcast an und plant den nächsten Heartbeat.
+    #  @details ["HEARTBEAT", handle, ip, port] ist ein kleines Datagramm; der
+    #           lokale Discovery-Dienst erhält ["HEARTBEAT", handle] ohne Adresse,
+    #           damit der eigene Eintrag nicht abläuft.
+    def _send_heartbeat(self):
+        self.call_later(self.heartbeat_interval, self._send_heartbeat)
+        try:
+            self._send_broadcast(["HEARTBEAT", self.username, self.local_ip, self.port])
+        except OSError:
+            pass  # nächster Versuch beim nächsten Intervall
+        self.to_disc.put(["HEARTBEAT", self.username])
+
+    ## @brief Kennzahlen des Prozesses einschließlich Queue-Längen und Bildserver.
+    def metrics_snapshot(self):
+        cli_bridge, disc_bridge = getattr(self, "cli_bridge", None), getattr(self, "disc_bridge", None)
+        queues = {"cli_to_net": cli_bridge.depth if cli_bridge else queue_depth(self.in_q),
+                  "net_to_cli": queue_depth(self.out_q), "cli_to_disc": queue_depth(self.to_disc),
+                  "disc_to_cli": disc_bridge.depth if disc_bridge else queue_depth(self.from_disc)}
+        image_server = getattr(self, "image_server", None)
+        return self.metrics.snapshot({"udp": dict(self.udp_stats), "queues": queues,
+                                      "tcp_images": image_server.stats() if image_server else None})
+
+    ## @brief Schreibt die Kennzahlen und plant den nächsten Durchlauf.
+    def _dump_metrics(self):
+        self.call_later(self.config.get("metrics_interval", 10.0), self._dump_metrics)
+        self.metrics_dump.write(self.metrics_snapshot())
+
+    ## @brief Formatiert die Kennzahlen für STATS.
+    #  @return Mehrzeiliger Text
+    def _format_stats(self):
+        snap = self.metrics_snapshot()
+        st, counters, groups = snap["udp"], snap["counters"], snap["groups"]
+        lines = [f"[Network] {st['datagrams']} Datagramme empfangen, "
+                 f"{st['kernel_drops']} vom Kernel verworfen, {st['overruns']} Überläufe",
+                 f"[Network] Pakete ein ({counters.get('bytes_in', 0) / 1024:.1f} KB): "
+                 f"{format_group(groups.get('packets_in', {}))}",
+                 f"[Network] Pakete aus ({counters.get('bytes_out', 0) / 1024:.1f} KB): "
+                 f"{format_group(groups.get('packets_out', {}))}",
+                 f"[Network] Nicht dekodierbar: {counters.get('decode_errors', 0)}, "
+                 f"abgewiesen: {counters.get('rejected', 0)}, "
+                 f"Handlerfehler: {counters.get('handler_errors', 0)}",
+                 "[Network] Queues: " + ", ".join(f"{name} {'?' if depth is None else depth}"
+                                                  for name, depth in snap["queues"].items())]
+        tcp = snap["tcp_images"]
+        if tcp:
+            rates = tcp["rates"]
+            lines.append(f"[Network] TCP-Bilder: {tcp['completed']} empfangen, {tcp['active']} aktiv, "
+                         f"{tcp['rejected']} abgewiesen, "
+                         f"Ø {tcp['mb_per_s']:.1f} MB/s (p50 ≤ {rates['p50']:.0f}, max {rates['max']:.1f} MB/s)")
+        return "\n".join(lines)
+
+    ## @brief Berechnet den Hash eines zu sendenden Bildes (Worker-Thread) und startet dann den Versand.
+    #  @param cmd ["IMG", sender, target, pfad, ip, port]
+    def _hash_udp_image(self, cmd):
+        try:
+            digest = file_digest(cmd[3])
+        except OSError as e:
+            self.out_q.put(f"[UDP Fehler] Bild '{cmd[3]}' konnte nicht gelesen werden: {e}")
+            return
+        self.events.post(lambda: self._start_udp_image(cmd, digest))
+
+    ## @brief Startet eine UDP-Bildübertragung in der Hauptschleife.
+    def _start_udp_image(self, cmd, digest):
+        try:
+            self.chunk_sender.start(cmd[1], cmd[2], cmd[3], cmd[-2], cmd[-1], digest)
+        except OSError as e:
+            self.out_q.put(f"[UDP Fehler] Bild '{cmd[3]}' konnte nicht gelesen werden: {e}")
+            return
+        self._arm_transfer_tick()
+
+    ## @brief Speichert ein per UDP vollständig empfangenes Bild.
+    def _on_udp_image(self, sender, target, filename, path, size, digest):
+        self.to_disc.put(["IMG_FILE", sender, target, path, size, filename, digest])
+
+    ## @brief Legt ein Bild im alten Format ["IMG", sender, target, img_b64] als Spooldatei ab.
+    #  @details Discovery erhält nur ["IMG_FILE", sender, target, pfad, größe] statt
+    #           des base64-Texts.
+    def _spool_legacy_image(self, msg):
+        try:
+            data = wire.payload_bytes(msg[3])
+            with spool_image(self.config['imagepath']) as f:
+                f.write(data)
+        except (ValueError, TypeError, OSError) as e:
+            self.out_q.put(f"[⚠️ Fehler beim Dekodieren des Bildes] {e}")
+            return
+        self.to_disc.put(["IMG_FILE", msg[1], msg[2], f.name, len(data)])
+
+    ## @brief Arbeitet alle anstehenden Befehle der CLI ab.
+    #  @param bridge Die auslösende QueueBridge
+    def _on_cli_ready(self, bridge):
+        for cmd in bridge.drain():
+            try:
+                self._handle_local(cmd)
+            except Exception as e:
+                self._handler_error(self._handle_local, e)
+
+    ## @brief Leitet alle anstehenden Discovery-Antworten weiter.
+    #  @param bridge Die auslösende QueueBridge
+    def _on_disc_ready(self, bridge):
+        for resp in bridge.drain():
+            self.out_q.put(resp)
+
+    ## @brief Führt Ereignisse aus eigenen Threads in der Hauptschleife aus.
+    #  @param bridge Die auslösende QueueBridge
+    def _on_events(self, bridge):
+        for callback in bridge.drain():
+            try:
+                callback()
+            except Exception as e:
+                self._handler_error(callback, e)
+
+    ## @brief Liest alle anstehenden Datagramme eines UDP-Sockets.
+    #  @details Leert den Socket vollständig in einen wiederverwendeten Puffer.
+    #           Unter Linux liefert SO_RXQ_OVFL den Drop-Zähler des Kernels mit,
+    #           abgeschnittene Datagramme werden als Überlauf gezählt.
+    #  @param sock Lesebereiter UDP-Socket
+    def _on_udp_readable(self, sock):
+        view = self._rx_buffers[sock]
+        stats = self.udp_stats
+        while True:
+            try:
+                if self._track_drops:
+                    n, ancdata, flags, addr = sock.recvmsg_into([view], self._ancbufsize)
+                    for level, kind, cdata in ancdata:
+                        if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(cdata) >= 4:
+                            self._note_kernel_drops(sock, struct.unpack("=I", cdata[:4])[0])
+                    truncated = bool(flags & socket.MSG_TRUNC)
                 else:
-                    packet = json.dumps(cmd).encode()
-                    # Maximale Chunk-Größe für Bilddaten (512 Bytes pro Chunk)
-                    max_size = 512
-                    if len(packet) <= max_size:
-                        # Direkt senden, für JOIN, LEAVE, WHO immer Broadcast
-                        if isinstance(cmd, list) and cmd and cmd[0] in ("JOIN", "LEAVE", "WHO"):
-                            self._send_broadcast(cmd)
-                    else:
-                        # Nachricht in Chunks aufteilen
-                        msg_id = uuid.uuid4().hex
-                        chunks = [packet[i:i+max_size] for i in range(0, len(packet), max_size)]
-                        total = len(chunks)
-                        for idx, chunk in enumerate(chunks):
-
-                            wrapper = ["IMG_CHUNK", msg_id, idx, total, chunk.decode('latin1')]
-                            data = json.dumps(wrapper).encode()
-
-                            sent = False
-                            while not sent:
-                                try:
-                                    self.udp.sendto(data, ('<broadcast>', self.config['whoisport']))
-                                    sent = True
-                                except OSError as e:
-                                    if getattr(e, 'errno', None) == 55:
-                                        time.sleep(0.05)
-                                    else:
-                                        raise
-                            time.sleep(0.01)
-
-            # 2) Remotes empfangen
-            ready, _, _ = select.select([self.udp, self.broadcast_udp], [], [], 0.05)
-            for sock in ready:
-                data, addr = sock.recvfrom(4096)
-                try:
-                    msg = json.loads(data.decode())
-                    sender_ip, sender_port = addr[0], addr[1]
-                    if isinstance(msg, list) and msg and msg[0] == "WHO":
-                        if not (sender_ip == "127.0.0.1" or (self.username == msg[1] and self.port == sender_port)):
-                            user_string = f"{self.username} {self.local_ip} {self.port}"
-                            known_msg = ["KNOWNUSERS", user_string]
-                            pkt = json.dumps(known_msg).encode()
-                            self.udp.sendto(pkt, (sender_ip, sender_port))
-                        continue
-                    if isinstance(msg, list) and msg[0] == "MSG" and len(msg) >= 3:
-                        if msg[1] == self.username:
-                            continue
-                        # Autoreply-Logik bei Inaktivität
-                        if self.config.get("inactive", False):
-                            autoreply = self.config.get("autoreply", "")
-                            sender = msg[1]
-                            self.to_disc.put(["GET_QUEUE", self.username, sender])
-                            found = None
-                            while True:
-                                try:
-                                    resp = self.from_disc.get(timeout=1)
-                                    if isinstance(resp, list) and resp and resp[0] == "FOUND" and resp[1] == sender:
-                                        found = resp
-                                        break
-                                    elif isinstance(resp, list) and resp and resp[0] == "NOT_FOUND" and resp[1] == sender:
-                                        break
-                                except:
-                                    break
-
-                            if found:
-                                ip = found[2]
-                                port = found[3]
-                                reply_cmd = ["MSG", self.username, sender, autoreply, ip, port]
-                                self._send_unicast(reply_cmd, ip, port)
-                    
-                    if isinstance(msg, list) and msg and msg[0] == "KNOWNUSERS" and len(msg) >= 2:
-                        user_entries = msg[1].split(", ")
-                        if not hasattr(self, "participants"):
-                            self.participants = {}
-                        for entry in user_entries:
-                            parts = entry.strip().split(" ")
-                            if len(parts) == 3:
-                                h, ip, p = parts[0], parts[1], int(parts[2])
-                                if h not in self.participants:
-                                    self.participants[h] = (ip, p)
-                        final_list = [
-                            f"{h} {ip} {port}" for h, (ip, port) in self.participants.items()
-                        ]
-                        output = "KNOWNUSERS " + ", ".join(final_list)
-                        self.out_q.put(output)
-                        for h, (ip, port) in self.participants.items():
-                            self.to_disc.put(["JOIN", h, ip, port])
-                        continue
+                    n, addr = sock.recvfrom_into(view)
+                    truncated = n == len(view)
+            except (BlockingIOError, InterruptedError):
+                return
+            if truncated:
+                stats["overruns"] += 1
+                continue
+            stats["datagrams"] += 1
+            try:
+                self._handle_remote(view[:n], addr)
+            except Exception as e:
+                self._handler_error(self._handle_remote, e)
 
-                    if len(msg) >= 4 and msg[0] == "JOIN":
-                        handle = msg[1]
-                        ip     = msg[2]
-                        port   = int(msg[3])
-                        if handle == self.username and port == self.port:
-                            continue
-                        self.to_disc.put(["JOIN", handle, ip, port])
-                    else:
+    ## @brief Übernimmt den kumulativen Drop-Zähler eines Sockets.
+    def _note_kernel_drops(self, sock, count):
+        previous = self._kernel_drops[sock]
+        if count != previous:
+            self._kernel_drops[sock] = count
+            self.udp_stats["kernel_drops"] += (count - previous) & 0xFFFFFFFF
 
-                        self.to_disc.put(msg)
-                except json.JSONDecodeError:
-                    continue
+    ## @brief Sendet die Autoreply, sobald die Adressabfrage beantwortet ist.
+    #  @param sender Handle des Absenders
+    #  @param fut Future der Adressabfrage
+    def _send_autoreply(self, sender, fut):
+        try:
+            found = fut.result()
+        except TimeoutError:
+            return
+        if not found:
+            return
+        ip, port = found
+        autoreply = self.config.get("autoreply", "")
+        reply_cmd = ["MSG", self.username, sender, autoreply, ip, port]
+        self._send_unicast(reply_cmd, ip, port)
+
+    ## @brief Verarbeitet einen Befehl aus der lokalen Queue.
+    #  @param cmd Befehl als Liste
+    def _handle_local(self, cmd):
+        if not cmd:
+            return
+        if isinstance(cmd, list) and cmd[0] == "JOIN" and len(cmd) >= 4:
+            port = _parse_port(cmd[3])
+            if port is None:
+                self.out_q.put(f"[Network] JOIN mit ungültigem Port verworfen: {cmd[3]!r}")
+                return
+            cmd = cmd[:3] + [port] + cmd[4:]
+        if isinstance(cmd, list) and cmd and cmd[0] == "MSG_MULTI" and len(cmd) >= 5:
+            self.to_disc.put(["MSG_MULTI", cmd[1], cmd[2], cmd[3], [r[0] for r in cmd[4]]])
+            self._send_multi(cmd)
+            return
+        if not (isinstance(cmd, list) and cmd and cmd[0] in ("IMG", "IMG_HEADER", "IMG_CHUNK") and isinstance(cmd[-2], str) and isinstance(cmd[-1], int)):
+            self.to_disc.put(cmd)
+
+        if isinstance(cmd, list) and cmd[0] == "STATS":
+            self.out_q.put(self._format_stats())
+            return
+
+        if isinstance(cmd, list) and cmd[0] == "KNOWNUSERS" and len(cmd) >= 3:
+            target_ip = cmd[-2]
+            target_port = cmd[-1]
+            net_cmd = cmd[:-2]
+            self._send_unicast(net_cmd, target_ip, target_port)
+            return
 
-            # 3) Antworten von Discovery an CLI shutteln
+        # Bild per UDP-Chunks: ["IMG", sender, target, pfad, ip, port]
+        if isinstance(cmd, list) and cmd[0] == "IMG" and len(cmd) >= 6 and isinstance(cmd[-2], str) and isinstance(cmd[-1], int):
+            # Hash in einem eigenen Thread, damit große Dateien die Hauptschleife nicht aufhalten
+            threading.Thread(target=self._hash_udp_image, args=(cmd,), daemon=True).start()
+        # Unicast für Nachrichten mit Ziel-IP/Port
+        elif isinstance(cmd, list) and cmd and cmd[0] in ("IMG_CHUNK", "IMG_HEADER") and len(cmd) >= 5 and isinstance(cmd[-2], str) and isinstance(cmd[-1], int):
+            ip = cmd[-2]
+            port = cmd[-1]
+            net_cmd = cmd[:-2]
+            self._send_unicast(net_cmd, ip, port)
+        elif isinstance(cmd, list) and cmd[0] == "MSG" and len(cmd) >= 6 and isinstance(cmd[-2], str) and isinstance(cmd[-1], int):
+            ip = cmd[-2]
+            port = cmd[-1]
+            msg_cmd = cmd[:-2]
+
+            self._send_unicast(msg_cmd, ip, port)
+        else:
+            if isinstance(cmd, list) and len(cmd) == 4 and cmd[0] == "JOIN" and cmd[1] == self.username and self.capabilities:
+                # Eigene Capabilities mit dem JOIN ankündigen (ältere Clients ignorieren das Feld)
+                cmd = cmd + [",".join(self.capabilities)]
+            packet = wire.encode(cmd, self.wire_format == "binary")
+            # Maximale Chunk-Größe für Bilddaten (512 Bytes pro Chunk)
+            max_size = 512
+            if len(packet) <= max_size:
+                # Direkt senden, für JOIN, LEAVE, WHO immer Broadcast
+                if isinstance(cmd, list) and cmd and cmd[0] in ("JOIN", "LEAVE", "WHO"):
+                    self._send_broadcast(cmd)
+            else:
+                # Nachricht in Chunks aufteilen
+                msg_id = uuid.uuid4().hex
+                chunks = [packet[i:i+max_size] for i in range(0, len(packet), max_size)]
+                total = len(chunks)
+                for idx, chunk in enumerate(chunks):
+
+                    wrapper = ["IMG_CHUNK", msg_id, idx, total, chunk]
+                    data = wire.encode(wrapper, self.wire_format == "binary")
+
+                    sent = False
+                    while not sent:
+                        try:
+                            self._send_discovery(data, "IMG_CHUNK")
+                            sent = True
+                        except OSError as e:
+                            if getattr(e, 'errno', None) == 55:
+                                time.sleep(0.05)
+                            else:
+                                raise
+                    time.sleep(0.01)
+
+    ## @brief Sendet eine Nachricht an mehrere Empfänger.
+    #  @details ["MSG_MULTI", sender, bezeichnung, text, [[handle, ip, port], …], ([unbekannt])]
+    #           Das MSG-Paket wird je Kodierung (JSON/binär, Codec) nur einmal
+    #           erzeugt und dann in einer Schleife an alle Adressen gesendet.
+    #           Danach folgt eine Zeile mit dem Ergebnis je Empfänger.
+    def _send_multi(self, cmd):
+        sender, label, text, recipients = cmd[1], cmd[2], cmd[3], cmd[4]
+        unknown = cmd[5] if len(cmd) >= 6 else []
+        msg = ["MSG", sender, label, text]
+        packets = {}
+        status = []
+        for handle, ip, port in recipients:
+            addr = (ip, int(port))
+            caps = self.peer_caps.get(addr, set())
+            key = (self._wants_binary(addr), frozenset(caps.intersection(self.codecs)))
+            packet = packets.get(key)
+            if packet is None:
+                packet = packets[key] = wire.encode(self._maybe_compress(msg, addr), key[0])
+            try:
+                self.udp.sendto(packet, addr)
+                self._packets_out["MSG"] += 1
+                self._counters["bytes_out"] += len(packet)
+                status.append(f"{handle} ✓")
+            except OSError as e:
+                status.append(f"{handle} ✗ ({e.strerror or e})")
+        status += [f"{handle} ✗ (unbekannt)" for handle in unknown]
+        self.out_q.put(f"[Network] MSG an {label}: " + ", ".join(status))
+
+    ## @brief Verarbeitet Pakete der UDP-Bildübertragung.
+    #  @param msg IMG_HEADER, IMG_CHUNK, IMG_ACK oder IMG_ABORT
+    #  @param addr Absenderadresse
+    def _handle_transfer(self, msg, addr):
+        kind = msg[0]
+        try:
+            if kind == "IMG_HEADER":
+                self.reassembler.on_header(msg, addr)
+            elif kind == "IMG_CHUNK":
+                self.reassembler.on_chunk(msg)
+            elif kind == "IMG_ACK":
+                self.chunk_sender.on_ack(msg)
+            else:
+                self.chunk_sender.on_abort(msg)
+        except (ValueError, TypeError, IndexError):
+            return  # fehlerhaftes Paket verwerfen
+        self._arm_transfer_tick()
+
+    ## @brief Verarbeitet ein empfangenes Datagramm.
+    #  @param data Rohdaten
+    #  @param addr Absenderadresse (IP, Port)
+    def _handle_remote(self, data, addr):
+        self._counters["bytes_in"] += len(data)
+        try:
+            msg = wire.decode(data)
+        except ValueError:
+            self._counters["decode_errors"] += 1
+            return
+        if not isinstance(msg, list) or not msg or not isinstance(msg[0], str):
+            self._counters["decode_errors"] += 1
+            return
+        self._packets_in[msg[0]] += 1
+        sender_ip, sender_port = addr[0], addr[1]
+        if data[0] == wire.MAGIC:
+            # Wer binär sendet, versteht auch binär
+            self._learn_caps(addr, wire.CAP_BINARY)
+        if msg[0] == "MSGZ" and len(msg) >= 5:
             try:
-                resp = self.from_disc.get_nowait()
-                self.out_q.put(resp)
-            except:
-                pass
\ No newline at end of file
+                text = compression.decompress(wire.payload_bytes(msg[4]), msg[3], MAX_TEXT)
+                msg = ["MSG", msg[1], msg[2], text.decode()]
+            except (ValueError, TypeError):  # auch UnicodeDecodeError und binascii.Error
+                self._counters["decode_errors"] += 1
+                return
+        if msg[0] == "WHO":
+            # Nur das eigene Echo ignorieren; andere Instanzen auf demselben Rechner antworten
+            own = len(msg) >= 2 and self.username == msg[1] and self.port == sender_port
+            if not own:
+                user_string = f"{self.username} {self.local_ip} {self.port}"
+                known_msg = ["KNOWNUSERS", user_string]
+                if self.capabilities:
+                    known_msg.append(",".join(self.capabilities))
+                self._send_unicast(known_msg, sender_ip, sender_port)
+            return
+        if msg[0] in ("IMG_HEADER", "IMG_CHUNK", "IMG_ACK", "IMG_ABORT"):
+            self._handle_transfer(msg, addr)
+            return
+        if msg[0] == "MSG":
+            if not _has_strings(msg, 3):
+                self._counters["rejected"] += 1
+                return
+            if msg[1] == self.username:
+                return
+            # Autoreply-Logik bei Inaktivität: Adresse asynchron abfragen, senden in der Hauptschleife
+            if self.config.get("inactive", False) and self.lookup:
+                sender = msg[1]
+                fut = self.lookup.lookup(sender)
+                fut.add_done_callback(lambda f, s=sender: self.events.post(lambda: self._send_autoreply(s, f)))
+
+        if msg[0] == "KNOWNUSERS":
+            if not _has_strings(msg, 1):
+                self._counters["rejected"] += 1
+                return
+            if len(msg) >= 3:
+                self._learn_caps(addr, msg[2])
+            added, changed = self._pending_members
+            for entry in msg[1].split(", "):
+                parts = entry.strip().split(" ")
+                port = _parse_port(parts[2]) if len(parts) == 3 else None
+                if port is not None:
+                    h, entry_addr = parts[0], (parts[1], port)
+                    old = self.participants.get(h)
+                    if old == entry_addr:
+                        continue
+                    self.participants[h] = entry_addr
+                    if old is None or h in added:
+                        added[h] = list(entry_addr)
+                    else:
+                        changed[h] = list(entry_addr)
+            # Antworten sammeln, bis das WHO-Fenster schließt
+            self._arm_who_window()
+            return
+
+        if msg[0] == "IMG":
+            if not (_has_strings(msg, 2) and len(msg) >= 4):
+                self._counters["rejected"] += 1
+                return
+            self._spool_legacy_image(msg)
+            return
+
+        if msg[0] == "HEARTBEAT":
+            port = _parse_port(msg[3]) if len(msg) >= 4 else None
+            if port is None or not _has_strings(msg, 2):
+                self._counters["rejected"] += 1
+                return
+            handle, ip = msg[1], msg[2]
+            if handle == self.username and port == self.port:
+                return
+            self.participants[handle] = (ip, port)
+            self.to_disc.put(["HEARTBEAT", handle, ip, port])
+            return
+
+        if msg[0] == "JOIN":
+            port = _parse_port(msg[3]) if len(msg) >= 4 else None
+            if port is None or not _has_strings(msg, 2):
+                self._counters["rejected"] += 1
+                return
+            handle = msg[1]
+            ip     = msg[2]
+            if handle == self.username and port == self.port:
+                return
+            if len(msg) >= 5:
+                self._learn_caps((ip, port), msg[4])
+                self._learn_caps(addr, msg[4])
+            self.participants[handle] = (ip, port)
+            self.to_disc.put(["JOIN", handle, ip, port])
+        elif msg[0] == "LEAVE" and _has_strings(msg, 1):
+            self.participants.pop(msg[1], None)
+            self.to_disc.put(msg)
+        elif msg[0] in REMOTE_TO_DISCOVERY and msg[0] != "LEAVE":
+            self.to_disc.put(msg)
+        else:
+            self._counters["rejected"] += 1
+
+    ## @brief PEERS-Delta von Discovery (Dispatcher-Thread der Lookup); Entfernte gehen an die Hauptschleife.
+    def _on_peer_delta(self, added, removed, changed):
+        if removed:
+            self.events.post(lambda: self._forget_peers(removed))
+
+    ## @brief Entfernt Teilnehmer, die Discovery aufgegeben hat (LEAVE oder abgelaufene peer_ttl).
+    #  @details Sonst tauchen abgelaufene Teilnehmer mit der nächsten KNOWNUSERS-Tabelle wieder auf.
+    #  @param removed Entfernte Handles
+    def _forget_peers(self, removed):
+        added, changed = self._pending_members
+        for handle in removed:
+            self.participants.pop(handle, None)
+            added.pop(handle, None)
+            changed.pop(handle, None)
+
+    ## @brief Öffnet das Sammelfenster für WHO-Antworten, falls noch nicht offen.
+    def _arm_who_window(self):
+        if not self._who_window_armed:
+            self._who_window_armed = True
+            self.call_later(self.config.get("who_window", 0.3), self._close_who_window)
+
+    ## @brief Schließt das WHO-Fenster: ein Delta an Discovery, eine Tabelle an die UI.
+    def _close_who_window(self):
+        self._who_window_armed = False
+        added, changed = self._pending_members
+        if added or changed:
+            self.members_version += 1
+            self.to_disc.put(["MEMBERS", self.username, self.members_version, added, [], changed])
+            self._pending_members = ({}, {})
+        final_list = [
+            f"{h} {ip} {port}" for h, (ip, port) in self.participants.items()
+        ]
+        self.out_q.put("KNOWNUSERS " + ", ".join(final_list))
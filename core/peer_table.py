@@ -0,0 +1,214 @@
+## @file peer_table.py
+#  @brief Teilnehmertabelle im Shared Memory, lesbar ohne IPC.
+#  @details Discovery ist der einzige Schreiber. Alle anderen Prozesse lesen die
+#           Tabelle direkt aus dem gemeinsamen Speicher, ohne Queue und ohne Pickle.
+#           Aufbau: ein Kopf (Sequenzzähler, belegte und gelöschte Einträge), danach
+#           capacity Datensätze fester Größe als offene Hashtabelle (crc32 des
+#           Handles, lineare Sondierung).
+#           Konsistenz über ein Seqlock: Der Schreiber macht den Zähler vor einer
+#           Änderung ungerade und danach wieder gerade. Ein Leser wiederholt, wenn
+#           der Zähler ungerade war oder sich während des Lesens geändert hat.
+
+import struct
+import time
+import zlib
+from multiprocessing import shared_memory
+
+_HEADER = struct.Struct("<QII")           # seq, belegt, gelöscht
+_RECORD = struct.Struct("<BBBxH64s46s12x")  # zustand, len(handle), len(ip), port, handle, ip
+_DATA = 64                                # Beginn der Datensätze
+
+EMPTY, USED, DELETED = 0, 1, 2
+
+## @var MAX_HANDLE
+#  @brief Längere Handles (UTF-8) werden nicht eingetragen, Leser fragen dann Discovery
+MAX_HANDLE = 64
+
+## @class PeerTable
+#  @brief Hashtabelle handle → (IP, Port) in einem Shared-Memory-Segment.
+class PeerTable:
+    ## @brief Konstruktor; verwendet ein bestehendes Segment.
+    #  @param shm SharedMemory-Objekt
+    #  @param owner True für den Prozess, der das Segment angelegt hat
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+
+        ## @var self.capacity
+        #  @brief Anzahl Datensätze (Zweierpotenz)
+        self.capacity = (shm.size - _DATA) // _RECORD.size
+        self._mask = self.capacity - 1
+
+    ## @brief Legt ein neues, leeres Segment an.
+    #  @param capacity Gewünschte Anzahl Datensätze, wird auf eine Zweierpotenz aufgerundet
+    #  @return PeerTable
+    @classmethod
+    def create(cls, capacity=4096):
+        capacity = 1 << max(capacity - 1, 1).bit_length()
+        shm = shared_memory.SharedMemory(create=True, size=_DATA + capacity * _RECORD.size)
+        shm.buf[:] = bytes(shm.size)
+        return cls(shm, owner=True)
+
+    ## @brief Öffnet ein bestehendes Segment.
+    #  @param name Name des Segments
+    #  @return PeerTable
+    @classmethod
+    def attach(cls, name):
+        # Leser sind Kindprozesse von main und teilen dessen resource_tracker;
+        # freigegeben wird nur vom Besitzer in close()
+        return cls(shared_memory.SharedMemory(name=name))
+
+    ## @var name
+    #  @brief Name des Segments
+    @property
+    def name(self):
+        return self.shm.name
+
+    # Bei spawn/Pickle nur den Namen übertragen und im Zielprozess neu öffnen
+    def __reduce__(self):
+        return PeerTable.attach, (self.shm.name,)
+
+    ## @brief Schließt das Segment; der Besitzer gibt es zusätzlich frei.
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def _seq(self):
+        return _HEADER.unpack_from(self.buf)[0]
+
+    # ---------------------------------------------------------------- Lesen
+
+    ## @brief Sucht ein Handle ohne Sperre.
+    #  @param handle Gesuchtes Handle
+    #  @param retries Versuche, bevor bei dauernden Schreibzugriffen aufgegeben wird
+    #  @return (IP, Port) oder None, wenn unbekannt oder nicht konsistent lesbar
+    def get(self, handle, retries=100):
+        key = handle.encode()
+        if len(key) > MAX_HANDLE:
+            return None
+        for _ in range(retries):
+            before = self._seq()
+            if before & 1:
+                time.sleep(0)
+                continue
+            try:
+                result = self._probe(key)
+            except (UnicodeDecodeError, struct.error):
+                result = None  # halb geschriebener Datensatz, Zähler prüft das
+            if self._seq() == before:
+                return result
+        return None
+
+    def _probe(self, key):
+        buf = self.buf
+        idx = zlib.crc32(key) & self._mask
+        for _ in range(self.capacity):
+            off = _DATA + idx * _RECORD.size
+            state = buf[off]
+            if state == EMPTY:
+                return None
+            if state == USED and buf[off + 1] == len(key) and buf[off + 6:off + 6 + len(key)] == key:
+                _, _, ip_len, port, _, ip = _RECORD.unpack_from(buf, off)
+                return ip[:ip_len].decode(), port
+            idx = (idx + 1) & self._mask
+        return None
+
+    ## @brief Liest einen konsistenten Schnappschuss aller Einträge.
+    #  @return Dictionary handle → (IP, Port)
+    def snapshot(self):
+        while True:
+            before = self._seq()
+            if before & 1:
+                time.sleep(0)
+                continue
+            try:
+                entries = dict(self._entries())
+            except (UnicodeDecodeError, struct.error):
+                continue
+            if self._seq() == before:
+                return entries
+
+    def _entries(self):
+        for i in range(self.capacity):
+            state, h_len, ip_len, port, handle, ip = _RECORD.unpack_from(self.buf, _DATA + i * _RECORD.size)
+            if state == USED:
+                yield handle[:h_len].decode(), (ip[:ip_len].decode(), port)
+
+    # ------------------------------------------------------------- Schreiben
+
+    ## @brief Wendet Änderungen in einem Schreibvorgang an (nur Discovery).
+    #  @param upserts Neue oder geänderte Einträge (handle → (IP, Port))
+    #  @param removed Entfernte Handles
+    #  @return Anzahl Einträge, die mangels Platz nicht eingetragen wurden
+    def update(self, upserts, removed=()):
+        seq, used, deleted = _HEADER.unpack_from(self.buf)
+        _HEADER.pack_into(self.buf, 0, seq + 1, used, deleted)
+        skipped = 0
+        try:
+            for handle in removed:
+                slot, _ = self._find(handle.encode())
+                if slot is not None:
+                    self.buf[_DATA + slot * _RECORD.size] = DELETED
+                    used -= 1
+                    deleted += 1
+            for handle, (ip, port) in upserts.items():
+                if not (isinstance(handle, str) and isinstance(ip, str)):
+                    skipped += 1
+                    continue
+                try:
+                    port = int(port)
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                key, raw_ip = handle.encode(), ip.encode()
+                if len(key) > MAX_HANDLE or len(raw_ip) > 46 or not 0 <= port <= 0xFFFF:
+                    skipped += 1
+                    continue
+                slot, free = self._find(key)
+                if slot is None:
+                    if free is None or used + 1 > self.capacity * 3 // 4:
+                        skipped += 1
+                        continue
+                    if self.buf[_DATA + free * _RECORD.size] == DELETED:
+                        deleted -= 1
+                    used += 1
+                    slot = free
+                _RECORD.pack_into(self.buf, _DATA + slot * _RECORD.size,
+                                  USED, len(key), len(raw_ip), port, key, raw_ip)
+            if deleted > self.capacity // 4:
+                self._rebuild()
+                used, deleted = len(dict(self._entries())), 0
+        finally:
+            _HEADER.pack_into(self.buf, 0, seq + 2, used, deleted)
+        return skipped
+
+    ## @brief Sucht den Datensatz eines Handles.
+    #  @return (Index oder None, erster freier Index oder None)
+    def _find(self, key):
+        idx = zlib.crc32(key) & self._mask
+        free = None
+        for _ in range(self.capacity):
+            off = _DATA + idx * _RECORD.size
+            state = self.buf[off]
+            if state == EMPTY:
+                return None, free if free is not None else idx
+            if state == DELETED:
+                if free is None:
+                    free = idx
+            elif self.buf[off + 1] == len(key) and self.buf[off + 6:off + 6 + len(key)] == key:
+                return idx, free
+            idx = (idx + 1) & self._mask
+        return None, free
+
+    # Gelöschte Einträge verlängern die Sondierung, daher gelegentlich neu aufbauen
+    def _rebuild(self):
+        entries = list(self._entries())
+        self.buf[_DATA:] = bytes(len(self.buf) - _DATA)
+        for handle, (ip, port) in entries:
+            key, raw_ip = handle.encode(), ip.encode()
+            _, free = self._find(key)
+            _RECORD.pack_into(self.buf, _DATA + free * _RECORD.size,
+                              USED, len(key), len(raw_ip), port, key, raw_ip)
@@ -0,0 +1,149 @@
+## @file profiling.py
+#  @brief Optionales Profiling je Prozess mit cProfile und tracemalloc.
+#  @details Eingeschaltet über die Umgebungsvariable BSRN_PROFILE oder den
+#           Konfigurationsschlüssel "profile": "cpu", "mem" oder "cpu,mem".
+#           Jeder Prozess (network, discovery, cli/gui) schreibt beim Beenden
+#           und bei SIGUSR1 nach <profile_dir>/<name>-<pid>.prof (pstats) bzw.
+#           .tracemalloc. Das Verzeichnis kommt aus BSRN_PROFILE_DIR bzw.
+#           "profile_dir" (Standard ./profiles).
+#           cProfile erfasst nur den Thread, der die Hauptschleife ausführt, und
+#           misst dessen CPU-Zeit (time.thread_time): Blockierendes Warten auf
+#           Sockets und Queues taucht daher nicht als heiße Funktion auf.
+#           Zusammenfassung aller Dateien eines Verzeichnisses:
+#             python -m core.profiling [verzeichnis] [-n 25] [--sort cumulative]
+
+import os
+import sys
+import time
+import glob
+import signal
+import pstats
+import argparse
+import cProfile
+import tracemalloc
+import collections
+
+## @brief Liest die Einstellungen aus Umgebung und Konfiguration.
+#  @param config Konfigurationsdaten, optional
+#  @return (Menge der Modi {"cpu", "mem"}, Ausgabeverzeichnis)
+def profile_settings(config=None):
+    config = config or {}
+    raw = os.environ.get("BSRN_PROFILE") or config.get("profile") or ""
+    modes = {m.strip().lower() for m in str(raw).split(",") if m.strip()} & {"cpu", "mem"}
+    directory = os.environ.get("BSRN_PROFILE_DIR") or config.get("profile_dir") or "./profiles"
+    return modes, directory
+
+## @class ProcessProfiler
+#  @brief Profiliert die Hauptschleife eines Prozesses und schreibt die Ergebnisse.
+class ProcessProfiler:
+    ## @brief Konstruktor
+    #  @param name Name des Prozesses (Teil des Dateinamens)
+    #  @param modes Menge aus "cpu" und "mem"
+    #  @param directory Ausgabeverzeichnis
+    def __init__(self, name, modes, directory):
+        self.name = name
+        self.modes = modes
+        self.directory = directory
+        self.profiler = cProfile.Profile(time.thread_time) if "cpu" in modes else None
+        self._prefix = os.path.join(directory, f"{name}-{os.getpid()}")
+
+    ## @brief Startet die Messung und richtet die Signale ein.
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if "mem" in self.modes and not tracemalloc.is_tracing():
+            tracemalloc.start(int(os.environ.get("BSRN_TRACEMALLOC_FRAMES", "1")))
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump())
+        # terminate() schickt SIGTERM; als SystemExit läuft das finally in run() noch
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if self.profiler:
+            self.profiler.enable()
+
+    ## @brief Schreibt den aktuellen Stand, die Messung läuft weiter.
+    def dump(self):
+        if self.profiler:
+            self.profiler.disable()
+            try:
+                self.profiler.dump_stats(self._prefix + ".prof")
+            finally:
+                self.profiler.enable()
+        if tracemalloc.is_tracing():
+            tracemalloc.take_snapshot().dump(self._prefix + ".tracemalloc")
+        print(f"[Profiling] {self.name}: Profil geschrieben nach {self._prefix}.*")
+
+    ## @brief Beendet die Messung und schreibt das Ergebnis.
+    def stop(self):
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self._prefix + ".prof")
+        if tracemalloc.is_tracing():
+            tracemalloc.take_snapshot().dump(self._prefix + ".tracemalloc")
+            tracemalloc.stop()
+        print(f"[Profiling] {self.name}: Profil geschrieben nach {self._prefix}.*")
+
+## @brief Führt func aus, bei eingeschaltetem Profiling unter ProcessProfiler.
+#  @param name Name des Prozesses
+#  @param func Hauptschleife ohne Argumente
+#  @param config Konfigurationsdaten, optional
+#  @return Rückgabewert von func
+def run_profiled(name, func, config=None):
+    modes, directory = profile_settings(config)
+    if not modes:
+        return func()
+    profiler = ProcessProfiler(name, modes, directory)
+    profiler.start()
+    try:
+        return func()
+    finally:
+        profiler.stop()
+
+## @brief Gibt die heißesten Funktionen aller .prof-Dateien zusammengefasst aus.
+#  @param files Liste von pstats-Dateien
+#  @param top Anzahl Funktionen
+#  @param sort Sortierschlüssel für pstats (z. B. "tottime", "cumulative")
+def summarize_cpu(files, top=25, sort="tottime"):
+    by_process = collections.defaultdict(list)
+    for path in files:
+        by_process[os.path.basename(path).rsplit("-", 1)[0]].append(path)
+    for name, paths in sorted(by_process.items()):
+        stats = pstats.Stats(*paths)
+        print(f"== {name}: {len(paths)} Profil(e), {stats.total_tt:.3f} s CPU-Zeit in der Hauptschleife")
+    print(f"\n== Top {top} Funktionen über alle Prozesse (nach {sort})")
+    stats = pstats.Stats(*files)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+## @brief Gibt die größten Allokationsstellen aller .tracemalloc-Dateien aus.
+#  @param files Liste von Snapshot-Dateien
+#  @param top Anzahl Zeilen
+def summarize_mem(files, top=25):
+    sizes = collections.Counter()
+    counts = collections.Counter()
+    for path in files:
+        for stat in tracemalloc.Snapshot.load(path).statistics("lineno"):
+            frame = stat.traceback[0]
+            key = f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            sizes[key] += stat.size
+            counts[key] += stat.count
+    print(f"\n== Top {top} Allokationsstellen über {len(files)} Snapshot(s)")
+    for key, size in sizes.most_common(top):
+        print(f"{size / 1024:10.1f} KB {counts[key]:9d} Blöcke  {key}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Fasst die Profile aller Prozesse zusammen")
+    parser.add_argument("directory", nargs="?", default=profile_settings()[1])
+    parser.add_argument("-n", type=int, default=25, help="Anzahl Einträge")
+    parser.add_argument("--sort", default="tottime", help="pstats-Sortierung (tottime, cumulative, calls)")
+    args = parser.parse_args()
+
+    prof = sorted(glob.glob(os.path.join(args.directory, "*.prof")))
+    mem = sorted(glob.glob(os.path.join(args.directory, "*.tracemalloc")))
+    if not prof and not mem:
+        print(f"Keine Profile in {args.directory}")
+        return
+    if prof:
+        summarize_cpu(prof, args.n, args.sort)
+    if mem:
+        summarize_mem(mem, args.n)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+## @file renderer.py
+#  @brief Ausgabeschicht der CLI für hohen Nachrichtendurchsatz.
+#  @details Eingehende Nachrichten werden gesammelt formatiert und pro Takt mit
+#           einem einzigen Schreibvorgang ausgegeben. Unter patch_stdout zeichnet
+#           prompt_toolkit die Eingabezeile so nur einmal pro Takt neu statt
+#           einmal pro Zeile. Die Teilnehmertabelle wird nur neu erzeugt, wenn
+#           sich die Teilnehmer geändert haben.
+
+import re
+import sys
+import time
+import queue
+
+_IMAGE_RECEIVED = re.compile(r"^\[(.+)\] Bild erhalten: (.+?)(?: \(\d+ KB\))?$")
+
+## @class OutputRenderer
+#  @brief Liest Nachrichten aus einer Queue und gibt sie gebündelt aus.
+class OutputRenderer:
+    ## @brief Konstruktor
+    #  @param username Eigenes Handle (eigene Nachrichten werden nicht wiederholt)
+    #  @param interval Mindestabstand zwischen zwei Ausgaben in Sekunden
+    #  @param max_batch Höchstzahl Nachrichten pro Ausgabe
+    #  @param write Ausgabefunktion, Standard sys.stdout.write
+    def __init__(self, username, interval=0.05, max_batch=2000, write=None):
+        self.username = username
+        self.interval = interval
+        self.max_batch = max_batch
+        self.write = write
+
+        ## @var self.lines_written
+        #  @brief Anzahl ausgegebener Nachrichten
+        self.lines_written = 0
+
+        ## @var self.flushes
+        #  @brief Anzahl Schreibvorgänge
+        self.flushes = 0
+
+        self._own_prefix = f"[{username}]"
+        self._table_key = None
+        self._table_text = None
+        self._last_flush = 0.0
+
+    ## @brief Formatiert eine Nachricht.
+    #  @param msg Nachricht aus der Queue (String oder Liste)
+    #  @return Auszugebender Text oder None
+    def render(self, msg):
+        if isinstance(msg, str):
+            if msg.startswith("KNOWNUSERS "):
+                return self.render_known_users(msg[len("KNOWNUSERS "):])
+            if " Bild erhalten: " in msg:
+                m = _IMAGE_RECEIVED.match(msg)
+                if m:
+                    return f"{msg}\n[Hinweis] Bild gespeichert unter: {m.group(2)}"
+            if msg.startswith(self._own_prefix):
+                return None
+            return msg
+        if isinstance(msg, list) and msg and msg[0] == "KNOWNUSERS":
+            return None
+        return str(msg)
+
+    ## @brief Erzeugt die Teilnehmertabelle; unverändert bleibt die letzte Tabelle gültig.
+    #  @param users_str Teilnehmer als "name ip port, name ip port, …"
+    def render_known_users(self, users_str):
+        user_data = []
+        for entry in users_str.split(", "):
+            parts = entry.strip().split(" ")
+            if len(parts) == 3:
+                user_data.append(tuple(parts))
+        key = tuple(sorted(user_data, key=lambda x: (x[0].lower(), x)))
+        if key != self._table_key:
+            from prettytable import PrettyTable  # erst beim ersten WHO laden
+            t = PrettyTable(['Name', 'IP', 'Port'])
+            for name, ip, port in key:
+                if name == self.username:
+                    name += " 🟢 Du"
+                t.add_row((name, ip, port))
+            self._table_key = key
+            self._table_text = f"Bekannte Teilnehmer:\n{t}"
+        return self._table_text
+
+    ## @brief Hauptschleife: sammelt bis zum nächsten Takt und schreibt dann einmal.
+    #  @param source Queue mit eingehenden Nachrichten
+    def run(self, source):
+        while True:
+            batch = [source.get()]  # blockierend warten
+            deadline = self._last_flush + self.interval
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(source.get_nowait())
+                    continue
+                except queue.Empty:
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(source.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    ## @brief Formatiert einen Stapel und gibt ihn mit einem Schreibvorgang aus.
+    #  @param batch Liste von Nachrichten
+    def flush(self, batch):
+        lines = [text for text in map(self.render, batch) if text is not None]
+        self._last_flush = time.monotonic()
+        if not lines:
+            return
+        (self.write or sys.stdout.write)("\n".join(lines) + "\n")
+        self.lines_written += len(lines)
+        self.flushes += 1
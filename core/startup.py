@@ -0,0 +1,43 @@
+## @file startup.py
+#  @brief Zeitmessung des Programmstarts nach Phasen (--startup-profile).
+#  @details main.py setzt nach jeder Phase eine Marke. Zeiten, in denen auf
+#           Benutzereingaben gewartet wird, werden getrennt ausgewiesen und
+#           zählen nicht zur Zeit bis zur ersten Eingabezeile.
+
+import time
+
+## @class StartupProfile
+#  @brief Sammelt Marken und gibt sie als Tabelle aus.
+class StartupProfile:
+    ## @brief Konstruktor
+    #  @param enabled False macht alle Aufrufe wirkungslos
+    #  @param start perf_counter-Zeit des Programmstarts, sonst jetzt
+    def __init__(self, enabled=False, start=None):
+        self.enabled = enabled
+
+        ## @var self.phases
+        #  @brief Liste (Phase, Sekunden, wartet auf Benutzer)
+        self.phases = []
+
+        self._last = start if start is not None else time.perf_counter()
+
+    ## @brief Beendet die laufende Phase.
+    #  @param phase Name der Phase
+    #  @param user True, wenn die Phase aus Warten auf Eingaben bestand
+    def mark(self, phase, user=False):
+        now = time.perf_counter()
+        if self.enabled:
+            self.phases.append((phase, now - self._last, user))
+        self._last = now
+
+    ## @brief Gibt die Aufschlüsselung aus (nur wenn aktiviert).
+    def report(self):
+        if not self.enabled:
+            return
+        total = sum(seconds for _, seconds, user in self.phases if not user)
+        lines = ["[Start] Zeit bis zur ersten Eingabezeile:"]
+        for phase, seconds, user in self.phases:
+            note = "  (Benutzereingabe, nicht mitgezählt)" if user else ""
+            lines.append(f"  {phase:<28} {seconds * 1000:8.1f} ms{note}")
+        lines.append(f"  {'Summe':<28} {total * 1000:8.1f} ms")
+        print("\n".join(lines))
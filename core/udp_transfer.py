@@ -0,0 +1,347 @@
+## @file udp_transfer.py
+#  @brief Bildübertragung in UDP-Chunks mit Fenster, Reassembly und selektiver Wiederholung.
+#  @details Rückfallebene, wenn der TCP-Bildserver (Port+100) nicht erreichbar ist.
+#           Ablauf:
+#           - Sender: ["IMG_HEADER", msg_id, sender, target, filename, total, size, chunk_size, sha256]
+#           - Sender: ["IMG_CHUNK", msg_id, idx, total, daten] (höchstens window unbestätigt;
+#             daten sind roh im Binärformat und base64 in JSON, siehe wire.py)
+#           - Empfänger: ["IMG_ACK", msg_id, next_expected, highest, [fehlende idx], (vorhanden)]
+#             – vorhanden=1 bestätigt sofort alles, wenn der Empfänger das Bild schon hat
+#           - Empfänger: ["IMG_ABORT", msg_id, grund] bei Überlast oder ungültigem Header
+#           next_expected bestätigt kumulativ, die Fehlliste fordert Lücken gezielt nach.
+#           Eingehende Chunks landen an ihrem Offset direkt in einer Spooldatei im
+#           Bildordner; es wird kein Puffer in Bildgröße gehalten.
+
+import os
+import math
+import time
+import uuid
+from core.wire import payload_bytes
+from core.image_handler import spool_image
+
+## @var ACK_EVERY
+#  @brief Der Empfänger bestätigt spätestens nach so vielen neuen Chunks
+ACK_EVERY = 16
+
+## @var MAX_NACKS
+#  @brief Maximale Länge der Fehlliste in einem IMG_ACK
+MAX_NACKS = 64
+
+## @brief Sendet ein Datagramm; ein voller Sendepuffer gilt wie ein Paketverlust.
+#  @param send Funktion send(cmd, ip, port)
+#  @param cmd Paket als Liste
+#  @param addr (IP, Port)
+def _emit(send, cmd, addr):
+    try:
+        send(cmd, *addr)
+    except OSError:
+        pass  # wird per Timeout bzw. Fehlliste wiederholt
+
+## @class OutgoingTransfer
+#  @brief Zustand einer ausgehenden Übertragung.
+class OutgoingTransfer:
+    def __init__(self, msg_id, sender, target, path, addr, chunk_size, digest=None):
+        self.msg_id = msg_id
+        self.sender = sender
+        self.target = target
+        self.addr = addr
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        self.total = max(1, math.ceil(self.size / chunk_size))
+        self.file = open(path, "rb")
+        self.filename = os.path.basename(path)
+        self.started = False      # Header vom Empfänger bestätigt
+        self.header_sent = 0.0
+        self.base = 0             # kleinster unbestätigter Index
+        self.next_new = 0         # nächster noch nie gesendeter Index
+        self.inflight = {}        # idx → Zeitpunkt des letzten Sendens
+        self.begin = time.monotonic()
+        self.last_progress = self.begin
+        self.retransmits = 0
+        self.digest = digest      # sha256 (Hex), ohne Hash keine Deduplizierung beim Empfänger
+        self.skipped = False      # Empfänger hatte das Bild schon
+
+    ## @brief Liest einen Chunk aus der Datei.
+    def read_chunk(self, idx):
+        self.file.seek(idx * self.chunk_size)
+        return self.file.read(self.chunk_size)
+
+## @class ChunkSender
+#  @brief Sendet Bilder in Chunks mit Sendefenster und Wiederholung.
+class ChunkSender:
+    ## @brief Konstruktor
+    #  @param send Funktion send(cmd, ip, port) für ein Datagramm
+    #  @param out_q Queue für Meldungen an die CLI
+    #  @param chunk_size Nutzdaten pro Chunk in Bytes
+    #  @param window Maximale Anzahl unbestätigter Chunks
+    #  @param rto Wiederholungs-Timeout in Sekunden
+    #  @param give_up Abbruch nach so vielen Sekunden ohne Fortschritt
+    def __init__(self, send, out_q, chunk_size=1024, window=64, rto=0.2, give_up=10.0):
+        self.send = send
+        self.out_q = out_q
+        self.chunk_size = chunk_size
+        self.window = window
+        self.rto = rto
+        self.give_up = give_up
+
+        ## @var self.transfers
+        #  @brief Laufende Übertragungen (msg_id → OutgoingTransfer)
+        self.transfers = {}
+
+    ## @brief Startet eine Übertragung.
+    #  @param digest sha256 der Datei, vom Aufrufer außerhalb der Hauptschleife berechnet, optional
+    #  @return msg_id der Übertragung
+    def start(self, sender, target, path, ip, port, digest=None):
+        msg_id = uuid.uuid4().hex
+        t = OutgoingTransfer(msg_id, sender, target, path, (ip, port), self.chunk_size, digest)
+        self.transfers[msg_id] = t
+        self._send_header(t)
+        return msg_id
+
+    def _send_header(self, t):
+        t.header_sent = time.monotonic()
+        _emit(self.send, ["IMG_HEADER", t.msg_id, t.sender, t.target, t.filename, t.total, t.size,
+                          t.chunk_size, t.digest], t.addr)
+
+    def _send_chunk(self, t, idx):
+        data = t.read_chunk(idx)
+        t.inflight[idx] = time.monotonic()
+        _emit(self.send, ["IMG_CHUNK", t.msg_id, idx, t.total, data], t.addr)
+
+    def _fill_window(self, t):
+        while t.next_new < t.total and len(t.inflight) < self.window:
+            self._send_chunk(t, t.next_new)
+            t.next_new += 1
+
+    ## @brief Verarbeitet eine Bestätigung des Empfängers.
+    #  @param msg ["IMG_ACK", msg_id, next_expected, highest, [fehlende idx], (vorhanden)]
+    def on_ack(self, msg):
+        t = self.transfers.get(msg[1])
+        if t is None or len(msg) < 5:
+            return
+        if len(msg) >= 6 and msg[5]:
+            t.skipped = True
+            self._finish(t, None)
+            return
+        next_expected, highest, missing = int(msg[2]), int(msg[3]), set(msg[4])
+        now = time.monotonic()
+        t.started = True
+        if next_expected > t.base:
+            t.last_progress = now
+        t.base = max(t.base, next_expected)
+        if t.base >= t.total:
+            self._finish(t, None)
+            return
+        for idx in list(t.inflight):
+            if idx < t.base or (idx <= highest and idx not in missing):
+                del t.inflight[idx]
+        for idx in sorted(missing):
+            sent = t.inflight.get(idx)
+            if sent is None or now - sent >= self.rto / 2:
+                t.retransmits += 1
+                self._send_chunk(t, idx)
+        self._fill_window(t)
+
+    ## @brief Bricht eine Übertragung auf Wunsch des Empfängers ab.
+    #  @param msg ["IMG_ABORT", msg_id, grund]
+    def on_abort(self, msg):
+        t = self.transfers.get(msg[1])
+        if t is not None:
+            self._finish(t, msg[2] if len(msg) > 2 else "vom Empfänger abgebrochen")
+
+    ## @brief Wiederholt überfällige Pakete und erkennt hängende Übertragungen.
+    #  @return True, solange noch Übertragungen laufen
+    def tick(self):
+        now = time.monotonic()
+        for t in list(self.transfers.values()):
+            if now - t.last_progress > self.give_up:
+                self._finish(t, "keine Antwort vom Empfänger")
+                continue
+            if not t.started:
+                if now - t.header_sent >= self.rto:
+                    self._send_header(t)
+                continue
+            for idx, sent in list(t.inflight.items()):
+                if now - sent >= self.rto:
+                    t.retransmits += 1
+                    self._send_chunk(t, idx)
+            self._fill_window(t)
+        return bool(self.transfers)
+
+    def _finish(self, t, error):
+        del self.transfers[t.msg_id]
+        t.file.close()
+        if error:
+            self.out_q.put(f"[UDP Fehler] Bildversand an {t.target} fehlgeschlagen: {error}")
+            return
+        if t.skipped:
+            self.out_q.put(f"[UDP] {t.target} hat das Bild bereits – keine Übertragung nötig.")
+            return
+        elapsed = max(time.monotonic() - t.begin, 1e-6)
+        self.out_q.put(f"[UDP] Bild an {t.target} gesendet: {t.size / 1024:.0f} KB in {elapsed:.2f} s "
+                       f"({t.size / elapsed / 1e6:.1f} MB/s, {t.retransmits} Wiederholungen)")
+
+## @class IncomingTransfer
+#  @brief Zustand einer eingehenden Übertragung.
+class IncomingTransfer:
+    def __init__(self, msg_id, sender, target, filename, total, size, chunk_size, addr, spool, digest=None):
+        self.msg_id = msg_id
+        self.sender = sender
+        self.target = target
+        self.filename = filename
+        self.total = total
+        self.size = size
+        self.chunk_size = chunk_size
+        self.addr = addr
+        self.spool = spool        # Spooldatei im Bildordner
+        self.digest = digest      # vom Sender angebotener sha256
+        self.have = bytearray(total)
+        self.count = 0
+        self.next_expected = 0
+        self.highest = -1
+        self.since_ack = 0
+        self.last_activity = time.monotonic()
+
+    ## @brief Schließt und löscht die Spooldatei einer abgebrochenen Übertragung.
+    def discard(self):
+        self.spool.close()
+        try:
+            os.unlink(self.spool.name)
+        except OSError:
+            pass
+
+## @class ChunkReassembler
+#  @brief Setzt eingehende Chunks pro msg_id wieder zusammen.
+#  @details Die Summe aller laufenden Übertragungen ist durch limit begrenzt; inaktive
+#           Übertragungen verfallen nach timeout Sekunden.
+class ChunkReassembler:
+    ## @brief Konstruktor
+    #  @param send Funktion send(cmd, ip, port) für ein Datagramm
+    #  @param on_complete Callback on_complete(sender, target, filename, spoolpfad, größe, sha256);
+    #                     spoolpfad ist None, wenn das Bild schon vorhanden war
+    #  @param spool_dir Ordner für Spooldateien (der Bildordner)
+    #  @param limit Maximale Gesamtgröße aller laufenden Übertragungen in Bytes
+    #  @param timeout Verfallszeit inaktiver Übertragungen in Sekunden
+    #  @param have Funktion have(sha256) → bool, optional
+    def __init__(self, send, on_complete, spool_dir, limit=32 * 1024 * 1024, timeout=15.0, have=None):
+        self.send = send
+        self.on_complete = on_complete
+        self.spool_dir = spool_dir
+        self.have = have
+        self.limit = limit
+        self.timeout = timeout
+
+        ## @var self.incoming
+        #  @brief Laufende Übertragungen (msg_id → IncomingTransfer)
+        self.incoming = {}
+
+        ## @var self.buffered
+        #  @brief Angekündigte Gesamtgröße der laufenden Übertragungen in Bytes
+        self.buffered = 0
+
+        self._completed = {}  # msg_id → (addr, total, Zeitpunkt, schon vorhanden) für verspätete Duplikate
+
+    ## @brief Verarbeitet einen IMG_HEADER.
+    #  @details Header mit chunk_size <= 0, negativer Größe oder einer Chunkzahl, die
+    #           nicht zu Größe und chunk_size passt, werden vor jeder Belegung abgelehnt.
+    #  @param msg ["IMG_HEADER", msg_id, sender, target, filename, total, size, chunk_size, (sha256)]
+    #  @param addr Absenderadresse
+    def on_header(self, msg, addr):
+        if len(msg) < 8:
+            return
+        msg_id, sender, target, filename = msg[1], msg[2], msg[3], msg[4]
+        total, size, chunk_size = int(msg[5]), int(msg[6]), int(msg[7])
+        digest = msg[8] if len(msg) >= 9 else None
+        if chunk_size <= 0 or size < 0 or total != max(1, -(-size // chunk_size)):
+            _emit(self.send, ["IMG_ABORT", msg_id, "Ungültiger Header"], addr)
+            return
+        if msg_id in self._completed:
+            self._ack_completed(msg_id)
+            return
+        t = self.incoming.get(msg_id)
+        if t is None and digest and self.have and self.have(digest):
+            self._completed[msg_id] = (addr, total, time.monotonic(), 1)
+            self._ack_completed(msg_id)
+            self.on_complete(sender, target, filename, None, size, digest)
+            return
+        if t is None:
+            if size > self.limit - self.buffered:
+                _emit(self.send, ["IMG_ABORT", msg_id, "Empfangspuffer voll"], addr)
+                return
+            try:
+                spool = spool_image(self.spool_dir)
+            except OSError:
+                _emit(self.send, ["IMG_ABORT", msg_id, "Bild kann nicht gespeichert werden"], addr)
+                return
+            t = IncomingTransfer(msg_id, sender, target, filename, total, size, chunk_size, addr, spool, digest)
+            self.incoming[msg_id] = t
+            self.buffered += size
+        self._ack(t)
+
+    ## @brief Verarbeitet einen IMG_CHUNK.
+    #  @param msg ["IMG_CHUNK", msg_id, idx, total, daten]
+    def on_chunk(self, msg):
+        if len(msg) < 5:
+            return
+        msg_id, idx = msg[1], int(msg[2])
+        t = self.incoming.get(msg_id)
+        if t is None:
+            if msg_id in self._completed:
+                self._ack_completed(msg_id)
+            return
+        if not 0 <= idx < t.total:
+            return
+        t.last_activity = time.monotonic()
+        if not t.have[idx]:
+            data = payload_bytes(msg[4])
+            offset = idx * t.chunk_size
+            if offset + len(data) > t.size:
+                return
+            t.spool.seek(offset)
+            t.spool.write(data)
+            t.have[idx] = 1
+            t.count += 1
+            t.highest = max(t.highest, idx)
+            while t.next_expected < t.total and t.have[t.next_expected]:
+                t.next_expected += 1
+            t.since_ack += 1
+        if t.count == t.total:
+            self._complete(t)
+        elif t.since_ack >= ACK_EVERY or idx == t.total - 1:
+            self._ack(t)
+
+    def _ack(self, t):
+        t.since_ack = 0
+        missing = []
+        for idx in range(t.next_expected, t.highest + 1):
+            if not t.have[idx]:
+                missing.append(idx)
+                if len(missing) >= MAX_NACKS:
+                    break
+        _emit(self.send, ["IMG_ACK", t.msg_id, t.next_expected, t.highest, missing], t.addr)
+
+    def _ack_completed(self, msg_id):
+        addr, total, _, had = self._completed[msg_id]
+        _emit(self.send, ["IMG_ACK", msg_id, total, total - 1, [], had], addr)
+
+    def _complete(self, t):
+        del self.incoming[t.msg_id]
+        self.buffered -= t.size
+        self._completed[t.msg_id] = (t.addr, t.total, time.monotonic(), 0)
+        self._ack_completed(t.msg_id)
+        t.spool.close()
+        self.on_complete(t.sender, t.target, t.filename, t.spool.name, t.size, t.digest)
+
+    ## @brief Verwirft inaktive Übertragungen.
+    #  @return True, solange noch Zustand gehalten wird
+    def expire(self):
+        now = time.monotonic()
+        for msg_id, t in list(self.incoming.items()):
+            if now - t.last_activity > self.timeout:
+                del self.incoming[msg_id]
+                self.buffered -= t.size
+                t.discard()
+        for msg_id, (_, _, done, _) in list(self._completed.items()):
+            if now - done > self.timeout:
+                del self._completed[msg_id]
+        return bool(self.incoming or self._completed)
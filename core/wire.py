@@ -0,0 +1,145 @@
+## @file wire.py
+#  @brief Kodierung der SLCP-Datagramme: JSON oder kompaktes Binärformat.
+#  @details JSON-Pakete beginnen immer mit '[', Binärpakete mit dem Byte MAGIC.
+#           Der Empfänger erkennt das Format daher am ersten Byte.
+#           Binäraufbau: MAGIC, Typcode, Feldanzahl, danach ein struct-Header mit
+#           allen Zahlen und Längen und zuletzt die Bytes der Text- und Datenfelder.
+#           Bytes in JSON-Paketen werden base64-kodiert.
+#           Das Binärformat wird per JOIN ausgehandelt (Capability CAP_BINARY).
+
+import json
+import base64
+import struct
+
+## @var MAGIC
+#  @brief Erstes Byte eines Binärpakets
+MAGIC = 0xB5
+
+## @var CAP_BINARY
+#  @brief Capability-Kennung für das Binärformat
+CAP_BINARY = "bin1"
+
+# Feldarten: s = Text (Länge u16), S = Text (Länge u32), H = Zahl u16,
+# I = Zahl u32, B = Bytes (Länge u32), U = msg_id als 32 Hex-Zeichen (16 Bytes)
+_LEN_FMT = {"s": "H", "S": "I", "H": "H", "I": "I", "B": "I", "U": ""}
+
+_TYPES = {
+    "JOIN":       (1, "ssHs"),   # handle, ip, port, [capabilities]
+    "LEAVE":      (2, "s"),      # handle
+    "WHO":        (3, "s"),      # handle
+    "MSG":        (4, "ssS"),    # sender, target, text
+    "KNOWNUSERS": (5, "Ss"),     # nutzerliste, [capabilities]
+    "IMG_CHUNK":  (6, "UIIB"),   # msg_id, idx, total, daten
+    "HEARTBEAT":  (7, "ssH"),    # handle, ip, port
+    "MSGZ":       (8, "sssB"),   # sender, target, codec, komprimierter Text
+}
+
+_HEAD = struct.Struct("!BBB")
+
+def _build_tables():
+    by_name, by_code = {}, {}
+    for name, (code, kinds) in _TYPES.items():
+        # Ein struct pro möglicher Feldanzahl (optionale Felder am Ende)
+        structs = [struct.Struct("!" + "".join(_LEN_FMT[k] for k in kinds[:n])) for n in range(len(kinds) + 1)]
+        by_name[name] = (code, kinds, structs)
+        by_code[code] = (name, kinds, structs)
+    return by_name, by_code
+
+_BY_NAME, _BY_CODE = _build_tables()
+
+def _json_default(obj):
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(obj).decode("ascii")
+    raise TypeError(f"{type(obj).__name__} ist nicht JSON-serialisierbar")
+
+## @brief Kodiert ein Paket als JSON.
+#  @param cmd Paket als Liste
+#  @return Bytes
+def encode_json(cmd):
+    return json.dumps(cmd, default=_json_default).encode()
+
+## @brief Kodiert ein Paket im Binärformat.
+#  @param cmd Paket als Liste
+#  @return Bytes oder None, falls der Typ oder die Felder nicht darstellbar sind
+def encode_binary(cmd):
+    spec = _BY_NAME.get(cmd[0]) if cmd else None
+    if spec is None:
+        return None
+    code, kinds, structs = spec
+    n = len(cmd) - 1
+    if n > len(kinds):
+        return None
+    values, tails = [], []
+    try:
+        for kind, value in zip(kinds, cmd[1:]):
+            if kind in "sS":
+                raw = value.encode()
+                values.append(len(raw))
+                tails.append(raw)
+            elif kind in "HI":
+                values.append(int(value))
+            elif kind == "B":
+                values.append(len(value))
+                tails.append(value)
+            else:  # U
+                raw = bytes.fromhex(value)
+                if len(raw) != 16:
+                    return None
+                tails.append(raw)
+        head = _HEAD.pack(MAGIC, code, n) + structs[n].pack(*values)
+    except (AttributeError, TypeError, ValueError, struct.error):
+        return None
+    return b"".join([head, *tails])
+
+## @brief Kodiert ein Paket, binär wenn gewünscht und möglich, sonst als JSON.
+#  @param cmd Paket als Liste
+#  @param binary True, wenn der Empfänger das Binärformat unterstützt
+#  @return Bytes
+def encode(cmd, binary=False):
+    if binary:
+        packet = encode_binary(cmd)
+        if packet is not None:
+            return packet
+    return encode_json(cmd)
+
+## @brief Dekodiert ein Datagramm (JSON oder binär).
+#  @param data Empfangene Bytes
+#  @return Paket als Liste; Bytes-Felder binärer Pakete als bytes
+#  @throws ValueError bei ungültigen Daten
+def decode(data):
+    if not data or data[0] != MAGIC:
+        return json.loads(bytes(data).decode())
+    try:
+        _, code, n = _HEAD.unpack_from(data)
+        name, kinds, structs = _BY_CODE[code]
+        values = structs[n].unpack_from(data, _HEAD.size)
+    except (KeyError, IndexError, struct.error) as e:
+        raise ValueError(f"Ungültiges Binärpaket: {e}") from None
+    pos = _HEAD.size + structs[n].size
+    msg = [name]
+    vi = 0
+    for kind in kinds[:n]:
+        if kind == "U":
+            msg.append(bytes(data[pos:pos + 16]).hex())
+            pos += 16
+            continue
+        value = values[vi]
+        vi += 1
+        if kind in "HI":
+            msg.append(value)
+            continue
+        chunk = data[pos:pos + value]
+        if len(chunk) != value:
+            raise ValueError("Binärpaket abgeschnitten")
+        pos += value
+        msg.append(bytes(chunk).decode() if kind in "sS" else bytes(chunk))
+    return msg
+
+## @brief Liefert Bytes-Nutzdaten unabhängig vom Format.
+#  @details JSON-Pakete enthalten base64-Text, Binärpakete rohe Bytes.
+#  @param value Feldinhalt
+#  @return bytes
+def payload_bytes(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    return base64.b64decode(value)
@@ -1,15 +1,23 @@
 ## @file main.py
 #  @brief Einstiegspunkt für das BSRN-Chatprogramm.
 #  @details Initialisiert Konfiguration, Prüft auf Discovery-Prozess, startet CLI und Netzwerk-Komponenten.
+#           Aufruf mit --startup-profile gibt die Startzeit nach Phasen aus.
+import time
+_START = time.perf_counter()
+
 import os
 import sys
 import toml
 import tempfile
 import signal
 from multiprocessing import Process, Queue
-from core.cli import CLI
 from core.network import Network
 from core.discovery import Discovery
+from core.peer_table import PeerTable
+from core.history import history_path
+from core.netinfo import local_ip
+from core.startup import StartupProfile
+from core.profiling import run_profiled
 
 CONFIG_PATH = "config/config.toml"
 LOCKFILE_NAME = "discovery_{port}.lock"
@@ -64,10 +72,29 @@ def check_discovery_alive(lockfile_path):
         os.remove(lockfile_path)
         return False
 
+## @brief Erzeugt Discovery im Kindprozess und startet die Hauptschleife.
+#  @details Bildspeicher und Verlauf werden so parallel zum Start der Oberfläche geladen.
+#           Mit BSRN_PROFILE bzw. "profile" läuft die Hauptschleife unter dem Profiler.
+def run_discovery(*args, **kwargs):
+    run_profiled("discovery", Discovery(*args, **kwargs).run, kwargs.get("config"))
+
+## @brief Erzeugt Network im Kindprozess und startet die Hauptschleife.
+def run_network(*args):
+    net = Network(*args)
+    run_profiled("network", net.run, net.config)
+
 ## @brief Startet CLI, Netzwerk und optional Discovery-Prozess.
 def main():
+    profile = StartupProfile("--startup-profile" in sys.argv[1:], _START)
+    profile.mark("Module laden")
     config = load_config()
+    profile.mark("Konfiguration laden")
     prompt_missing_config(config)
+    profile.mark("Konfiguration abfragen", user=True)
+
+    # Schnittstelle einmal prüfen, Kindprozesse erhalten das Ergebnis über config
+    config["local_ip"] = local_ip(config)
+    profile.mark("IP-Adresse ermitteln")
 
     handle = config["handle"]
     port = config["port"]
@@ -78,6 +105,12 @@ def main():
     net_to_cli = Queue()
     cli_to_disc = Queue()
     disc_to_cli = Queue()
+    # Eigene Antwortkanäle für Adressabfragen (GET_QUEUE mit Request-ID)
+    disc_to_net_lookup = Queue()
+    disc_to_ui_lookup = Queue()
+    # Teilnehmertabelle im Shared Memory: Discovery schreibt, alle anderen lesen ohne IPC
+    peer_table = PeerTable.create(config.get("peer_table_size", 4096))
+    profile.mark("Queues und Shared Memory")
 
     # Discovery vorbereiten
     lockfile_path = get_lockfile_path(port)
@@ -85,27 +118,40 @@ def main():
     if not check_discovery_alive(lockfile_path):
         with open(lockfile_path, "w") as f:
             f.write(str(os.getpid()))
-        disc = Discovery(cli_to_disc, disc_to_cli, config['imagepath'])
-        p_disc = Process(target=disc.run, name="Discovery")
+        p_disc = Process(target=run_discovery, name="Discovery",
+                         args=(cli_to_disc, disc_to_cli, config['imagepath']),
+                         kwargs={"reply_queues": {"net": disc_to_net_lookup, "ui": disc_to_ui_lookup},
+                                 "config": config, "peer_table": peer_table})
         p_disc.start()
 
-    # Network vorbereiten
-    net = Network(handle, port, cli_to_net, net_to_cli, cli_to_disc, disc_to_cli, config)
-    p_net = Process(target=Network.run, args=(net,), name="Network")
+    # Network startet parallel; beide Prozesse initialisieren sich, während hier die Oberfläche lädt
+    p_net = Process(target=run_network, name="Network",
+                    args=(handle, port, cli_to_net, net_to_cli, cli_to_disc, disc_to_cli, config,
+                          disc_to_net_lookup, peer_table))
     p_net.start()
+    profile.mark("Prozesse starten")
 
     # Auswahlmenü für CLI oder GUI
     print("Starte Chat:")
     print("1) CLI")
     print("2) GUI")
     auswahl = input("Bitte wähle 1 oder 2: ").strip()
+    profile.mark("Auswahl CLI/GUI", user=True)
+
+    def ready():
+        profile.mark("Oberfläche bis Eingabezeile")
+        profile.report()
+
+    # prompt_toolkit, prettytable und tkinter werden erst hier bzw. bei Bedarf geladen
     if auswahl == "2":
         from core.gui import GUI
-        gui = GUI(cli_to_net, net_to_cli, handle, cli_to_disc, disc_to_cli)
-        gui.run()
+        gui = GUI(cli_to_net, net_to_cli, handle, cli_to_disc, disc_to_cli, disc_to_ui_lookup, peer_table,
+                  history_path(config))
+        run_profiled("gui", lambda: gui.run(on_ready=ready), config)
     else:
-        cli = CLI(handle, cli_to_net, cli_to_disc, net_to_cli, disc_to_cli, config)
-        cli.run()
+        from core.cli import CLI
+        cli = CLI(handle, cli_to_net, cli_to_disc, net_to_cli, disc_to_cli, config, disc_to_ui_lookup, peer_table)
+        run_profiled("cli", lambda: cli.run(on_ready=ready), config)
 
     # Prozesse beenden
     p_net.terminate()
@@ -115,6 +161,8 @@ def main():
         if os.path.exists(lockfile_path):
             os.remove(lockfile_path)
 
+    peer_table.close()
+
 if __name__ == "__main__":
     main()
 